@@ -1,3 +1,4 @@
+import click
 from flask import Flask, flash, request
 import os
 import logging
@@ -5,6 +6,14 @@ from logging.handlers import RotatingFileHandler
 from logging import Formatter
 from app.extensions import db, login, bcrypt, scheduler
 
+def running_cli_command():
+    """True when the app was loaded for a `flask` command other than `flask run`"""
+    if os.environ.get('FLASK_RUN_FROM_CLI') != 'true':
+        return False
+    # `flask run` loads the app inside its own command, or lazily in a server thread
+    ctx = click.get_current_context(silent=True)
+    return ctx is not None and ctx.info_name != 'run'
+
 def create_app(config_name='default'):
     """Application factory function to create and configure Flask app"""
     app = Flask(__name__)
@@ -77,8 +86,24 @@ def create_app(config_name='default'):
     app.register_blueprint(api_bp)
     app.register_blueprint(errors_bp)
     
+    # Register CLI commands
+    from app.commands import register_commands
+    register_commands(app)
+    
     # Initialize app context specific extensions
     with app.app_context():
+        # Apply the SQLite connection profile and report what the database actually uses
+        from app.extensions import configure_sqlite, sqlite_pragma_report
+        configure_sqlite(db.engine, app.config.get('SQLITE_PRAGMAS'))
+        pragmas = sqlite_pragma_report(db.engine)
+        if pragmas:
+            app.logger.info('SQLite pragmas: ' + ', '.join(f'{name}={value}' for name, value in pragmas.items()))
+        
+        # Only server processes work through the job queue
+        if not app.config.get('JOB_WORKER_ENABLED', True) or running_cli_command():
+            if scheduler.get_job('job_worker'):
+                scheduler.remove_job('job_worker')
+        
         # Start scheduler
         if not scheduler.running:
             scheduler.start()
@@ -92,12 +117,21 @@ def create_app(config_name='default'):
         
         app.before_first_request(init_app_data)
         
-        # Make projects available to all templates
+        # Make projects available to all templates, from the cached catalog
         @app.context_processor
         def inject_projects():
-            from app.models.project import Project
-            projects = Project.query.all()
-            return dict(projects=projects)
+            from app.utils.project_catalog import get_projects
+            return dict(projects=get_projects())
+    
+    # Route list, search and dashboard reads to the read replica, if configured
+    from app.utils.replica import init_replica
+    init_replica(app)
+    
+    # Pick up a database restored by another worker process
+    @app.before_request
+    def check_database_generation():
+        from app.utils.restore import check_generation
+        check_generation()
     
     # Add no-cache headers for JS files to prevent caching issues
     @app.after_request
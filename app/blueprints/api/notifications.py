@@ -1,44 +1,112 @@
-from flask import jsonify, current_app
+from flask import jsonify, current_app, request, Response, stream_with_context
 from flask_login import current_user, login_required
+from sqlalchemy import func, case
 from app.models.notification import Notification
+from app.utils.notification_events import subscribe, unsubscribe, publish
+from app.utils.http_cache import conditional_response
+from app.utils.versions import bump_version
 from app import db
 from datetime import datetime
+import json
+import time
 from . import api_bp
 
+# Seconds between keepalive comments on an idle stream; each one also re-checks
+# the database. Changes from other processes arrive sooner, through the shared
+# notifications version (see app.utils.notification_events).
+STREAM_HEARTBEAT = 25
+
+# Streams are closed after this many seconds and the browser reconnects,
+# so a worker thread is never held by one tab indefinitely
+STREAM_MAX_AGE = 300
+
+# Reconnect delay sent to the browser, in milliseconds
+STREAM_RETRY = 3000
+
+def notification_signature(user_id):
+    """
+    Cheap fingerprint of a user's notifications that changes whenever the
+    list or the unread count would. Used as the ETag and the stream event id.
+    """
+    total, last_id, unread = db.session.query(
+        func.count(Notification.id),
+        func.max(Notification.id),
+        func.sum(case((Notification.read == False, 1), else_=0))
+    ).filter(Notification.user_id == user_id).one()
+    return f"{total}.{last_id or 0}.{unread or 0}"
+
+def notification_snapshot(user_id):
+    """Latest notifications and unread count for a user"""
+    # Get notifications for user, ordered by creation date descending
+    notifications = Notification.query.filter_by(user_id=user_id)\
+        .order_by(Notification.created_at.desc())\
+        .limit(10)\
+        .all()
+    
+    # Count unread notifications for user
+    unread_count = Notification.query.filter_by(user_id=user_id, read=False).count()
+    
+    return {
+        'notifications': [n.to_dict() for n in notifications],
+        'unreadCount': unread_count
+    }
+
 @api_bp.route('/notifications')
 @login_required
 def get_notifications():
     """Get notifications for the current user"""
     try:
-        # Get notifications for current user, ordered by creation date descending
-        notifications = Notification.query.filter_by(user_id=current_user.id)\
-            .order_by(Notification.created_at.desc())\
-            .limit(10)\
-            .all()
-        
-        # Count unread notifications for current user
-        unread_count = Notification.query.filter_by(user_id=current_user.id, read=False).count()
-        
-        # Format notifications for response
-        formatted_notifications = [{
-            'id': n.id,
-            'title': n.title,
-            'message': n.message,
-            'icon': n.icon,
-            'icon_color': n.icon_color,
-            'link': n.link,
-            'read': n.read,
-            'created_at': n.created_at.isoformat()
-        } for n in notifications]
-        
-        return jsonify({
-            'notifications': formatted_notifications,
-            'unreadCount': unread_count
-        })
+        # Answer conditional requests from the fetch cache without loading the list
+        return conditional_response(
+            notification_signature(current_user.id),
+            lambda: jsonify(notification_snapshot(current_user.id))
+        )
     except Exception as e:
         current_app.logger.error(f'Error fetching notifications: {str(e)}')
         return jsonify({'error': 'Failed to fetch notifications'}), 500
 
+@api_bp.route('/notifications/stream')
+@login_required
+def notification_stream():
+    """Server-sent event stream of the current user's notifications"""
+    if not current_app.config.get('NOTIFICATION_STREAM_ENABLED', False):
+        # Browsers stop reconnecting on 204 and the page falls back to polling
+        return Response(status=204)
+    
+    user_id = current_user.id
+    last_sent = request.headers.get('Last-Event-ID')
+    
+    def generate():
+        changed = subscribe(user_id, current_app._get_current_object())
+        sent = last_sent
+        deadline = time.monotonic() + STREAM_MAX_AGE
+        try:
+            yield f"retry: {STREAM_RETRY}\n\n"
+            while True:
+                signature = notification_signature(user_id)
+                if signature != sent:
+                    data = json.dumps(notification_snapshot(user_id))
+                    sent = signature
+                    yield f"id: {signature}\nevent: notifications\ndata: {data}\n\n"
+                # Don't hold a database transaction open while idle
+                db.session.remove()
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if not changed.wait(min(STREAM_HEARTBEAT, remaining)):
+                    yield ": keepalive\n\n"
+                changed.clear()
+        finally:
+            unsubscribe(user_id, changed)
+            db.session.remove()
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @api_bp.route('/notifications/<int:notification_id>/read', methods=['POST'])
 @login_required
 def mark_notification_read(notification_id):
@@ -49,6 +117,7 @@ def mark_notification_read(notification_id):
         
         notification.read = True
         db.session.commit()
+        publish([current_user.id])
         
         return jsonify({'message': 'Notification marked as read'})
     except Exception as e:
@@ -64,7 +133,9 @@ def mark_all_read():
         # Update only notifications belonging to current user
         Notification.query.filter_by(user_id=current_user.id, read=False)\
             .update({Notification.read: True})
+        bump_version('notifications')
         db.session.commit()
+        publish([current_user.id])
         
         return jsonify({'message': 'All notifications marked as read'})
     except Exception as e:
@@ -79,7 +150,9 @@ def clear_all_notifications():
     try:
         # Delete only notifications belonging to current user
         Notification.query.filter_by(user_id=current_user.id).delete()
+        bump_version('notifications')
         db.session.commit()
+        publish([current_user.id])
         
         return jsonify({'message': 'All notifications cleared'})
     except Exception as e:
@@ -5,29 +5,37 @@ from app.blueprints.api import api_bp
 from app.models.user import User
 from app.utils.access import head_office_admin_required
 from app.models.project import Project
+from app.utils.versions import get_versions
+from app.utils.project_catalog import get_projects as get_catalog_projects
+from app.utils.http_cache import conditional_response
+from sqlalchemy.orm import joinedload
 from datetime import datetime
 
 @api_bp.route('/users', methods=['GET'])
 @login_required
 @head_office_admin_required
 def get_users():
-    users = User.query.all()
-    user_list = []
-    
-    for user in users:
-        user_data = {
-            'id': user.id,
-            'username': user.username,
-            'email': user.email,
-            'is_active': user.is_active,
-            'is_admin': user.is_admin,
-            'is_head_office': user.is_head_office,
-            'project_id': user.project_id,
-            'created_at': user.created_at.strftime('%Y-%m-%d %H:%M')
-        }
-        user_list.append(user_data)
+    def build():
+        users = User.query.options(joinedload(User.project)).all()
+        user_list = []
+        
+        for user in users:
+            user_data = {
+                'id': user.id,
+                'username': user.username,
+                'email': user.email,
+                'is_active': user.is_active,
+                'is_admin': user.is_admin,
+                'is_head_office': user.is_head_office,
+                'project_id': user.project_id,
+                'created_at': user.created_at.strftime('%Y-%m-%d %H:%M')
+            }
+            user_list.append(user_data)
+        
+        return jsonify({'success': True, 'users': user_list})
     
-    return jsonify({'success': True, 'users': user_list})
+    # The list only changes when a user or a project (for is_head_office) does
+    return conditional_response(f'users-{get_versions("users", "projects")}', build)
 
 @api_bp.route('/users/<int:user_id>', methods=['GET'])
 @login_required
@@ -192,7 +200,7 @@ def delete_user(user_id):
 @login_required
 @head_office_admin_required
 def get_projects():
-    projects = Project.query.all()
+    projects = get_catalog_projects()
     project_list = []
     
     for project in projects:
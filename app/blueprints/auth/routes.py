@@ -3,7 +3,7 @@ from flask_login import login_user, logout_user, current_user, login_required
 from app import db
 from app.blueprints.auth import auth_bp
 from app.models.user import User
-from app.models.project import Project
+from app.utils.project_catalog import get_projects
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -38,11 +38,7 @@ def login():
         return redirect(next_page)
     
     # Get projects for dropdown - head office first
-    projects = Project.query.filter_by(is_head_office=True).all()
-    
-    # Add other projects
-    other_projects = Project.query.filter_by(is_head_office=False).all()
-    projects.extend(other_projects)
+    projects = get_projects(head_office_first=True)
     
     return render_template('login.html', projects=projects)
 
@@ -115,5 +111,5 @@ def register():
         return redirect(url_for('auth.login'))
     
     # Get all projects for dropdown
-    projects = Project.query.all()
+    projects = get_projects()
     return render_template('register.html', projects=projects) 
\ No newline at end of file
@@ -1,13 +1,21 @@
 from flask import render_template, redirect, url_for, flash, request, jsonify, send_from_directory, current_app, make_response
 from flask_login import login_required, current_user
+from werkzeug.utils import secure_filename
 import os
-import shutil
 from datetime import datetime
 from app import db
 from app.blueprints.database import database_bp
-from app.models import Setting
 from app.utils.access import head_office_admin_required
-from app.utils.database import auto_backup_database
+from app.utils.database import cleanup_old_auto_backups
+from app.utils.backups import (
+    start_backup, read_backup_status, is_backup_file, get_backup_backend,
+    delete_backup as delete_backup_files, BackupError
+)
+from app.utils.restore import restore_backup, restore_database_file, RestoreError
+from app.utils.jobs import queue_stats
+from app.utils.letter_import import start_import, list_imports, import_errors_path, LetterImportError
+from app.utils.http_cache import not_modified, tag_response
+from app.utils.settings import get_setting, set_setting
 
 @database_bp.route('/utilities')
 @login_required
@@ -47,8 +55,8 @@ def utilities():
             return redirect(url_for('database.utilities', tab='backups'))
     
     # Get auto backup settings
-    auto_backup_enabled = Setting.get('auto_backup_enabled', False)
-    auto_backup_keep_count = Setting.get('auto_backup_keep_count', 5)
+    auto_backup_enabled = get_setting('auto_backup_enabled')
+    auto_backup_keep_count = get_setting('auto_backup_keep_count')
     
     # Check if we need to load the backups for the backups tab
     backups = None
@@ -61,9 +69,15 @@ def utilities():
             current_app.logger.error(f"Error loading backups for utilities page: {str(e)}")
             flash(f"Error loading backups: {str(e)}", "danger")
     
+    job_stats = queue_stats() if selected_tab == 'jobs' else None
+    imports = list_imports() if selected_tab == 'import' else None
+    
     return render_template('database_utilities.html', 
                            selected_tab=selected_tab,
                            backups=backups,
+                           job_stats=job_stats,
+                           imports=imports,
+                           backup_status=read_backup_status(),
                            auto_backup_enabled=auto_backup_enabled,
                            auto_backup_keep_count=auto_backup_keep_count)
 
@@ -77,7 +91,7 @@ def get_backups_list():
         
         files = []
         for filename in os.listdir(backups_dir):
-            if filename.endswith('.db'):
+            if is_backup_file(filename):
                 file_path = os.path.join(backups_dir, filename)
                 file_stats = os.stat(file_path)
                 
@@ -106,38 +120,9 @@ def get_backups_list():
 # Helper function to restore database from file
 def restore_database_from_file(filename):
     try:
-        if not filename.endswith('.db'):
-            return {'success': False, 'error': 'Invalid file format. Only .db files are allowed.'}
-        
-        backup_file_path = os.path.join(current_app.root_path, 'backups', filename)
-        
-        if not os.path.exists(backup_file_path):
-            return {'success': False, 'error': f'Backup file not found: {filename}'}
-        
-        database_path = os.path.join(current_app.root_path, current_app.config['DATABASE_PATH'])
-        
-        # Make sure the destination directory exists
-        os.makedirs(os.path.dirname(database_path), exist_ok=True)
-        
-        # Create a temporary backup of the current database
-        import shutil
-        import datetime
-        
-        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        temp_backup_path = os.path.join(current_app.root_path, 'backups', f'pre_restore_{timestamp}.db')
-        
-        try:
-            if os.path.exists(database_path):
-                shutil.copy2(database_path, temp_backup_path)
-                current_app.logger.info(f"Created pre-restore backup at {temp_backup_path}")
-        except Exception as e:
-            current_app.logger.warning(f"Could not create pre-restore backup: {str(e)}")
-        
-        # Copy the backup file to the database location
-        shutil.copy2(backup_file_path, database_path)
-        current_app.logger.info(f"Restored database from {backup_file_path} to {database_path}")
-        
-        return {'success': True}
+        pre_restore_backup = restore_backup(filename)
+        current_app.logger.info(f"Restored database from backup {filename} (previous state saved as {pre_restore_backup})")
+        return {'success': True, 'pre_restore_backup': pre_restore_backup}
     
     except Exception as e:
         current_app.logger.error(f"Error restoring database: {str(e)}")
@@ -146,20 +131,8 @@ def restore_database_from_file(filename):
 # Helper function to delete backup file
 def delete_backup_file(filename):
     try:
-        if not filename.endswith('.db'):
-            return {'success': False, 'error': 'Invalid file format. Only .db files are allowed.'}
-        
-        # Make sure filename doesn't have path traversal
-        if os.path.sep in filename or (os.path.altsep and os.path.altsep in filename):
-            return {'success': False, 'error': 'Invalid filename'}
-        
-        backup_file_path = os.path.join(current_app.root_path, 'backups', filename)
-        
-        if not os.path.exists(backup_file_path):
-            return {'success': False, 'error': f'Backup file not found: {filename}'}
-        
-        os.remove(backup_file_path)
-        current_app.logger.info(f"Deleted backup file: {backup_file_path}")
+        delete_backup_files(filename)
+        current_app.logger.info(f"Deleted backup file: {filename}")
         
         return {'success': True}
     
@@ -190,6 +163,12 @@ document.addEventListener('DOMContentLoaded', function() {
             case 'settings':
                 tabButton = document.getElementById('settings-tab');
                 break;
+            case 'jobs':
+                tabButton = document.getElementById('jobs-tab');
+                break;
+            case 'import':
+                tabButton = document.getElementById('import-tab');
+                break;
             default:
                 tabButton = null;
         }
@@ -265,76 +244,44 @@ def backup_database():
         # Just a regular form submission without backup request
         return redirect(url_for('database.utilities'))
         
+    is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
     try:
-        # Create backups directory if it doesn't exist
-        backup_dir = os.path.join(current_app.root_path, 'backups')
-        if not os.path.exists(backup_dir):
-            os.makedirs(backup_dir)
-            current_app.logger.info(f"Created backups directory: {backup_dir}")
-            
-        current_app.logger.info(f"Using backups directory: {backup_dir}")
-        
-        # Generate backup file name with date and time
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        db_uri = current_app.config['SQLALCHEMY_DATABASE_URI']
-        
-        # Extract database path - handle both relative and absolute paths
-        if db_uri.startswith('sqlite:///'):
-            if db_uri[10:].startswith('/'):
-                # Absolute path
-                db_path = db_uri[10:]
-            else:
-                # Relative path
-                db_path = os.path.join(current_app.root_path, db_uri[10:])
-                
-            current_app.logger.info(f"Database path: {db_path}")
-        else:
-            current_app.logger.error(f"Unsupported database type: {db_uri}")
-            flash('Only SQLite databases are supported for backup', 'error')
-            return redirect(url_for('database.utilities'))
-        
-        if not os.path.exists(db_path):
-            current_app.logger.error(f"Database file not found: {db_path}")
-            flash(f'Database file not found at path: {db_path}', 'error')
-            return redirect(url_for('database.utilities'))
-            
-        # Create backup filename
-        db_name = os.path.basename(db_path)
-        backup_filename = f'{db_name}_{timestamp}.db'
-        backup_path = os.path.join(backup_dir, backup_filename)
+        # The copy runs in a background thread; progress is polled from /database/backup/status
+        backup_filename = start_backup()
+        current_app.logger.info(f"Started backup: {backup_filename}")
         
-        current_app.logger.info(f"Creating backup at: {backup_path}")
-        
-        # Check if this exact backup already exists (to prevent duplicates)
-        if os.path.exists(backup_path):
-            current_app.logger.info(f"Backup already exists: {backup_path}")
-            flash('This backup already exists', 'info')
-            return redirect(url_for('database.utilities'))
-        
-        # Copy the database file
-        try:
-            shutil.copy2(db_path, backup_path)
-            current_app.logger.info(f"Backup created successfully: {backup_path}")
-            
-            # Verify the backup was created
-            if os.path.exists(backup_path):
-                current_app.logger.info(f"Backup file verification successful: {os.path.getsize(backup_path)} bytes")
-            else:
-                current_app.logger.error(f"Backup file not found after creation: {backup_path}")
-                flash('Backup was created but the file could not be verified', 'warning')
-                return redirect(url_for('database.utilities'))
-        except Exception as copy_error:
-            current_app.logger.error(f"Error copying database: {str(copy_error)}")
-            flash(f'Error copying database file: {str(copy_error)}', 'error')
-            return redirect(url_for('database.utilities'))
-        
-        flash('Database backup created successfully', 'success')
+        if is_ajax:
+            return jsonify({
+                'success': True,
+                'message': 'Backup started',
+                'filename': backup_filename,
+                'status_url': url_for('database.backup_status')
+            }), 202
+        flash('Database backup started. It will appear under Previous Backups when complete.', 'info')
+        return redirect(url_for('database.utilities'))
+    except BackupError as e:
+        current_app.logger.warning(f"Backup not started: {str(e)}")
+        if is_ajax:
+            return jsonify({'success': False, 'error': str(e)}), 409
+        flash(str(e), 'error')
         return redirect(url_for('database.utilities'))
     except Exception as e:
         current_app.logger.error(f"Error creating backup: {str(e)}")
+        if is_ajax:
+            return jsonify({'success': False, 'error': str(e)}), 500
         flash(f'Error creating backup: {str(e)}', 'error')
         return redirect(url_for('database.utilities'))
 
+@database_bp.route('/backup/status', methods=['GET'])
+@login_required
+@head_office_admin_required
+def backup_status():
+    """Progress of the current or most recent backup"""
+    return jsonify({
+        'success': True,
+        'backup': read_backup_status()
+    })
+
 @database_bp.route('/backups', methods=['GET'])
 @login_required
 @head_office_admin_required
@@ -349,6 +296,16 @@ def list_backups():
         # Get absolute backups directory path
         abs_backup_dir = os.path.abspath(backup_dir)
         
+        # The directory's mtime changes whenever a backup is added or removed, so
+        # polling clients can revalidate without the directory being listed
+        is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+        backups_etag = f"backups-{os.stat(abs_backup_dir).st_mtime_ns}"
+        if is_ajax:
+            unchanged = not_modified(backups_etag)
+            if unchanged:
+                unchanged.headers['Vary'] = 'X-Requested-With'
+                return unchanged
+        
         # Log for debugging
         current_app.logger.info(f"Looking for backups in: {abs_backup_dir}")
         
@@ -361,7 +318,7 @@ def list_backups():
             current_app.logger.info(f"Found {len(files_in_dir)} files in backup directory: {files_in_dir}")
             
             for filename in files_in_dir:
-                if not filename.endswith('.db'):
+                if not is_backup_file(filename):
                     continue
                     
                 abs_path = os.path.join(abs_backup_dir, filename)
@@ -385,16 +342,13 @@ def list_backups():
         
         current_app.logger.info(f"Returning {len(backup_files)} backups")
         
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            # Set specific JSON content type and ensure no caching
+        if is_ajax:
+            # Cached by the browser, but revalidated against the ETag on every request
             response = jsonify({'success': True, 'backups': backup_files})
-            response.headers['Content-Type'] = 'application/json'
-            response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-            response.headers['Pragma'] = 'no-cache'
-            response.headers['Expires'] = '0'
-            return response
+            response.headers['Vary'] = 'X-Requested-With'
+            return tag_response(response, backups_etag)
         
-        return render_template('database_utilities.html', backups=backup_files)
+        return render_template('database_utilities.html', backups=backup_files, backup_status=read_backup_status())
     except Exception as e:
         current_app.logger.error(f"Error listing backups: {str(e)}")
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -412,8 +366,8 @@ def download_backup(filename):
         flash('Invalid backup filename.', 'error')
         return redirect(url_for('database.utilities'))
         
-    # Ensure file has .db extension
-    if not filename.endswith('.db'):
+    # Ensure file is a backup
+    if not is_backup_file(filename):
         flash('Invalid backup file format.', 'error')
         return redirect(url_for('database.utilities'))
         
@@ -446,9 +400,10 @@ def restore_database():
                 flash('No file selected', 'error')
                 return redirect(url_for('database.utilities'))
                 
-            # Validate filename
-            if not uploaded_file.filename.endswith('.db'):
-                flash('Invalid file format. Only .db files are allowed.', 'error')
+            # Validate filename against what the database backend can restore
+            extensions = get_backup_backend().upload_extensions
+            if not uploaded_file.filename.endswith(extensions):
+                flash(f"Invalid file format. Only {', '.join(extensions)} files are allowed.", 'error')
                 return redirect(url_for('database.utilities'))
                 
             # Create temp directory for uploaded files if it doesn't exist
@@ -458,100 +413,35 @@ def restore_database():
                 
             # Save uploaded file
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            safe_filename = f"uploaded_{timestamp}_{uploaded_file.filename}"
+            safe_filename = f"uploaded_{timestamp}_{secure_filename(uploaded_file.filename)}"
             temp_path = os.path.join(temp_dir, safe_filename)
             uploaded_file.save(temp_path)
             
-            # Get current database path
-            db_uri = current_app.config['SQLALCHEMY_DATABASE_URI']
-            
-            # Extract database path
-            if not db_uri.startswith('sqlite:///'):
-                flash('Only SQLite databases are supported for restore', 'error')
-                return redirect(url_for('database.utilities'))
-                
-            if db_uri[10:].startswith('/'):
-                db_path = db_uri[10:]
-            else:
-                db_path = os.path.join(current_app.root_path, db_uri[10:])
-            
-            # Create backups directory if it doesn't exist
-            backup_dir = os.path.join(current_app.root_path, 'backups')
-            if not os.path.exists(backup_dir):
-                os.makedirs(backup_dir)
-                
-            # Create a backup of the current database before restoring
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            db_name = os.path.basename(db_path)
-            pre_restore_backup = f'pre_restore_{db_name}_{timestamp}.db'
-            pre_restore_path = os.path.join(backup_dir, pre_restore_backup)
-            
-            # Copy current database to pre-restore backup
-            shutil.copy2(db_path, pre_restore_path)
-            
-            # Close database connection
-            db.session.close()
-            db.engine.dispose()
-            
-            # Copy uploaded file to database location
-            shutil.copy2(temp_path, db_path)
-            
-            # Clean up temp file
-            os.remove(temp_path)
+            try:
+                restore_database_file(temp_path)
+            finally:
+                # Clean up temp file
+                os.remove(temp_path)
             
-            flash('Database restored successfully. Please restart the application.', 'success')
+            flash('Database restored successfully', 'success')
             return redirect(url_for('database.utilities'))
         else:
             # Handle regular form submission with filename
             filename = request.form.get('filename')
             
             # Validate filename
-            if not filename or '..' in filename or '/' in filename or '\\' in filename:
+            if not is_backup_file(filename):
                 flash('Invalid backup filename.', 'error')
                 return redirect(url_for('database.utilities'))
             
-            # Get paths
-            backup_dir = os.path.join(current_app.root_path, 'backups')
-            backup_path = os.path.join(backup_dir, filename)
-            
-            # Check if backup file exists
-            if not os.path.exists(backup_path):
-                flash('Backup file not found.', 'error')
-                return redirect(url_for('database.utilities'))
-            
-            # Get current database path
-            db_uri = current_app.config['SQLALCHEMY_DATABASE_URI']
+            restore_backup(filename)
             
-            # Extract database path - handle both relative and absolute paths
-            if db_uri.startswith('sqlite:///'):
-                if db_uri[10:].startswith('/'):
-                    # Absolute path
-                    db_path = db_uri[10:]
-                else:
-                    # Relative path
-                    db_path = os.path.join(current_app.root_path, db_uri[10:])
-            else:
-                flash('Only SQLite databases are supported for restore', 'error')
-                return redirect(url_for('database.utilities'))
-            
-            # Create a backup of the current database before restoring
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            db_name = os.path.basename(db_path)
-            pre_restore_backup = f'pre_restore_{db_name}_{timestamp}.db'
-            pre_restore_path = os.path.join(backup_dir, pre_restore_backup)
-            
-            # Copy current database to pre-restore backup
-            shutil.copy2(db_path, pre_restore_path)
-            
-            # Close database connection
-            db.session.close()
-            db.engine.dispose()
-            
-            # Copy backup to current database
-            shutil.copy2(backup_path, db_path)
-            
-            flash('Database restored successfully. Please restart the application.', 'success')
+            flash('Database restored successfully', 'success')
             return redirect(url_for('database.utilities'))
+    except (RestoreError, BackupError) as e:
+        current_app.logger.warning(f"Restore rejected: {str(e)}")
+        flash(f'Error restoring database: {str(e)}', 'error')
+        return redirect(url_for('database.utilities'))
     except Exception as e:
         current_app.logger.error(f"Error restoring database: {str(e)}")
         flash(f'Error restoring database: {str(e)}', 'error')
@@ -570,7 +460,7 @@ def get_settings():
         for key in keys:
             if key.strip():
                 settings[key.strip()] = {
-                    'value': Setting.get(key.strip())
+                    'value': get_setting(key.strip())
                 }
         
         return jsonify({
@@ -598,9 +488,10 @@ def update_settings():
             auto_backup_enabled = request.form.get('auto_backup_enabled', 'false') == 'true'
             auto_backup_keep_count = int(request.form.get('auto_backup_keep_count', 5))
         
-        # Update settings
-        Setting.set('auto_backup_enabled', str(auto_backup_enabled).lower(), 'Enable automatic weekly database backups')
-        Setting.set('auto_backup_keep_count', str(auto_backup_keep_count), 'Number of automatic backups to keep')
+        # Update settings in one transaction
+        set_setting('auto_backup_enabled', auto_backup_enabled, commit=False)
+        set_setting('auto_backup_keep_count', auto_backup_keep_count, commit=False)
+        db.session.commit()
         
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return jsonify({
@@ -611,6 +502,7 @@ def update_settings():
         flash('Database settings updated successfully', 'success')
         return redirect(url_for('database.utilities'))
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Error updating database settings: {str(e)}")
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return jsonify({
@@ -620,14 +512,33 @@ def update_settings():
         flash(f'Error updating database settings: {str(e)}', 'error')
         return redirect(url_for('database.utilities'))
 
+@database_bp.route('/jobs', methods=['GET'])
+@login_required
+@head_office_admin_required
+def job_queue_status():
+    """Background job queue depth and latency"""
+    try:
+        return jsonify({
+            'success': True,
+            'jobs': queue_stats()
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error getting job queue status: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
 @database_bp.route('/manual-backup')
 @login_required
 @head_office_admin_required
 def manual_auto_backup():
     """Trigger the auto backup process manually"""
     try:
-        auto_backup_database()
-        flash('Manual backup completed successfully', 'success')
+        start_backup(prefix='auto_', on_success=lambda filename: cleanup_old_auto_backups())
+        flash('Automatic backup started. It will appear under Previous Backups when complete.', 'info')
+    except BackupError as e:
+        flash(str(e), 'error')
     except Exception as e:
         current_app.logger.error(f"Error during manual backup: {str(e)}")
         flash(f'Error creating manual backup: {str(e)}', 'error')
@@ -671,48 +582,19 @@ def restore_from_backup():
         filename = data.get('filename')
         
         # Validate filename
-        if not filename or '..' in filename or '/' in filename or '\\' in filename:
+        if not is_backup_file(filename):
             return jsonify({'success': False, 'error': 'Invalid backup filename'})
         
-        # Get paths
-        backup_dir = os.path.join(current_app.root_path, 'backups')
-        backup_path = os.path.join(backup_dir, filename)
-        
-        # Check if backup file exists
-        if not os.path.exists(backup_path):
-            return jsonify({'success': False, 'error': 'Backup file not found'})
-        
-        # Get current database path
-        db_uri = current_app.config['SQLALCHEMY_DATABASE_URI']
-        
-        # Extract database path - handle both relative and absolute paths
-        if db_uri.startswith('sqlite:///'):
-            if db_uri[10:].startswith('/'):
-                # Absolute path
-                db_path = db_uri[10:]
-            else:
-                # Relative path
-                db_path = os.path.join(current_app.root_path, db_uri[10:])
-        else:
-            return jsonify({'success': False, 'error': 'Only SQLite databases are supported for restore'})
-        
-        # Create a backup of the current database before restoring
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        db_name = os.path.basename(db_path)
-        pre_restore_backup = f'pre_restore_{db_name}_{timestamp}.db'
-        pre_restore_path = os.path.join(backup_dir, pre_restore_backup)
-        
-        # Copy current database to pre-restore backup
-        shutil.copy2(db_path, pre_restore_path)
-        
-        # Close database connection
-        db.session.close()
-        db.engine.dispose()
+        pre_restore_backup = restore_backup(filename)
         
-        # Copy backup to current database
-        shutil.copy2(backup_path, db_path)
-        
-        return jsonify({'success': True, 'message': 'Database restored successfully. Please restart the application.'})
+        return jsonify({
+            'success': True,
+            'message': 'Database restored successfully',
+            'pre_restore_backup': pre_restore_backup
+        })
+    except (RestoreError, BackupError) as e:
+        current_app.logger.warning(f"Restore rejected: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)})
     except Exception as e:
         current_app.logger.error(f"Error restoring database: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
@@ -733,20 +615,7 @@ def delete_backup():
         if not filename or '..' in filename or '/' in filename or '\\' in filename:
             return jsonify({'success': False, 'error': 'Invalid backup filename'})
         
-        # Ensure file has .db extension
-        if not filename.endswith('.db'):
-            return jsonify({'success': False, 'error': 'Invalid backup file format'})
-            
-        # Get backup directory
-        backup_dir = os.path.join(current_app.root_path, 'backups')
-        file_path = os.path.join(backup_dir, filename)
-        
-        # Check if file exists
-        if not os.path.exists(file_path):
-            return jsonify({'success': False, 'error': 'Backup file not found'})
-            
-        # Delete file
-        os.remove(file_path)
+        delete_backup_files(filename)
         
         return jsonify({'success': True, 'message': 'Backup deleted successfully'})
     except Exception as e:
@@ -792,4 +661,41 @@ def api_database_delete_backup():
     # Set the X-Requested-With header to ensure proper JSON response
     if 'X-Requested-With' not in request.headers:
         request.environ['HTTP_X_REQUESTED_WITH'] = 'XMLHttpRequest'
-    return delete_backup() 
\ No newline at end of file
+    return delete_backup() 
+
+@database_bp.route('/import-letters', methods=['POST'])
+@login_required
+@head_office_admin_required
+def import_letters():
+    """Start importing letters from an uploaded CSV or XLSX register"""
+    register_file = request.files.get('register_file')
+    attachments_file = request.files.get('attachments_file')
+    if not register_file or not register_file.filename:
+        flash('No register file selected', 'error')
+        return redirect(url_for('database.utilities', tab='import'))
+    if attachments_file and attachments_file.filename and not attachments_file.filename.lower().endswith('.zip'):
+        flash('Attachments must be uploaded as a .zip archive', 'error')
+        return redirect(url_for('database.utilities', tab='import'))
+    
+    try:
+        start_import(register_file, attachments_file, user_id=current_user.id,
+                     link=url_for('database.utilities', tab='import'))
+        flash('Import started. You will get a notification when it finishes.', 'success')
+    except LetterImportError as e:
+        flash(str(e), 'error')
+    except Exception as e:
+        current_app.logger.error(f"Error starting letter import: {str(e)}")
+        flash(f'Error starting import: {str(e)}', 'error')
+    return redirect(url_for('database.utilities', tab='import'))
+
+@database_bp.route('/import-letters/<import_id>/errors')
+@login_required
+@head_office_admin_required
+def import_letters_errors(import_id):
+    """Download the rows an import rejected, as CSV"""
+    path = import_errors_path(import_id)
+    if path is None:
+        flash('No error report for this import', 'error')
+        return redirect(url_for('database.utilities', tab='import'))
+    return send_from_directory(os.path.dirname(path), os.path.basename(path), mimetype='text/csv',
+                               as_attachment=True, download_name=f'import_{import_id}_errors.csv')
@@ -1,41 +1,53 @@
-from flask import render_template, redirect, url_for, flash, request, jsonify, send_from_directory, current_app, abort
+from flask import (
+    render_template, redirect, url_for, flash, request, jsonify, send_from_directory, current_app, abort,
+    Response, stream_with_context, send_file
+)
 from flask_login import login_required, current_user
 import os
 from datetime import datetime
 from werkzeug.utils import secure_filename
-import uuid
+from sqlalchemy.orm import undefer_group
 from app import db
 from app.blueprints.letters import letters_bp
 from app.models.letter import Letter
-from app.models.project import Project
 from app.utils.access import get_user_project_id, project_query_filter, crud_permission_required
 from app.utils.database import allowed_file
-from app.utils.notifications import (
-    create_notification,
-    create_notification_for_all_admins,
-    create_notification_for_project_users,
-    create_notification_for_all_users
+from app.utils.blobstore import store_upload, acquire_blob, release_blob, send_blob, InvalidUploadError
+from app.utils.pagination import keyset_paginate, rank_paginate, get_page_size
+from app.utils.search import apply_letter_search
+from app.utils.letter_export import stream_export, export_filename, EXPORT_MIMETYPES
+from app.utils.letter_archive import archive_key, archive_filename, open_cached_archive, stream_archive
+from app.utils.http_cache import not_modified, tag_response
+from app.utils.numbering import (
+    HO_SCOPE,
+    MAX_NUMBER,
+    project_scope,
+    valid_number,
+    advance_to,
+    allocate_letter_numbers,
+    format_letter_number,
+    SequenceExhaustedError,
+    claim_reservation,
+    preview_letter_numbers,
+    reserve_letter_numbers
 )
+from app.utils.notifications import queue_notification
+from app.utils.jobs import enqueue_job
+from app.utils.previews import queue_preview, preview_exists, PREVIEW_SUFFIX
+from app.utils.project_catalog import get_projects, get_project, get_project_by_code
+from app.utils.replica import use_replica
 
-@letters_bp.route('/')
-@login_required
-def list_letters():
-    project_id = get_user_project_id()
-    
-    # Get filters
+def filter_letters(query):
+    """
+    Apply the letters list filters in the request args (type, project, year,
+    search) to a Letter query. Returns (query, rank) as apply_letter_search() does.
+    """
     is_incoming_param = request.args.get('is_incoming')
     filter_project_id = request.args.get('project_id')
     filter_project_code = request.args.get('project_code')
+    year = request.args.get('year', '')
     search_term = request.args.get('search', '')
     
-    # Determine letter type for template
-    letter_type = 'all'
-    if is_incoming_param is not None:
-        letter_type = 'incoming' if is_incoming_param.lower() == 'true' else 'outgoing'
-    
-    # Base query
-    query = Letter.query
-    
     # Filter by project (unless head office)
     query = project_query_filter(query, Letter)
     
@@ -48,37 +60,130 @@ def list_letters():
         query = query.filter_by(project_id=filter_project_id)
     elif filter_project_code:
         # Find project by code and filter by its ID
-        project = Project.query.filter_by(project_code=filter_project_code).first()
+        project = get_project_by_code(filter_project_code)
         if project:
             query = query.filter_by(project_id=project.id)
     
+    if year and year.isdigit():
+        query = query.filter(Letter.date >= datetime(int(year), 1, 1),
+                             Letter.date < datetime(int(year) + 1, 1, 1))
+    
+    rank = None
     if search_term:
-        search = f"%{search_term}%"
-        query = query.filter(
-            (Letter.letter_number.like(search)) |
-            (Letter.description.like(search)) |
-            (Letter.object_of.like(search)) |
-            (Letter.sender.like(search)) |
-            (Letter.recipient.like(search))
+        query, rank = apply_letter_search(query, search_term)
+    return query, rank
+
+@letters_bp.route('/')
+@login_required
+@use_replica
+def list_letters():
+    project_id = get_user_project_id()
+    
+    # Get filters
+    is_incoming_param = request.args.get('is_incoming')
+    filter_project_code = request.args.get('project_code')
+    search_term = request.args.get('search', '')
+    
+    # Determine letter type for template
+    letter_type = 'all'
+    if is_incoming_param is not None:
+        letter_type = 'incoming' if is_incoming_param.lower() == 'true' else 'outgoing'
+    
+    query, rank = filter_letters(Letter.summary_query())
+    page_size = get_page_size(request.args.get('per_page'))
+    
+    if rank is not None:
+        # Full-text matches, best match first
+        page = rank_paginate(
+            query, rank, Letter.id,
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            page_size=page_size
         )
+    else:
+        # Get one page of letters, newest first
+        page = keyset_paginate(
+            query, Letter.date, Letter.id,
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            page_size=page_size
+        )
+    
+    # Filters to carry over into the page links
+    page_args = {key: value for key, value in request.args.items()
+                 if key not in ('after', 'before', 'format') and value}
     
-    # Get letters
-    letters = query.order_by(Letter.date.desc()).all()
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'letters': [letter.to_summary_dict() for letter in page.items],
+            'next_cursor': page.next_cursor,
+            'prev_cursor': page.prev_cursor,
+            'next_url': url_for('letters.list_letters', after=page.next_cursor, format='json', **page_args) if page.has_next else None,
+            'prev_url': url_for('letters.list_letters', before=page.prev_cursor, format='json', **page_args) if page.has_prev else None
+        })
     
     # Get all projects for filter dropdown
     if current_user.is_head_office:
-        projects = Project.query.all()
+        projects = get_projects()
     else:
-        projects = Project.query.filter_by(id=project_id).all()
+        projects = [project for project in [get_project(project_id)] if project]
     
     # Pass the selected project_code to the template
     selected_project_code = filter_project_code
     
     return render_template('letters.html', 
-                          letters=letters, 
+                          letters=page.items, 
+                          page=page,
+                          page_args=page_args,
                           projects=projects, 
                           letter_type=letter_type,
-                          project_code=selected_project_code)
+                          project_code=selected_project_code,
+                          search_term=search_term)
+
+@letters_bp.route('/export/<any(csv, xlsx):file_format>')
+@login_required
+@use_replica
+def export_letters(file_format):
+    """Stream the letters matching the list filters as CSV or XLSX"""
+    query, rank = filter_letters(Letter.query)
+    if rank is None:
+        query = query.order_by(Letter.date.desc(), Letter.id.desc())
+    
+    response = Response(stream_with_context(stream_export(query, file_format)),
+                        mimetype=EXPORT_MIMETYPES[file_format])
+    response.headers['Content-Disposition'] = f'attachment; filename="{export_filename(file_format)}"'
+    # Let the download start straight away instead of being buffered by a proxy
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@letters_bp.route('/archive')
+@login_required
+@use_replica
+def download_archive():
+    """Download the files of the letters matching the list filters as one zip, with a manifest"""
+    query, rank = filter_letters(Letter.query)
+    if rank is None:
+        query = query.order_by(Letter.date, Letter.id)
+    
+    # The key identifies the archive's exact bytes, so it doubles as a strong ETag
+    key = archive_key(query)
+    cached = not_modified(key)
+    if cached is not None:
+        return cached
+    
+    download_name = archive_filename(request.args)
+    path = open_cached_archive(key)
+    if path:
+        # Built before: served from disk, with Range requests for resuming
+        response = send_file(path, mimetype='application/zip', as_attachment=True,
+                             download_name=download_name, conditional=True, etag=key)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    
+    response = Response(stream_with_context(stream_archive(query, key)), mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    response.headers['X-Accel-Buffering'] = 'no'
+    return tag_response(response, key)
 
 @letters_bp.route('/create', methods=['GET', 'POST'])
 @login_required
@@ -102,7 +207,7 @@ def create_letter():
             return redirect(url_for('letters.create_letter'))
         
         # Check if the project exists and user has access
-        project = Project.query.get(project_id)
+        project = get_project(project_id)
         if not project:
             flash('Selected project does not exist', 'error')
             return redirect(url_for('letters.create_letter'))
@@ -118,70 +223,21 @@ def create_letter():
             flash('Invalid date format', 'error')
             return redirect(url_for('letters.create_letter'))
         
-        # Get HO and project numbers
-        project_number = request.form.get('project_number', '0')
-        ho_number = request.form.get('ho_number', '0')
-        
-        # Validate project and HO numbers (must be numeric)
-        if not project_number.isdigit() or not ho_number.isdigit():
-            # Generate new numbers using the same logic as in generate_numbers
-            next_ho_number = 1
-            next_project_number = 1
-            
-            # Get the last HO number
-            last_ho_letter = Letter.query.filter(
-                Letter.ho_number.isnot(None),
-                Letter.is_incoming == is_incoming
-            ).order_by(Letter.ho_number.desc()).first()
-            
-            if last_ho_letter and last_ho_letter.ho_number and last_ho_letter.ho_number.isdigit():
-                next_ho_number = int(last_ho_letter.ho_number) + 1
-                if next_ho_number > 9999:
-                    next_ho_number = 1
-            
-            # Get the last project number
-            project_number_query = Letter.query.filter(
-                Letter.project_number.isnot(None),
-                Letter.is_incoming == is_incoming,
-                Letter.project_id == project_id
-            ).order_by(Letter.project_number.desc()).first()
-            
-            if project_number_query and project_number_query.project_number and project_number_query.project_number.isdigit():
-                next_project_number = int(project_number_query.project_number) + 1
-                if next_project_number > 9999:
-                    next_project_number = 1
-            
-            project_number = str(next_project_number).zfill(4)
-            ho_number = str(next_ho_number).zfill(4)
-        
-        # Generate letter number using the previous format
-        year = datetime.now().strftime('%y')
-        letter_type_code = "IN" if is_incoming else "OU"
-        letter_number = f"KEC/{project.project_code}/{letter_type_code}/{year}-{ho_number}-{project_number}"
-        
-        # Check if letter number already exists
-        if Letter.query.filter_by(letter_number=letter_number).first():
-            flash('Letter number already exists. Please refresh to get a new number.', 'error')
-            return redirect(url_for('letters.create_letter'))
-        
         # Check if a file was uploaded
-        letter_file = None
         file_name = None
+        file_hash = None
+        file_size = None
         
         if 'letter_file' in request.files:
             file = request.files['letter_file']
             if file and file.filename and allowed_file(file.filename):
                 try:
-                    filename = secure_filename(file.filename)
-                    # Generate unique filename
-                    unique_filename = f"{uuid.uuid4()}_{filename}"
-                    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-                    file.save(file_path)
-                    file_name = unique_filename
-                    
-                    # Read the file content for storage
-                    with open(file_path, 'rb') as f:
-                        letter_file = f.read()
+                    file_name = secure_filename(file.filename)
+                    # Store the file in the blob store, keyed by its content hash
+                    file_hash, file_size = store_upload(file)
+                except InvalidUploadError as e:
+                    flash(str(e), 'error')
+                    return redirect(url_for('letters.create_letter'))
                 except Exception as e:
                     current_app.logger.error(f"Error saving file: {str(e)}")
                     flash(f'Error saving file: {str(e)}', 'error')
@@ -193,44 +249,78 @@ def create_letter():
             flash('Letter file is required', 'error')
             return redirect(url_for('letters.create_letter'))
         
-        # Create letter
-        letter = Letter(
-            letter_number=letter_number,
-            project_id=project_id,
-            date=letter_date,
-            object_of=object_of,
-            project_number=project_number,
-            ho_number=ho_number,
-            description=description,
-            in_charge=request.form.get('in_charge'),
-            reference=request.form.get('reference'),
-            remarks=request.form.get('remarks'),
-            file_name=file_name,
-            is_incoming=is_incoming,
-            letter_content=letter_file,
-            created_by=current_user.id,
-            sender=sender,
-            recipient=recipient,
-            priority=request.form.get('priority'),
-            status=request.form.get('status', 'Pending'),
-            department=request.form.get('department'),
-            category=request.form.get('category'),
-            tags=request.form.get('tags')
-        )
+        # Get HO and project numbers
+        project_number = request.form.get('project_number', '')
+        ho_number = request.form.get('ho_number', '')
+        year = datetime.now().year
+        
+        # Numbers entered by hand must fit the 4-digit format, or the sequences
+        # would be moved past MAX_NUMBER and wrap onto numbers already issued
+        hand_numbered = project_number.isdigit() and ho_number.isdigit()
+        if hand_numbered and not (valid_number(ho_number) and valid_number(project_number)):
+            flash(f'HO and project numbers must be between 1 and {MAX_NUMBER}', 'error')
+            return redirect(url_for('letters.create_letter'))
         
         try:
+            if claim_reservation(current_user.id, project.id, is_incoming, ho_number, project_number, year):
+                pass  # Numbers were reserved for this user on the create form
+            elif hand_numbered:
+                # Numbers entered by hand: keep them, and move the sequences past them
+                ho_number = ho_number.zfill(4)
+                project_number = project_number.zfill(4)
+                advance_to(HO_SCOPE, is_incoming, year, int(ho_number))
+                advance_to(project_scope(project.id), is_incoming, year, int(project_number))
+            else:
+                ho_number, project_number = allocate_letter_numbers(project.id, is_incoming, year)
+        
+            # Generate letter number using the previous format
+            letter_number = format_letter_number(project.project_code, is_incoming, year, ho_number, project_number)
+        
+            # Check if letter number already exists
+            if Letter.query.filter_by(letter_number=letter_number).first():
+                db.session.rollback()
+                flash('Letter number already exists. Please refresh to get a new number.', 'error')
+                return redirect(url_for('letters.create_letter'))
+        
+            # Create letter
+            letter = Letter(
+                letter_number=letter_number,
+                project_id=project_id,
+                date=letter_date,
+                object_of=object_of,
+                project_number=project_number,
+                ho_number=ho_number,
+                description=description,
+                in_charge=request.form.get('in_charge'),
+                reference=request.form.get('reference'),
+                remarks=request.form.get('remarks'),
+                file_name=file_name,
+                file_hash=file_hash,
+                file_size=file_size,
+                is_incoming=is_incoming,
+                created_by=current_user.id,
+                sender=sender,
+                recipient=recipient,
+                priority=request.form.get('priority'),
+                status=request.form.get('status', 'Pending'),
+                department=request.form.get('department'),
+                category=request.form.get('category'),
+                tags=request.form.get('tags')
+            )
+        
             db.session.add(letter)
-            db.session.commit()
-            flash('Letter created successfully', 'success')
+            if file_hash:
+                acquire_blob(file_hash, file_size)
+                queue_preview(file_hash)
+            db.session.flush()
             
-            # Get project details for notification
-            project = Project.query.get(project_id)
+            # Notifications are queued with the letter and sent by the job worker
             letter_type = "incoming" if is_incoming else "outgoing"
             
-            # Create notification for all users
             if current_user.is_head_office:
                 # If head office user creates a letter, notify everyone
-                create_notification_for_all_users(
+                queue_notification(
+                    'all_users',
                     title=f"New {letter_type.title()} Letter",
                     message=f"Letter {letter.letter_number} has been added by Head Office for project {project.project_code}",
                     icon="fa-envelope",
@@ -240,17 +330,19 @@ def create_letter():
             else:
                 # If project user creates a letter:
                 # 1. Notify all users in their project
-                create_notification_for_project_users(
+                queue_notification(
+                    'project_users',
                     title=f"New {letter_type.title()} Letter",
                     message=f"Letter {letter.letter_number} has been added by {current_user.username}",
-                    project_id=project_id,
+                    project_id=project.id,
                     icon="fa-envelope",
                     icon_color="bg-info",
                     link=url_for('letters.view_letter', letter_id=letter.id)
                 )
                 
                 # 2. Notify all head office users and admins
-                create_notification_for_all_admins(
+                queue_notification(
+                    'all_admins',
                     title=f"New {letter_type.title()} Letter",
                     message=f"Letter {letter.letter_number} has been added by {current_user.username} for project {project.project_code}",
                     icon="fa-envelope-open",
@@ -258,6 +350,8 @@ def create_letter():
                     link=url_for('letters.view_letter', letter_id=letter.id)
                 )
             
+            db.session.commit()
+            flash('Letter created successfully', 'success')
             return redirect(url_for('letters.view_letter', letter_id=letter.id))
         except Exception as e:
             db.session.rollback()
@@ -271,16 +365,16 @@ def create_letter():
     
     # Get all projects for dropdown
     if current_user.is_head_office:
-        projects = Project.query.all()
+        projects = get_projects()
     else:
-        projects = Project.query.filter_by(id=user_project_id).all()
+        projects = [project for project in [get_project(user_project_id)] if project]
     
     return render_template('create_letter.html', projects=projects, default_letter_type=default_letter_type)
 
 @letters_bp.route('/<int:letter_id>')
 @login_required
 def view_letter(letter_id):
-    letter = Letter.query.get_or_404(letter_id)
+    letter = Letter.query.options(undefer_group('details')).get_or_404(letter_id)
     
     # Check if user has access to this letter by comparing with their project_id
     user_project_id = get_user_project_id()
@@ -299,7 +393,7 @@ def view_letter(letter_id):
 @login_required
 @crud_permission_required
 def edit_letter(letter_id):
-    letter = Letter.query.get_or_404(letter_id)
+    letter = Letter.query.options(undefer_group('details')).get_or_404(letter_id)
     
     # Check if user has access to this letter by comparing with their project_id
     user_project_id = get_user_project_id()
@@ -337,35 +431,42 @@ def edit_letter(letter_id):
                 return redirect(url_for('letters.edit_letter', letter_id=letter.id))
         
         # Check if a new file was uploaded
+        replaced_hash = None
         if 'letter_file' in request.files:
             file = request.files['letter_file']
             if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                # Generate unique filename
-                unique_filename = f"{uuid.uuid4()}_{filename}"
-                file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-                file.save(file_path)
+                try:
+                    file_hash, file_size = store_upload(file)
+                except InvalidUploadError as e:
+                    flash(str(e), 'error')
+                    return redirect(url_for('letters.edit_letter', letter_id=letter.id))
                 
-                # Delete old file if exists
-                if letter.file_name:
+                # Delete old legacy file if exists
+                if letter.file_name and not letter.file_hash:
                     old_file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], letter.file_name)
                     if os.path.exists(old_file_path):
                         os.remove(old_file_path)
                 
-                letter.file_name = unique_filename
+                if file_hash != letter.file_hash:
+                    replaced_hash = letter.file_hash
+                    release_blob(replaced_hash)
+                    acquire_blob(file_hash, file_size)
+                    queue_preview(file_hash)
                 
-                # Read the file content for storage
-                with open(file_path, 'rb') as f:
-                    letter.letter_content = f.read()
+                letter.file_name = secure_filename(file.filename)
+                letter.file_hash = file_hash
+                letter.file_size = file_size
+                letter.letter_content = None
         
-        db.session.commit()
-        flash('Letter updated successfully', 'success')
+        if replaced_hash:
+            enqueue_job('blobs.purge', {'digest': replaced_hash})
         
-        # Create notification for the user
-        create_notification(
+        # Notify the user
+        queue_notification(
+            'user',
+            user_id=current_user.id,
             title="Letter Updated",
             message=f"Letter {letter.letter_number} has been updated successfully",
-            user_id=current_user.id,
             icon="fa-edit",
             icon_color="bg-primary",
             link=url_for('letters.view_letter', letter_id=letter.id)
@@ -373,18 +474,21 @@ def edit_letter(letter_id):
         
         # Notify admins if user is not admin
         if not current_user.is_admin:
-            create_notification_for_all_admins(
+            queue_notification(
+                'all_admins',
                 title="Letter Updated",
                 message=f"Letter {letter.letter_number} has been modified by {current_user.username}",
                 icon="fa-edit",
                 icon_color="bg-warning",
                 link=url_for('letters.view_letter', letter_id=letter.id)
             )
-            
+        
+        db.session.commit()
+        flash('Letter updated successfully', 'success')
         return redirect(url_for('letters.view_letter', letter_id=letter.id))
     
     # Get all projects for dropdown
-    projects = Project.query.all()
+    projects = get_projects()
     
     return render_template('edit_letter.html', letter=letter, projects=projects)
 
@@ -405,36 +509,40 @@ def delete_letter(letter_id):
         flash('You do not have permission to delete this letter', 'error')
         return redirect(url_for('letters.list_letters'))
     
-    # Delete file if exists
-    if letter.file_name:
+    # Delete legacy file if exists
+    if letter.file_name and not letter.file_hash:
         file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], letter.file_name)
         if os.path.exists(file_path):
             os.remove(file_path)
     
-    db.session.delete(letter)
-    db.session.commit()
-    
-    # Get letter information before it's lost after deletion
+    file_hash = letter.file_hash
     letter_number = letter.letter_number
+    release_blob(file_hash)
+    db.session.delete(letter)
+    if file_hash:
+        enqueue_job('blobs.purge', {'digest': file_hash})
     
-    # Create notification for the user
-    create_notification(
+    # Notify the user
+    queue_notification(
+        'user',
+        user_id=current_user.id,
         title="Letter Deleted",
         message=f"Letter {letter_number} has been deleted successfully",
-        user_id=current_user.id,
         icon="fa-trash",
         icon_color="bg-danger"
     )
     
     # Notify admins if user is not admin
     if not current_user.is_admin:
-        create_notification_for_all_admins(
+        queue_notification(
+            'all_admins',
             title="Letter Deleted",
             message=f"Letter {letter_number} has been deleted by {current_user.username}",
             icon="fa-trash",
             icon_color="bg-danger"
         )
     
+    db.session.commit()
     flash('Letter deleted successfully', 'success')
     return redirect(url_for('letters.list_letters'))
 
@@ -454,7 +562,7 @@ def download_letter(letter_id):
         flash('You do not have permission to download this letter', 'error')
         return redirect(url_for('letters.list_letters'))
     
-    if not letter.file_name:
+    if not letter.file_hash and not letter.file_name:
         flash('No file available for this letter', 'error')
         return redirect(url_for('letters.view_letter', letter_id=letter.id))
     
@@ -464,7 +572,16 @@ def download_letter(letter_id):
         
         # Set the appropriate Content-Disposition header
         download_name = f"Letter_{letter.letter_number}.pdf"
-        attachment_header = "inline" if inline else "attachment"
+        
+        if letter.file_hash:
+            # Links that carry the content hash (?v=...) always return the same bytes
+            immutable = request.args.get('v') == letter.file_hash
+            return send_blob(
+                letter.file_hash,
+                download_name,
+                as_attachment=not inline,
+                immutable=immutable
+            )
         
         return send_from_directory(
             current_app.config['UPLOAD_FOLDER'],
@@ -477,89 +594,67 @@ def download_letter(letter_id):
         flash('Error downloading file', 'error')
         return redirect(url_for('letters.view_letter', letter_id=letter.id))
 
-@letters_bp.route('/generate_numbers')
+@letters_bp.route('/<int:letter_id>/preview')
+@login_required
+def letter_preview(letter_id):
+    """First-page thumbnail of a letter's PDF, or 404 while it hasn't been rendered"""
+    letter = Letter.summary_query().get_or_404(letter_id)
+    
+    user_project_id = get_user_project_id()
+    if not current_user.is_head_office and (user_project_id is None or int(letter.project_id) != int(user_project_id)):
+        abort(403)
+    
+    if not preview_exists(letter.file_hash):
+        abort(404)
+    
+    immutable = request.args.get('v') == letter.file_hash
+    return send_blob(
+        letter.file_hash,
+        f"Letter_{letter.id}.png",
+        mimetype='image/png',
+        as_attachment=False,
+        immutable=immutable,
+        suffix=PREVIEW_SUFFIX
+    )
+
+@letters_bp.route('/generate_numbers', methods=['GET', 'POST'])
 @login_required
 @crud_permission_required
 def generate_numbers():
+    """
+    Numbers for the create form. GET only previews the next numbers; POST, sent
+    by the form itself, reserves them for this user while the form is open.
+    """
+    args = request.form if request.method == 'POST' else request.args
+    
     # Get letter type from request
-    is_incoming_param = request.args.get('is_incoming', '0')
+    is_incoming_param = args.get('is_incoming', '0')
     is_incoming = is_incoming_param == '1'
     
     # Get project ID from request
-    project_id = request.args.get('project_id')
+    project_id = args.get('project_id')
     
     current_app.logger.info(f"Generating numbers for {'incoming' if is_incoming else 'outgoing'} letter for project_id {project_id}. Param value: {is_incoming_param}")
     
-    # Get the last HO number from the database for the appropriate letter type
-    last_ho_letter = Letter.query.filter(
-        Letter.ho_number.isnot(None),
-        Letter.is_incoming == is_incoming
-    ).order_by(Letter.ho_number.desc()).first()
+    if not project_id or not project_id.isdigit() or not get_project(project_id):
+        return jsonify({'ho_number': '', 'project_number': ''})
     
-    if last_ho_letter and last_ho_letter.ho_number:
-        try:
-            next_ho_number = int(last_ho_letter.ho_number) + 1
-            if next_ho_number > 9999:
-                next_ho_number = 1
-            current_app.logger.debug(f"Found last HO number: {last_ho_letter.ho_number}, next: {next_ho_number}")
-        except ValueError:
-            next_ho_number = 1
-            current_app.logger.debug(f"Error converting HO number: {last_ho_letter.ho_number}, using 1")
-    else:
-        next_ho_number = 1
-        current_app.logger.debug("No previous HO number found, using 1")
-
-    # Get the last project number from the database for the specific project and letter type
-    project_number_query = Letter.query.filter(
-        Letter.project_number.isnot(None),
-        Letter.is_incoming == is_incoming
-    )
-    
-    # Add project filter if a project is selected
-    if project_id and project_id.isdigit():
-        project_number_query = project_number_query.filter(Letter.project_id == int(project_id))
-    
-    last_project_letter = project_number_query.order_by(Letter.project_number.desc()).first()
-    
-    if last_project_letter and last_project_letter.project_number:
-        try:
-            next_project_number = int(last_project_letter.project_number) + 1
-            if next_project_number > 9999:
-                next_project_number = 1
-            current_app.logger.debug(f"Found last project number: {last_project_letter.project_number}, next: {next_project_number}")
-        except ValueError:
-            next_project_number = 1
-            current_app.logger.debug(f"Error converting project number: {last_project_letter.project_number}, using 1")
-    else:
-        next_project_number = 1
-        current_app.logger.debug("No previous project number found, using 1")
-    
-    # Format numbers with leading zeros
-    ho_number = str(next_ho_number).zfill(4)
-    project_number = str(next_project_number).zfill(4)
+    try:
+        if request.method == 'POST':
+            # Reserve the next numbers for this user so they stay valid while the form is open
+            reservation = reserve_letter_numbers(current_user.id, int(project_id), is_incoming)
+            ho_number, project_number = reservation.ho_number, reservation.project_number
+        else:
+            ho_number, project_number, reservation = preview_letter_numbers(
+                current_user.id, int(project_id), is_incoming)
+    except SequenceExhaustedError as e:
+        db.session.rollback()
+        return jsonify({'ho_number': '', 'project_number': '', 'error': str(e)}), 409
     
-    # Check if letter number already exists
-    if project_id and project_id.isdigit():
-        year = datetime.now().strftime('%y')
-        project = Project.query.get(int(project_id))
-        if project:
-            project_code = project.project_code
-            letter_type_code = "IN" if is_incoming else "OU"
-            letter_number = f"KEC/{project_code}/{letter_type_code}/{year}-{ho_number}-{project_number}"
-            
-            existing_letter = Letter.query.filter_by(letter_number=letter_number).first()
-            if existing_letter:
-                # If exists, increment HO number until unique
-                ho_num = next_ho_number
-                while existing_letter:
-                    ho_num += 1
-                    letter_number = f"KEC/{project_code}/{letter_type_code}/{year}-{str(ho_num).zfill(4)}-{project_number}"
-                    existing_letter = Letter.query.filter_by(letter_number=letter_number).first()
-                ho_number = str(ho_num).zfill(4)
-
     response_data = {
         'ho_number': ho_number,
-        'project_number': project_number
+        'project_number': project_number,
+        'reserved_until': reservation.expires_at.isoformat() if reservation else None
     }
     
     current_app.logger.info(f"Returning numbers: {response_data}")
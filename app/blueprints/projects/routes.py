@@ -5,17 +5,22 @@ from app.blueprints.projects import projects_bp
 from app.models.project import Project
 from app.models.letter import Letter
 from app.utils.access import admin_required, get_user_project_id, project_query_filter, head_office_required
+from app.utils.pagination import keyset_paginate, get_page_size
+from app.utils.letter_stats import get_project_stats
+from app.utils.project_catalog import get_visible_projects
+from app.utils.replica import use_replica
+from app.models.project_letter_stats import ProjectLetterStats
 
 @projects_bp.route('/')
 @login_required
 def list_projects():
-    # Filter projects by head office status
-    if current_user.is_head_office:
-        projects = Project.query.all()
-    else:
-        projects = Project.query.filter_by(id=current_user.project_id).all()
+    # Head Office sees every project, other users their own, from the cached catalog
+    projects = get_visible_projects(current_user)
     
-    return render_template('projects.html', projects=projects)
+    # Letter counts from the per-project counters instead of a COUNT per project
+    letter_counts = {stats.project_id: stats.total for stats in ProjectLetterStats.query.all()}
+    
+    return render_template('projects.html', projects=projects, letter_counts=letter_counts)
 
 @projects_bp.route('/create', methods=['GET', 'POST'])
 @login_required
@@ -59,6 +64,7 @@ def create_project():
 
 @projects_bp.route('/<int:project_id>')
 @login_required
+@use_replica
 def view_project(project_id):
     project = Project.query.get_or_404(project_id)
     
@@ -67,21 +73,36 @@ def view_project(project_id):
         flash('You do not have permission to view this project', 'error')
         return redirect(url_for('projects.list_projects'))
     
-    # Get letters for this project
-    letters = Letter.query.filter_by(project_id=project.id).all()
+    # Get one page of letters for this project, optionally filtered by type
+    letter_type = request.args.get('letter_type', 'all')
+    letters_query = Letter.summary_query().filter_by(project_id=project.id)
+    if letter_type in ('incoming', 'outgoing'):
+        letters_query = letters_query.filter_by(is_incoming=(letter_type == 'incoming'))
+    
+    page = keyset_paginate(
+        letters_query, Letter.date, Letter.id,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        page_size=get_page_size(request.args.get('per_page'))
+    )
+    page_args = {key: value for key, value in request.args.items()
+                 if key not in ('after', 'before', 'format') and value}
+    page_args['project_id'] = project.id
     
-    # Calculate letter statistics
-    total_letters = len(letters)
-    incoming_letters = sum(1 for letter in letters if letter.is_incoming)
-    outgoing_letters = total_letters - incoming_letters
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'letters': [letter.to_summary_dict() for letter in page.items],
+            'next_cursor': page.next_cursor,
+            'prev_cursor': page.prev_cursor,
+            'next_url': url_for('projects.view_project', after=page.next_cursor, format='json', **page_args) if page.has_next else None,
+            'prev_url': url_for('projects.view_project', before=page.prev_cursor, format='json', **page_args) if page.has_prev else None
+        })
     
-    stats = {
-        'total_letters': total_letters,
-        'incoming_letters': incoming_letters,
-        'outgoing_letters': outgoing_letters
-    }
+    # Letter statistics from the per-project counters
+    stats = get_project_stats(project.id)
     
-    return render_template('view_project.html', project=project, letters=letters, stats=stats)
+    return render_template('view_project.html', project=project, letters=page.items, stats=stats,
+                          page=page, page_args=page_args, letter_type=letter_type)
 
 @projects_bp.route('/<int:project_id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -129,6 +150,7 @@ def delete_project(project_id):
         flash('Cannot delete project with assigned users', 'error')
         return redirect(url_for('projects.view_project', project_id=project.id))
     
+    ProjectLetterStats.query.filter_by(project_id=project.id).delete()
     db.session.delete(project)
     db.session.commit()
     
@@ -0,0 +1,170 @@
+import os
+import shutil
+import click
+from flask import current_app
+from app import db
+
+def register_commands(app):
+    """Register maintenance commands with the Flask CLI"""
+
+    @app.cli.command('drain-letter-content')
+    @click.option('--batch-size', default=50, help='Letters to migrate per transaction')
+    @click.option('--vacuum/--no-vacuum', default=True, help='Compact the database file afterwards')
+    def drain_letter_content(batch_size, vacuum):
+        """Move PDFs stored in letters.letter_content into the blob store."""
+        from sqlalchemy.orm import load_only
+        from app.models.letter import Letter
+        from app.utils.blobstore import store_bytes, store_file, acquire_blob, new_temp_path
+        from app.utils.database import create_tables
+
+        create_tables()
+        migrated = 0
+        last_id = 0
+        while True:
+            letters = Letter.query.options(load_only(Letter.id, Letter.file_name, Letter.letter_content))\
+                .filter(Letter.id > last_id, Letter.file_hash.is_(None))\
+                .filter((Letter.letter_content.isnot(None)) | (Letter.file_name.isnot(None)))\
+                .order_by(Letter.id)\
+                .limit(batch_size)\
+                .all()
+            if not letters:
+                break
+
+            for letter in letters:
+                last_id = letter.id
+                if letter.letter_content:
+                    digest, size = store_bytes(letter.letter_content)
+                else:
+                    legacy_path = os.path.join(current_app.config['UPLOAD_FOLDER'], letter.file_name)
+                    if not os.path.exists(legacy_path):
+                        click.echo(f"Letter {letter.id}: file {letter.file_name} is missing, skipping")
+                        continue
+                    temp_path = new_temp_path()
+                    shutil.copyfile(legacy_path, temp_path)
+                    digest, size = store_file(temp_path)
+
+                acquire_blob(digest, size)
+                letter.file_hash = digest
+                letter.file_size = size
+                letter.letter_content = None
+                migrated += 1
+
+            db.session.commit()
+            click.echo(f"Migrated {migrated} letters")
+
+        if vacuum and db.engine.dialect.name == 'sqlite':
+            click.echo("Compacting database...")
+            with db.engine.connect() as connection:
+                connection.exec_driver_sql('VACUUM')
+
+        click.echo(f"Done. {migrated} letters now reference the blob store.")
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        """Rebuild the letters full-text search index."""
+        from app.utils.search import rebuild_search_index
+        if rebuild_search_index():
+            click.echo("Search index rebuilt")
+        else:
+            click.echo("Full-text search is not available on this database; searches use LIKE matching")
+
+    @app.cli.command('backfill-letter-sequences')
+    def backfill_letter_sequences():
+        """Seed the letter number sequences from existing letters."""
+        from app.utils.numbering import backfill_sequences
+        from app.utils.database import create_tables
+
+        create_tables()
+        count = backfill_sequences()
+        click.echo(f"Backfilled {count} letter number sequences")
+
+    @app.cli.command('reconcile-letter-stats')
+    def reconcile_letter_stats_command():
+        """Recount the per-project letter counters from the letters table."""
+        from app.utils.letter_stats import reconcile_letter_stats
+        from app.utils.database import create_tables
+
+        create_tables()
+        corrected = reconcile_letter_stats()
+        if corrected:
+            click.echo(f"Corrected letter counts for projects: {', '.join(str(project_id) for project_id in corrected)}")
+        click.echo(f"{len(corrected)} projects had drifted counters")
+
+    @app.cli.command('index-advisor')
+    def index_advisor():
+        """Explain the registered hot queries and flag full scans."""
+        from app.utils.query_plans import advise_indexes
+        from app.utils.database import create_tables
+
+        create_tables()
+        flagged = 0
+        for name, plan, problems in advise_indexes():
+            status = 'WARN' if problems else 'ok'
+            click.echo(f"[{status}] {name}")
+            for line in plan:
+                click.echo(f"       {line}")
+            for problem in problems:
+                click.echo(f"    -> {problem}")
+            flagged += bool(problems)
+
+        click.echo(f"{flagged} of the hot queries need attention")
+
+    @app.cli.command('blob-gc')
+    def blob_gc():
+        """Remove unreferenced files from the blob store."""
+        from app.utils.blobstore import collect_garbage
+        removed = collect_garbage()
+        click.echo(f"Removed {removed} unreferenced blob files")
+
+    @app.cli.command('render-previews')
+    def render_previews():
+        """Queue preview rendering for letter files that don't have one yet."""
+        from app.models.letter import Letter
+        from app.utils.previews import queue_preview, get_renderer
+
+        if get_renderer() is None:
+            click.echo("No PDF renderer available; install PyMuPDF or poppler-utils first")
+            return
+
+        digests = [digest for (digest,) in db.session.query(Letter.file_hash).filter(Letter.file_hash.isnot(None)).distinct()]
+        for digest in digests:
+            queue_preview(digest)
+        db.session.commit()
+        click.echo(f"Checked {len(digests)} letter files; missing previews will be rendered by the job worker")
+
+    @app.cli.command('import-letters')
+    @click.argument('register', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--attachments', type=click.Path(exists=True), help='Directory or .zip holding the PDFs named in the file column')
+    @click.option('--chunk-size', default=500, help='Letters to insert per transaction')
+    @click.option('--user', 'username', help='Record the letters as created by this user')
+    @click.option('--errors', 'errors_path', type=click.Path(dir_okay=False), help='Write the rejected rows to this CSV file')
+    def import_letters_command(register, attachments, chunk_size, username, errors_path):
+        """Import letters from a CSV or XLSX register."""
+        from app.models.user import User
+        from app.utils.database import create_tables
+        from app.utils.letter_import import import_letters, LetterImportError
+
+        create_tables()
+        user_id = None
+        if username:
+            user = User.query.filter_by(username=username).first()
+            if user is None:
+                raise click.ClickException(f"No user named {username}")
+            user_id = user.id
+
+        def progress(result):
+            click.echo(f"{result.rows} rows read, {result.imported} imported, {len(result.errors)} rejected")
+
+        try:
+            result = import_letters(register, attachments, user_id=user_id, chunk_size=chunk_size, progress=progress)
+        except LetterImportError as e:
+            raise click.ClickException(str(e))
+
+        for row_number, message in result.errors[:20]:
+            click.echo(f"Row {row_number}: {message}")
+        if len(result.errors) > 20:
+            click.echo(f"... and {len(result.errors) - 20} more")
+        if errors_path and result.errors:
+            result.write_errors(errors_path)
+            click.echo(f"Rejected rows written to {errors_path}")
+        click.echo(f"Done. Imported {result.imported} of {result.rows} rows.")
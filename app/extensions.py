@@ -1,16 +1,76 @@
 """Flask extensions module to avoid circular imports."""
 
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
 from flask_login import LoginManager
 from flask_bcrypt import Bcrypt
 from flask_apscheduler import APScheduler
 
+# Bind key of the optional read replica in SQLALCHEMY_BINDS
+REPLICA_BIND = 'replica'
+
+# Tables whose ORM reads may be served by the replica. Users, projects, settings
+# and version tokens always come from the primary, so the caches built from them
+# never store a lagging copy under a current version token.
+REPLICA_TABLES = ('letters', 'project_letter_stats')
+
+class RoutingSession(SignallingSession):
+    """
+    Session that sends SELECTs on REPLICA_TABLES to the read replica while
+    'use_replica' is set in its info (see app.utils.replica), until the session
+    first writes. Writes, and every read after one, go to the primary.
+    """
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or getattr(clause, 'is_dml', False):
+            self.info['wrote'] = True
+        elif (self.info.get('use_replica') and not self.info.get('wrote') and getattr(clause, 'is_select', False)
+              and mapper is not None and mapper.local_table.name in REPLICA_TABLES):
+            return self.db.get_engine(self.app, bind=REPLICA_BIND)
+        return super().get_bind(mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
 # Initialize extensions
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 login = LoginManager()
 bcrypt = Bcrypt()
 scheduler = APScheduler()
 
 # Configure extensions
 login.login_view = 'auth.login'
-login.login_message = 'Please log in to access this page.' 
\ No newline at end of file
+login.login_message = 'Please log in to access this page.'
+
+# Pragmas that may be set through SQLITE_PRAGMAS, in the order they are applied
+SQLITE_PRAGMA_NAMES = ('busy_timeout', 'journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store', 'foreign_keys')
+
+def configure_sqlite(engine, pragmas):
+    """Apply `pragmas` to every new connection of a SQLite engine"""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    unknown = set(pragmas) - set(SQLITE_PRAGMA_NAMES)
+    if unknown:
+        raise ValueError(f"Unsupported SQLite pragmas: {', '.join(sorted(unknown))}")
+    statements = [f'PRAGMA {name} = {pragmas[name]}' for name in SQLITE_PRAGMA_NAMES if name in pragmas]
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+def sqlite_pragma_report(engine):
+    """Effective values of the tunable pragmas on a fresh connection, or None for other databases"""
+    if engine.dialect.name != 'sqlite':
+        return None
+    with engine.connect() as connection:
+        return {name: connection.exec_driver_sql(f'PRAGMA {name}').scalar() for name in SQLITE_PRAGMA_NAMES} 
\ No newline at end of file
@@ -2,4 +2,13 @@ from app.models.user import User
 from app.models.project import Project
 from app.models.letter import Letter
 from app.models.notification import Notification
-from app.models.setting import Setting 
\ No newline at end of file
+from app.models.setting import Setting
+from app.models.blob import Blob
+from app.models.letter_sequence import LetterSequence
+from app.models.number_reservation import NumberReservation
+from app.models.job import Job
+from app.models.change_version import ChangeVersion
+from app.models.project_letter_stats import ProjectLetterStats
+
+# Registers the listeners that keep project_letter_stats in step with letters
+import app.utils.letter_stats
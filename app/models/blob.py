@@ -0,0 +1,14 @@
+from datetime import datetime
+from app import db
+
+class Blob(db.Model):
+    """A content-addressed file in the blob store, keyed by its SHA-256 digest"""
+    __tablename__ = 'blobs'
+    
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Blob {self.sha256[:12]} refs={self.ref_count}>'
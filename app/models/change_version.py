@@ -0,0 +1,13 @@
+from datetime import datetime
+from app import db
+
+class ChangeVersion(db.Model):
+    """Opaque version token for a data set, replaced on every change; used as an ETag"""
+    __tablename__ = 'change_versions'
+    
+    name = db.Column(db.String(100), primary_key=True)
+    token = db.Column(db.String(32), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ChangeVersion {self.name}: {self.token}>'
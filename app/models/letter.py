@@ -1,8 +1,27 @@
 from datetime import datetime
+from sqlalchemy.orm import load_only, undefer_group
 from app import db
 
 class Letter(db.Model):
     __tablename__ = 'letters'
+    __table_args__ = (
+        # Letters list and project tab: filter by project/type, newest first
+        db.Index('ix_letters_project_type_date', 'project_id', 'is_incoming', 'date'),
+        db.Index('ix_letters_project_date', 'project_id', 'date'),
+        # Head Office letters list across all projects
+        db.Index('ix_letters_type_date', 'is_incoming', 'date'),
+        db.Index('ix_letters_date', 'date'),
+        # Dashboard recent letters
+        db.Index('ix_letters_project_created', 'project_id', 'created_at'),
+        db.Index('ix_letters_created', 'created_at'),
+    )
+    
+    # Columns needed to render a letter in list views (letters table, project tab, dashboard)
+    SUMMARY_FIELDS = (
+        'id', 'letter_number', 'project_id', 'date', 'object_of', 'project_number', 'ho_number',
+        'in_charge', 'is_incoming', 'sender', 'recipient', 'priority', 'status',
+        'file_name', 'file_hash', 'file_size', 'created_at', 'has_file'
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     letter_number = db.Column(db.String(50), unique=True)
@@ -11,13 +30,15 @@ class Letter(db.Model):
     object_of = db.Column(db.String(200))
     project_number = db.Column(db.String(4))  # Changed to String to maintain leading zeros
     ho_number = db.Column(db.String(4))      # Changed to String to maintain leading zeros
-    description = db.Column(db.Text)
+    description = db.deferred(db.Column(db.Text), group='details')
     in_charge = db.Column(db.String(100))
-    reference = db.Column(db.String(200))
-    remarks = db.Column(db.Text)
+    reference = db.deferred(db.Column(db.String(200)), group='details')
+    remarks = db.deferred(db.Column(db.Text), group='details')
     file_name = db.Column(db.String(255))
     is_incoming = db.Column(db.Boolean, default=False)
-    letter_content = db.Column(db.LargeBinary)  # For PDF storage
+    letter_content = db.deferred(db.Column(db.LargeBinary), group='content')  # Legacy PDF storage, drained into the blob store
+    file_hash = db.Column(db.String(64))      # SHA-256 of the attached PDF in the blob store
+    file_size = db.Column(db.Integer)         # Size of the attached PDF in bytes
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -27,25 +48,54 @@ class Letter(db.Model):
     recipient = db.Column(db.String(200))     # Recipient's name/organization
     priority = db.Column(db.String(20))       # Priority level (High/Medium/Low)
     status = db.Column(db.String(20))         # Letter status (Pending/Processed/Archived)
-    due_date = db.Column(db.DateTime)         # Due date for action
-    action_taken = db.Column(db.Text)         # Action taken on the letter
-    department = db.Column(db.String(100))    # Department handling the letter
-    category = db.Column(db.String(100))      # Letter category
-    tags = db.Column(db.String(200))          # Tags for categorization
-    related_letters = db.Column(db.String(200))  # Related letter numbers
-    attachments = db.Column(db.Text)          # List of attachments
-    tracking_number = db.Column(db.String(50))  # Tracking number for outgoing letters
-    delivery_status = db.Column(db.String(50))  # Delivery status for outgoing letters
-    acknowledgment = db.Column(db.Text)       # Acknowledgment details
-    follow_up_date = db.Column(db.DateTime)   # Follow-up date
-    follow_up_notes = db.Column(db.Text)      # Follow-up notes
-    archive_location = db.Column(db.String(200))  # Physical archive location
-    archive_date = db.Column(db.DateTime)     # Date when letter was archived
-    confidential = db.Column(db.Boolean, default=False)  # Confidential flag
-    digital_signature = db.Column(db.String(200))  # Digital signature details
-    version = db.Column(db.Integer, default=1)  # Version number for letter revisions
-    last_reviewed = db.Column(db.DateTime)    # Last review date
-    reviewed_by = db.Column(db.String(100))   # Last reviewed by
-    review_notes = db.Column(db.Text)         # Review notes
-    compliance_status = db.Column(db.String(50))  # Compliance status
-    audit_trail = db.Column(db.Text)          # Audit trail information 
\ No newline at end of file
+    due_date = db.deferred(db.Column(db.DateTime), group='details')         # Due date for action
+    action_taken = db.deferred(db.Column(db.Text), group='details')         # Action taken on the letter
+    department = db.deferred(db.Column(db.String(100)), group='details')    # Department handling the letter
+    category = db.deferred(db.Column(db.String(100)), group='details')      # Letter category
+    tags = db.deferred(db.Column(db.String(200)), group='details')          # Tags for categorization
+    related_letters = db.deferred(db.Column(db.String(200)), group='details')  # Related letter numbers
+    attachments = db.deferred(db.Column(db.Text), group='details')          # List of attachments
+    tracking_number = db.deferred(db.Column(db.String(50)), group='details')  # Tracking number for outgoing letters
+    delivery_status = db.deferred(db.Column(db.String(50)), group='details')  # Delivery status for outgoing letters
+    acknowledgment = db.deferred(db.Column(db.Text), group='details')       # Acknowledgment details
+    follow_up_date = db.deferred(db.Column(db.DateTime), group='details')   # Follow-up date
+    follow_up_notes = db.deferred(db.Column(db.Text), group='details')      # Follow-up notes
+    archive_location = db.deferred(db.Column(db.String(200)), group='details')  # Physical archive location
+    archive_date = db.deferred(db.Column(db.DateTime), group='details')     # Date when letter was archived
+    confidential = db.deferred(db.Column(db.Boolean, default=False), group='details')  # Confidential flag
+    digital_signature = db.deferred(db.Column(db.String(200)), group='details')  # Digital signature details
+    version = db.deferred(db.Column(db.Integer, default=1), group='details')  # Version number for letter revisions
+    last_reviewed = db.deferred(db.Column(db.DateTime), group='details')    # Last review date
+    reviewed_by = db.deferred(db.Column(db.String(100)), group='details')   # Last reviewed by
+    review_notes = db.deferred(db.Column(db.Text), group='details')         # Review notes
+    compliance_status = db.deferred(db.Column(db.String(50)), group='details')  # Compliance status
+    audit_trail = db.deferred(db.Column(db.Text), group='details')          # Audit trail information
+    
+    # Cheap computed columns so list views never touch the deferred groups
+    has_file = db.column_property(db.or_(file_hash.isnot(None), file_name.isnot(None)))
+    # Only list views show the preview, so other queries don't compute it
+    description_preview = db.column_property(db.func.substr(description.columns[0], 1, 120),
+                                             deferred=True, group='summary')
+    
+    @classmethod
+    def summary_query(cls):
+        """Query that only loads the columns needed by list views"""
+        return cls.query.options(load_only(*[getattr(cls, field) for field in cls.SUMMARY_FIELDS]),
+                                 undefer_group('summary'))
+    
+    def to_summary_dict(self):
+        return {
+            'id': self.id,
+            'letter_number': self.letter_number,
+            'project_id': self.project_id,
+            'date': self.date.isoformat() if self.date else None,
+            'object_of': self.object_of,
+            'is_incoming': self.is_incoming,
+            'in_charge': self.in_charge,
+            'sender': self.sender,
+            'recipient': self.recipient,
+            'status': self.status,
+            'priority': self.priority,
+            'has_file': bool(self.has_file),
+            'file_size': self.file_size
+        }
@@ -0,0 +1,13 @@
+from app import db
+
+class LetterSequence(db.Model):
+    """Last issued letter number per scope (Head Office or a project), letter type and year"""
+    __tablename__ = 'letter_sequences'
+    
+    scope = db.Column(db.String(20), primary_key=True)  # 'HO' or 'project:<id>'
+    is_incoming = db.Column(db.Boolean, primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    last_value = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<LetterSequence {self.scope}/{"IN" if self.is_incoming else "OU"}/{self.year}={self.last_value}>'
@@ -3,6 +3,12 @@ from app import db
 
 class Notification(db.Model):
     __tablename__ = 'notifications'
+    __table_args__ = (
+        # Unread badge counts and duplicate checks
+        db.Index('ix_notifications_user_read_created', 'user_id', 'read', 'created_at'),
+        # Notification dropdown and page: latest first
+        db.Index('ix_notifications_user_created', 'user_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -0,0 +1,22 @@
+from datetime import datetime
+from app import db
+
+class NumberReservation(db.Model):
+    """Letter numbers shown on the create form, held for one user until they expire"""
+    __tablename__ = 'number_reservations'
+    __table_args__ = (
+        db.Index('ix_number_reservations_user_key', 'user_id', 'project_id', 'is_incoming', 'year'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False)
+    is_incoming = db.Column(db.Boolean, nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    ho_number = db.Column(db.String(4), nullable=False)
+    project_number = db.Column(db.String(4), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<NumberReservation {self.ho_number}-{self.project_number} for user {self.user_id}>'
@@ -0,0 +1,16 @@
+from app import db
+
+class ProjectLetterStats(db.Model):
+    """Letter counts per project, kept in step with the letters table by app.utils.letter_stats"""
+    __tablename__ = 'project_letter_stats'
+    
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), primary_key=True)
+    incoming = db.Column(db.Integer, default=0, nullable=False)
+    outgoing = db.Column(db.Integer, default=0, nullable=False)
+    
+    @property
+    def total(self):
+        return self.incoming + self.outgoing
+    
+    def __repr__(self):
+        return f'<ProjectLetterStats {self.project_id}: {self.incoming} in, {self.outgoing} out>'
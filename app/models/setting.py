@@ -13,31 +13,12 @@ class Setting(db.Model):
     
     @classmethod
     def get(cls, key, default=None):
-        """Get a setting value by key with optional default"""
-        setting = cls.query.filter_by(key=key).first()
-        if setting:
-            # Try to convert to appropriate type
-            if setting.value.lower() in ('true', 'false'):
-                return setting.value.lower() == 'true'
-            try:
-                if '.' in setting.value:
-                    return float(setting.value)
-                return int(setting.value)
-            except ValueError:
-                return setting.value
-        return default
+        """Get a setting value by key with optional default, from the settings cache"""
+        from app.utils.settings import get_setting
+        return get_setting(key, default)
     
     @classmethod
     def set(cls, key, value, description=None):
         """Set a setting value, create if doesn't exist"""
-        setting = cls.query.filter_by(key=key).first()
-        if setting:
-            setting.value = str(value)
-            setting.updated_at = datetime.utcnow()
-            if description:
-                setting.description = description
-        else:
-            setting = cls(key=key, value=str(value), description=description)
-            db.session.add(setting)
-        db.session.commit()
-        return setting 
\ No newline at end of file
+        from app.utils.settings import set_setting
+        return set_setting(key, value, description) 
\ No newline at end of file
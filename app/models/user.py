@@ -5,6 +5,11 @@ from app.extensions import db, login
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Notification recipients by project and by role
+        db.Index('ix_users_project_active', 'project_id', 'is_active'),
+        db.Index('ix_users_admin_active', 'is_admin', 'is_active'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -64,4 +69,5 @@ class User(UserMixin, db.Model):
 
 @login.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id)) 
\ No newline at end of file
+    from app.utils.principal import load_principal
+    return load_principal(int(user_id)) 
\ No newline at end of file
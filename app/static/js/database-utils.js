@@ -4,6 +4,8 @@
 // Version: 1.1.6 - Fixed API endpoints to use /database/backups instead of /api/database/backups
 // Version: 1.1.7 - Ensure consistency in all route paths
 // Version: 1.1.8 - Fixed null reference errors and API endpoint URLs
+// Version: 1.1.9 - Show progress of background backups
+// Version: 1.2.0 - Restores apply without restarting the application
 document.addEventListener('DOMContentLoaded', function() {
     // Elements
     const createBackupBtn = document.getElementById('createBackupBtn');
@@ -99,15 +101,15 @@ document.addEventListener('DOMContentLoaded', function() {
             .then(data => {
                 console.log("Backup response data:", data);
                 if (data.success) {
-                    backupStatus.innerHTML = `<div class="alert alert-success">
-                        <strong>Success!</strong> ${data.message}
-                    </div>`;
-                    // Reload the backups list after a short delay to ensure the server has processed everything
-                    setTimeout(() => {
+                    // The backup runs in the background; follow its progress until it finishes
+                    watchBackupProgress(backupStatus, () => {
+                        createBackupBtn.disabled = false;
+                        isCreatingBackup = false;
                         if (backupsList) {
                             loadBackupsList();
                         }
-                    }, 1000);
+                    });
+                    return;
                 } else {
                     backupStatus.innerHTML = `<div class="alert alert-danger">
                         <strong>Error!</strong> ${data.message || data.error || 'Unknown error'}
@@ -128,6 +130,12 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Follow a backup started by the form on the utilities page
+    const backupProgress = document.getElementById('backupProgress');
+    if (backupProgress && backupProgress.dataset.running === '1') {
+        watchBackupProgress(backupProgress);
+    }
+    
     // Restore database
     if (restoreForm) {
         restoreForm.addEventListener('submit', function(e) {
@@ -302,12 +310,11 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         
+        // Revalidate with the stored ETag: an unchanged list comes back as a 304
         fetch('/database/backups', {
+            cache: 'no-cache',
             headers: {
-                'X-Requested-With': 'XMLHttpRequest',
-                'Cache-Control': 'no-cache, no-store, must-revalidate',
-                'Pragma': 'no-cache',
-                'Expires': '0'
+                'X-Requested-With': 'XMLHttpRequest'
             }
         })
         .then(response => {
@@ -468,7 +475,7 @@ window.restoreFromBackup = function(filename) {
         if (data.success) {
             backupsList.innerHTML = `<div class="alert alert-success">
                 <strong>Success!</strong> ${data.message || 'Database restored successfully.'}
-                <div class="mt-2">The application will need to be restarted to apply the changes.</div>
+                <div class="mt-2">The previous state was saved as ${data.pre_restore_backup}.</div>
             </div>`;
         } else {
             window.location.href = '/database/utilities?tab=backups';
@@ -519,3 +526,52 @@ window.deleteBackup = function(filename) {
         }, 3000);
     });
 };
+
+// Poll the status of a background backup and render it into container until it finishes
+function watchBackupProgress(container, onFinished) {
+    if (!container) return;
+    
+    function render(backup) {
+        if (backup.status === 'running') {
+            const percent = backup.pages_total ? Math.floor(backup.pages_done * 100 / backup.pages_total) : 0;
+            container.innerHTML = `<div class="alert alert-info">
+                Creating backup ${backup.filename} (${backup.phase || 'copying'})...
+                <div class="progress mt-2">
+                    <div class="progress-bar progress-bar-striped progress-bar-animated" role="progressbar"
+                         style="width: ${percent}%" aria-valuenow="${percent}" aria-valuemin="0" aria-valuemax="100">${percent}%</div>
+                </div>
+            </div>`;
+        } else if (backup.status === 'done') {
+            container.innerHTML = `<div class="alert alert-success">
+                <strong>Success!</strong> Backup ${backup.filename} created and verified (${(backup.size / 1024).toFixed(2)} KB,
+                ${backup.attachments_added || 0} new of ${backup.attachments || 0} attachments).
+            </div>`;
+        } else if (backup.status === 'failed') {
+            container.innerHTML = `<div class="alert alert-danger">
+                <strong>Error!</strong> ${backup.error || 'Backup failed'}
+            </div>`;
+        }
+    }
+    
+    function poll() {
+        fetch('/database/backup/status', {
+            headers: { 'X-Requested-With': 'XMLHttpRequest' },
+            cache: 'no-cache'
+        })
+        .then(response => response.json())
+        .then(data => {
+            render(data.backup);
+            if (data.backup.status === 'running') {
+                setTimeout(poll, 1000);
+            } else if (onFinished) {
+                onFinished(data.backup);
+            }
+        })
+        .catch(error => {
+            console.error("Backup status error:", error);
+            setTimeout(poll, 3000);
+        });
+    }
+    
+    poll();
+}
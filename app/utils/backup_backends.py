@@ -0,0 +1,302 @@
+import os
+import re
+import gzip
+import time
+import shutil
+import hashlib
+import sqlite3
+import tempfile
+import subprocess
+from flask import current_app
+from app import db
+
+# Tables a snapshot must have to be accepted as a backup of this app
+REQUIRED_TABLES = ('projects', 'users', 'letters')
+
+# Pages copied per step of the SQLite backup API. The source is only locked
+# while a step runs, so requests can keep writing between steps.
+BACKUP_PAGES_PER_STEP = 256
+
+# Pause between steps, giving waiting writers a turn at the lock
+BACKUP_STEP_PAUSE = 0.005
+
+# Seconds between progress reports while pg_dump runs
+DUMP_POLL_INTERVAL = 0.5
+
+# Seconds pg_restore waits for a table lock before giving up, rather than
+# queueing behind a long transaction while every new request queues behind it
+RESTORE_LOCK_TIMEOUT = 30
+
+CHUNK_SIZE = 1024 * 1024
+
+REFERENCED_BLOBS_SQL = 'SELECT DISTINCT file_hash FROM letters WHERE file_hash IS NOT NULL'
+
+class BackendError(Exception):
+    """A snapshot could not be taken, read or restored"""
+
+class DatabaseBackend:
+    """
+    Takes and restores snapshots of one kind of database. create_backup() and
+    restore_database_file() handle status, manifests and attachments; a
+    backend only deals with the database itself.
+    """
+    name = None
+    # Extension of the snapshots it writes
+    snapshot_suffix = None
+    # Extensions of files that can be uploaded for restore
+    upload_extensions = ()
+
+    def __init__(self, url):
+        self.url = url
+
+    def label(self):
+        """Name of the database, used in backup filenames"""
+        raise NotImplementedError
+
+    def check(self):
+        """Raise BackendError if the database can't be backed up"""
+
+    def snapshot(self, target_path, report):
+        """
+        Write a consistent snapshot of the live database to target_path, calling
+        report(phase=..., done=..., total=...) as it goes. Returns
+        (sha256, size, blobs): the digest and size that extract() will check,
+        and the attachment hashes the snapshot references.
+        """
+        raise NotImplementedError
+
+    def extract(self, snapshot_path, sha256, work_dir):
+        """A file restore() accepts, from a snapshot. Returns (path, is_temporary)."""
+        raise NotImplementedError
+
+    def validate(self, path):
+        """Raise BackendError unless path holds an intact database with this app's tables"""
+        raise NotImplementedError
+
+    def restore(self, path):
+        """Replace the contents of the live database with a validated file, in one transaction"""
+        raise NotImplementedError
+
+def _missing_tables(tables):
+    missing = [table for table in REQUIRED_TABLES if table not in tables]
+    if missing:
+        raise BackendError(f"The backup is missing tables: {', '.join(missing)}")
+
+def _file_digest(path):
+    sha = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+            size += len(chunk)
+    return sha.hexdigest(), size
+
+class SQLiteBackend(DatabaseBackend):
+    """Copies with the SQLite backup API; snapshots are gzip-compressed database files"""
+    name = 'sqlite'
+    snapshot_suffix = '.db.gz'
+    upload_extensions = ('.db',)
+
+    @property
+    def path(self):
+        return os.path.abspath(self.url.database)
+
+    def label(self):
+        return os.path.basename(self.path)
+
+    def check(self):
+        if not os.path.exists(self.path):
+            raise BackendError(f'Database file not found at path: {self.path}')
+
+    def snapshot(self, target_path, report):
+        copy_path = target_path + '.snapshot'
+
+        def progress(step_status, remaining, total):
+            report(done=total - remaining, total=total)
+            time.sleep(BACKUP_STEP_PAUSE)
+
+        try:
+            source = sqlite3.connect(self.path, timeout=30)
+            target = sqlite3.connect(copy_path)
+            try:
+                source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=progress)
+                total = target.execute('PRAGMA page_count').fetchone()[0]
+                report(phase='verifying', done=total, total=total)
+                problems = [row[0] for row in target.execute('PRAGMA integrity_check')]
+                blobs = self._referenced_blobs(target)
+            finally:
+                target.close()
+                source.close()
+
+            if problems != ['ok']:
+                raise BackendError(f"Backup failed the integrity check: {'; '.join(problems[:5])}")
+
+            report(phase='compressing')
+            sha256, size = self._compress(copy_path, target_path)
+        finally:
+            if os.path.exists(copy_path):
+                os.remove(copy_path)
+        return sha256, size, blobs
+
+    def _referenced_blobs(self, connection):
+        try:
+            return {digest for (digest,) in connection.execute(REFERENCED_BLOBS_SQL)}
+        except sqlite3.OperationalError:
+            return set()
+
+    def _compress(self, source_path, target_path):
+        # Returns the SHA-256 and size of the uncompressed snapshot
+        sha = hashlib.sha256()
+        size = 0
+        with open(source_path, 'rb') as source, gzip.open(target_path, 'wb', compresslevel=6) as target:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                sha.update(chunk)
+                size += len(chunk)
+                target.write(chunk)
+        return sha.hexdigest(), size
+
+    def extract(self, snapshot_path, sha256, work_dir):
+        fd, temp_path = tempfile.mkstemp(prefix='.restore-', suffix='.db', dir=work_dir)
+        os.close(fd)
+        try:
+            sha = hashlib.sha256()
+            with gzip.open(snapshot_path, 'rb') as source, open(temp_path, 'wb') as target:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    sha.update(chunk)
+                    target.write(chunk)
+            if sha.hexdigest() != sha256:
+                raise BackendError(f'Backup {os.path.basename(snapshot_path)} does not match its manifest')
+        except Exception:
+            os.remove(temp_path)
+            raise
+        return temp_path, True
+
+    def validate(self, path):
+        try:
+            connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+            try:
+                problems = [row[0] for row in connection.execute('PRAGMA integrity_check')]
+                tables = {name for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            finally:
+                connection.close()
+        except sqlite3.DatabaseError as e:
+            raise BackendError(f'Not a valid SQLite database: {str(e)}')
+
+        if problems != ['ok']:
+            raise BackendError(f"The backup failed the integrity check: {'; '.join(problems[:5])}")
+        _missing_tables(tables)
+
+    def restore(self, path):
+        # The backup API writes the whole file in a single write transaction: other
+        # connections see either the old database or the new one, and keep their handles
+        source = sqlite3.connect(path)
+        target = sqlite3.connect(self.path, timeout=30)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+class PostgresBackend(DatabaseBackend):
+    """Uses pg_dump and pg_restore; snapshots are custom-format archives, compressed by pg_dump"""
+    name = 'postgresql'
+    snapshot_suffix = '.dump'
+    upload_extensions = ('.dump',)
+
+    def label(self):
+        return self.url.database
+
+    def _tool(self, name):
+        configured = current_app.config.get(f'{name.upper()}_PATH') or name
+        path = shutil.which(configured)
+        if path is None:
+            raise BackendError(f'{configured} was not found; install the PostgreSQL client tools '
+                               f'or set {name.upper()}_PATH')
+        return path
+
+    def _env(self):
+        # Connection settings go through libpq's environment, keeping the password off the command line
+        env = dict(os.environ)
+        url = self.url
+        for key, value in (('PGHOST', url.host), ('PGPORT', url.port), ('PGUSER', url.username),
+                           ('PGPASSWORD', url.password), ('PGDATABASE', url.database),
+                           ('PGSSLMODE', url.query.get('sslmode'))):
+            if value is not None:
+                env[key] = str(value)
+        return env
+
+    def _run(self, args, env=None):
+        result = subprocess.run(args, env=env or self._env(), capture_output=True, text=True)
+        if result.returncode != 0:
+            error = result.stderr.strip().splitlines()
+            raise BackendError(f"{os.path.basename(args[0])} failed: {' '.join(error[-3:]) or result.returncode}")
+        return result.stdout
+
+    def check(self):
+        self._tool('pg_dump')
+
+    def _referenced_blobs(self):
+        with db.engine.connect() as connection:
+            return {digest for (digest,) in connection.exec_driver_sql(REFERENCED_BLOBS_SQL)}
+
+    def snapshot(self, target_path, report):
+        # pg_dump works from a snapshot taken when it starts. Attachments referenced
+        # before or after that cover every row it can contain, even with concurrent writes.
+        blobs = self._referenced_blobs()
+        report(phase='dumping')
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(
+                [self._tool('pg_dump'), '--format=custom', '--compress=6', '--no-owner', '--no-privileges',
+                 f'--file={target_path}'],
+                env=self._env(), stdout=subprocess.DEVNULL, stderr=errors
+            )
+            while process.poll() is None:
+                # Also keeps the status fresh, so a long dump isn't taken for a dead one
+                report(done=os.path.getsize(target_path) if os.path.exists(target_path) else 0)
+                time.sleep(DUMP_POLL_INTERVAL)
+            if process.returncode != 0:
+                errors.seek(0)
+                message = errors.read().decode(errors='replace').strip().splitlines()
+                raise BackendError(f"pg_dump failed: {' '.join(message[-3:]) or process.returncode}")
+        blobs |= self._referenced_blobs()
+
+        report(phase='verifying')
+        self.validate(target_path)
+        sha256, size = _file_digest(target_path)
+        return sha256, size, blobs
+
+    def extract(self, snapshot_path, sha256, work_dir):
+        # pg_restore reads the archive directly
+        if _file_digest(snapshot_path)[0] != sha256:
+            raise BackendError(f'Backup {os.path.basename(snapshot_path)} does not match its manifest')
+        return snapshot_path, False
+
+    def validate(self, path):
+        # Reading the table of contents checks the archive; its TABLE entries give the tables
+        try:
+            listing = self._run([self._tool('pg_restore'), '--list', path])
+        except BackendError as e:
+            raise BackendError(f'Not a valid pg_dump archive: {str(e)}')
+        tables = set(re.findall(r'^\d+; \d+ \d+ TABLE (?!DATA )\S+ (\S+)', listing, flags=re.MULTILINE))
+        _missing_tables(tables)
+
+    def restore(self, path):
+        # --clean drops and recreates every object in the archive. With
+        # --single-transaction other sessions keep seeing the old data until the commit.
+        env = self._env()
+        env['PGOPTIONS'] = f"{env.get('PGOPTIONS', '')} -c lock_timeout={RESTORE_LOCK_TIMEOUT}s".strip()
+        db.engine.dispose()
+        self._run([self._tool('pg_restore'), '--clean', '--if-exists', '--no-owner', '--no-privileges',
+                   '--single-transaction', '--exit-on-error', f'--dbname={self.url.database}', path], env=env)
+
+BACKENDS = {backend.name: backend for backend in (SQLiteBackend, PostgresBackend)}
+
+def get_backend():
+    """The backup backend for the app's database"""
+    url = db.engine.url
+    backend = BACKENDS.get(url.get_backend_name())
+    if backend is None:
+        raise BackendError(f'Backups are not supported for {url.get_backend_name()} databases')
+    if backend is SQLiteBackend and url.database in (None, '', ':memory:'):
+        raise BackendError('In-memory SQLite databases cannot be backed up')
+    return backend(url)
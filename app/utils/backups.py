@@ -0,0 +1,352 @@
+import os
+import json
+import time
+import shutil
+import threading
+from datetime import datetime
+from flask import current_app
+from app import db
+from app.utils.backup_backends import BACKENDS, BackendError, get_backend
+
+# Minimum seconds between progress updates written to the status file
+PROGRESS_INTERVAL = 0.5
+
+# A 'running' status that hasn't been updated for this long belongs to a backup that died
+STALE_STATUS_AFTER = 120
+
+# Progress of the current or last backup, shared by all app processes
+STATUS_FILENAME = '.backup-status.json'
+
+# A backup is a compressed database snapshot, written by the database's backend,
+# plus a manifest listing the attachment blobs it references. Blobs are kept once,
+# by hash, in the backup blob store, so each backup only adds the attachments
+# that are new since the last.
+SNAPSHOT_SUFFIXES = tuple(backend.snapshot_suffix for backend in BACKENDS.values())
+MANIFEST_SUFFIX = '.manifest.json'
+BACKUP_BLOB_DIR = 'blobs'
+MANIFEST_FORMAT = 1
+
+# Older backups are plain SQLite database copies
+BACKUP_EXTENSIONS = ('.db',) + SNAPSHOT_SUFFIXES
+
+class BackupError(Exception):
+    """A backup could not be started or did not complete"""
+
+# Held for the duration of a backup in this process
+_lock = threading.Lock()
+
+def get_database_path():
+    """Absolute path of the SQLite database file, or None for other databases"""
+    url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    return os.path.abspath(url.database)
+
+def get_backup_backend():
+    """The backend that backs up the app's database, or BackupError if there is none"""
+    try:
+        return get_backend()
+    except BackendError as e:
+        raise BackupError(str(e))
+
+def get_backup_dir():
+    """Directory holding backup files, created if needed"""
+    backup_dir = os.path.join(current_app.root_path, 'backups')
+    os.makedirs(backup_dir, exist_ok=True)
+    return backup_dir
+
+def backup_filename(prefix=''):
+    """Name for a new backup of the current database, e.g. auto_letter_registry.db_20250101_010000.db.gz"""
+    backend = get_backup_backend()
+    db_name = backend.label()
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f'{prefix}{db_name}_{timestamp}{backend.snapshot_suffix}'
+    # Backups taken within the same second get a counter
+    counter = 1
+    while os.path.exists(os.path.join(get_backup_dir(), filename)):
+        filename = f'{prefix}{db_name}_{timestamp}_{counter}{backend.snapshot_suffix}'
+        counter += 1
+    return filename
+
+def is_backup_file(filename):
+    """Check if a name is a backup in the backups directory (and not a path elsewhere)"""
+    return bool(filename) and os.path.basename(filename) == filename and filename.endswith(BACKUP_EXTENSIONS)
+
+def manifest_path(filename):
+    """Path of the manifest of a compressed backup"""
+    suffix = next(suffix for suffix in SNAPSHOT_SUFFIXES if filename.endswith(suffix))
+    return os.path.join(get_backup_dir(), filename[:-len(suffix)] + MANIFEST_SUFFIX)
+
+def read_manifest(filename):
+    """The manifest of a compressed backup, or None for plain .db backups"""
+    if not filename.endswith(SNAPSHOT_SUFFIXES):
+        return None
+    with open(manifest_path(filename)) as f:
+        return json.load(f)
+
+def backup_blob_path(digest):
+    """Path of an attachment in the backup blob store, sharded like the live blob store"""
+    return os.path.join(get_backup_dir(), BACKUP_BLOB_DIR, digest[:2], digest[2:4], digest)
+
+def list_backup_files():
+    """Filenames of all backups, plain and compressed"""
+    return [filename for filename in os.listdir(get_backup_dir())
+            if is_backup_file(filename) and os.path.isfile(os.path.join(get_backup_dir(), filename))]
+
+def read_backup_status():
+    """Progress of the current or most recent backup"""
+    path = os.path.join(get_backup_dir(), STATUS_FILENAME)
+    try:
+        with open(path) as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return {'status': 'idle'}
+
+    if status.get('status') == 'running' and time.time() - status.get('updated_at', 0) > STALE_STATUS_AFTER:
+        status.update(status='failed', error='The backup was interrupted')
+    return status
+
+def _write_status(backup_dir, status):
+    status['updated_at'] = time.time()
+    path = os.path.join(backup_dir, STATUS_FILENAME)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(temp_path, path)
+
+def backup_running():
+    """Check if a backup is in progress in this or another process"""
+    return _lock.locked() or read_backup_status()['status'] == 'running'
+
+def create_backup(filename=None, prefix=''):
+    """
+    Back up the live database to the backups directory. The database backend
+    takes a consistent, verified and compressed snapshot while writes carry on;
+    attachments it references that aren't in the backup blob store yet are
+    copied there. The manifest is written before the snapshot is renamed into
+    place, so a listed backup is always complete. Returns the backup filename.
+    """
+    backend = get_backup_backend()
+    try:
+        backend.check()
+    except BackendError as e:
+        raise BackupError(str(e))
+
+    if not _lock.acquire(blocking=False):
+        raise BackupError('A backup is already running')
+    try:
+        backup_dir = get_backup_dir()
+        filename = filename or backup_filename(prefix)
+        backup_path = os.path.join(backup_dir, filename)
+        if os.path.exists(backup_path):
+            raise BackupError('This backup already exists')
+
+        status = {
+            'status': 'running',
+            'phase': 'copying',
+            'filename': filename,
+            'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'pages_done': 0,
+            'pages_total': 0
+        }
+        _write_status(backup_dir, status)
+        last_update = [time.monotonic()]
+
+        def report(phase=None, done=None, total=None):
+            if phase:
+                status['phase'] = phase
+            if done is not None:
+                status.update(pages_done=done, pages_total=total or 0)
+            if phase or time.monotonic() - last_update[0] >= PROGRESS_INTERVAL:
+                _write_status(backup_dir, status)
+                last_update[0] = time.monotonic()
+
+        partial_path = backup_path + '.partial'
+        started = time.monotonic()
+        try:
+            try:
+                snapshot_sha256, snapshot_size, digests = backend.snapshot(partial_path, report)
+            except BackendError as e:
+                raise BackupError(str(e))
+
+            report(phase='attachments')
+            added, missing = _copy_blobs(digests)
+
+            manifest = {
+                'format': MANIFEST_FORMAT,
+                'backend': backend.name,
+                'snapshot': filename,
+                'created_at': status['started_at'],
+                'database_sha256': snapshot_sha256,
+                'database_size': snapshot_size,
+                'blobs': sorted(digests),
+                'missing_blobs': missing
+            }
+            _write_json(manifest_path(filename), manifest)
+            os.replace(partial_path, backup_path)
+        except Exception as e:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            status.update(status='failed', error=str(e))
+            _write_status(backup_dir, status)
+            raise
+
+        status.update(
+            status='done',
+            phase=None,
+            size=os.path.getsize(backup_path),
+            database_size=snapshot_size,
+            attachments=len(digests),
+            attachments_added=added,
+            seconds=round(time.monotonic() - started, 2),
+            integrity='ok'
+        )
+        _write_status(backup_dir, status)
+        current_app.logger.info(
+            f"Backup created: {filename} ({status['size']} bytes, {added} new of {len(digests)} attachments, {status['seconds']}s)")
+        if missing:
+            current_app.logger.warning(f"Backup {filename}: {len(missing)} attachments were missing from the blob store")
+        return filename
+    finally:
+        _lock.release()
+
+def _copy_blobs(digests):
+    # Copy attachments into the backup blob store unless an earlier backup already holds them
+    from app.utils.blobstore import blob_path
+    added = 0
+    missing = []
+    for digest in sorted(digests):
+        target = backup_blob_path(digest)
+        if os.path.exists(target):
+            continue
+        source = blob_path(digest)
+        if not os.path.exists(source):
+            missing.append(digest)
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = target + '.partial'
+        shutil.copyfile(source, temp_path)
+        os.replace(temp_path, target)
+        added += 1
+    return added, missing
+
+def _write_json(path, data):
+    temp_path = path + '.partial'
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+def delete_backup(filename, prune=True):
+    """Delete a backup and its manifest, then the attachments no other backup references"""
+    if not is_backup_file(filename):
+        raise BackupError('Invalid backup filename')
+    path = os.path.join(get_backup_dir(), filename)
+    if not os.path.exists(path):
+        raise BackupError(f'Backup file not found: {filename}')
+
+    os.remove(path)
+    if filename.endswith(SNAPSHOT_SUFFIXES) and os.path.exists(manifest_path(filename)):
+        os.remove(manifest_path(filename))
+    if prune:
+        prune_backup_blobs()
+
+def prune_backup_blobs():
+    """Remove attachments from the backup blob store that no remaining backup references. Returns the number removed."""
+    if backup_running():
+        return 0
+
+    backup_dir = get_backup_dir()
+    referenced = set()
+    for filename in os.listdir(backup_dir):
+        if not filename.endswith(MANIFEST_SUFFIX):
+            continue
+        with open(os.path.join(backup_dir, filename)) as f:
+            manifest = json.load(f)
+        if not os.path.exists(os.path.join(backup_dir, manifest['snapshot'])):
+            # Left behind by a backup that stopped before its snapshot was renamed into place
+            os.remove(os.path.join(backup_dir, filename))
+            continue
+        referenced.update(manifest['blobs'])
+
+    removed = 0
+    for dirpath, _, filenames in os.walk(os.path.join(backup_dir, BACKUP_BLOB_DIR)):
+        for filename in filenames:
+            if filename not in referenced:
+                os.remove(os.path.join(dirpath, filename))
+                removed += 1
+    return removed
+
+def materialize_backup(filename):
+    """
+    Get a file for a backup that the database backend can restore, and put any
+    attachments it references back into the live blob store if they are missing.
+    Returns (path, is_temporary); temporary files are for the caller to remove.
+    """
+    if not is_backup_file(filename):
+        raise BackupError('Invalid backup filename')
+    path = os.path.join(get_backup_dir(), filename)
+    if not os.path.exists(path):
+        raise BackupError(f'Backup file not found: {filename}')
+
+    backend = get_backup_backend()
+    manifest = read_manifest(filename)
+    source_backend = manifest.get('backend', 'sqlite') if manifest else 'sqlite'
+    if source_backend != backend.name:
+        raise BackupError(f'Backup {filename} was taken from a {source_backend} database '
+                          f'and cannot be restored into {backend.name}')
+    if manifest is None:
+        return path, False
+
+    try:
+        temp_path, is_temporary = backend.extract(path, manifest['database_sha256'], get_backup_dir())
+    except BackendError as e:
+        raise BackupError(str(e))
+    try:
+        from app.utils.blobstore import blob_exists, new_temp_path, store_file
+        for digest in manifest['blobs']:
+            if blob_exists(digest) or not os.path.exists(backup_blob_path(digest)):
+                continue
+            blob_temp = new_temp_path()
+            shutil.copyfile(backup_blob_path(digest), blob_temp)
+            store_file(blob_temp, digest, os.path.getsize(blob_temp))
+    except Exception:
+        if is_temporary:
+            os.remove(temp_path)
+        raise
+    return temp_path, is_temporary
+
+def start_backup(prefix='', on_success=None):
+    """
+    Run create_backup() in a background thread, then on_success(filename) if given.
+    Returns the filename the backup will have.
+    """
+    get_backup_backend()
+    if backup_running():
+        raise BackupError('A backup is already running')
+
+    app = current_app._get_current_object()
+    filename = backup_filename(prefix)
+    if os.path.exists(os.path.join(get_backup_dir(), filename)):
+        raise BackupError('This backup already exists')
+
+    # Report the backup as running straight away, before the thread gets going
+    _write_status(get_backup_dir(), {
+        'status': 'running',
+        'phase': 'starting',
+        'filename': filename,
+        'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'pages_done': 0,
+        'pages_total': 0
+    })
+
+    def run():
+        with app.app_context():
+            try:
+                create_backup(filename)
+                if on_success:
+                    on_success(filename)
+            except Exception as e:
+                app.logger.error(f"Background backup failed: {str(e)}")
+
+    threading.Thread(target=run, name='database-backup', daemon=True).start()
+    return filename
@@ -0,0 +1,263 @@
+import os
+import time
+import itertools
+import hashlib
+import tempfile
+from flask import current_app, send_file, Response
+from app import db
+from app.models.blob import Blob
+from app.utils.http_cache import not_modified, tag_response
+
+CHUNK_SIZE = 1024 * 1024
+
+# Every PDF starts with this signature
+PDF_MAGIC = b'%PDF-'
+
+# Blob URLs that carry the digest never change content, so browsers may keep them for a year
+IMMUTABLE_CACHE = 'private, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'private, no-cache'
+
+# Files of purged blobs are renamed with this suffix rather than deleted, and
+# removed by collect_garbage() once they are older than its min_age
+PURGED_SUFFIX = '.purged'
+
+class InvalidUploadError(ValueError):
+    """An uploaded file was rejected before being stored"""
+
+def get_blob_root():
+    """Get the root directory of the blob store, creating it if needed"""
+    root = current_app.config['BLOB_STORE_FOLDER']
+    os.makedirs(root, exist_ok=True)
+    return root
+
+def blob_path(digest):
+    """Get the sharded path of a blob, e.g. blobs/ab/cd/abcd..."""
+    return os.path.join(get_blob_root(), digest[:2], digest[2:4], digest)
+
+def blob_exists(digest):
+    """Check if a blob file is present on disk"""
+    return bool(digest) and os.path.exists(blob_path(digest))
+
+def hash_file(path):
+    """Compute the SHA-256 digest and size of a file without loading it into memory"""
+    sha = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+            size += len(chunk)
+    return sha.hexdigest(), size
+
+def new_temp_path():
+    """Create a temp file inside the blob store so it can be renamed into place atomically"""
+    fd, path = tempfile.mkstemp(prefix='.incoming-', dir=get_blob_root())
+    os.close(fd)
+    return path
+
+def store_file(path, digest=None, size=None):
+    """
+    Move a file into the blob store and return (digest, size).
+    If an identical blob already exists the file is discarded instead of stored twice.
+    """
+    if digest is None or size is None:
+        digest, size = hash_file(path)
+
+    target = blob_path(digest)
+    if os.path.exists(target):
+        os.remove(path)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+    return digest, size
+
+def store_bytes(data):
+    """Write an in-memory payload into the blob store and return (digest, size)"""
+    temp_path = new_temp_path()
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        return store_file(temp_path, hashlib.sha256(data).hexdigest(), len(data))
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def store_upload(file, magic=PDF_MAGIC):
+    """
+    Stream an uploaded file into the blob store and return (digest, size).
+    The upload is copied in chunks to a temp file, hashed as it is written and
+    renamed into place, so it is never held in memory or read back from disk.
+    Raises InvalidUploadError if the file does not start with `magic`.
+    """
+    return store_stream(file.stream, magic)
+
+def store_stream(stream, magic=PDF_MAGIC):
+    """Like store_upload(), for any binary file object"""
+    temp_path = new_temp_path()
+    try:
+        sha = hashlib.sha256()
+        size = 0
+        with open(temp_path, 'wb') as f:
+            header = _read_header(stream, len(magic or b''))
+            if magic and not header.startswith(magic):
+                raise InvalidUploadError('The uploaded file is not a valid PDF')
+
+            for chunk in itertools.chain((header,), iter(lambda: stream.read(CHUNK_SIZE), b'')):
+                sha.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if size == 0:
+            raise InvalidUploadError('The uploaded file is empty')
+        return store_file(temp_path, sha.hexdigest(), size)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def _read_header(stream, length):
+    # Stream reads may return short; keep reading until the header is complete or the stream ends
+    header = b''
+    while len(header) < length:
+        chunk = stream.read(length - len(header))
+        if not chunk:
+            break
+        header += chunk
+    return header
+
+def send_blob(digest, download_name, mimetype='application/pdf', as_attachment=True, immutable=False, suffix=''):
+    """
+    Respond with a blob, using its digest as a strong ETag. Range and
+    conditional requests are honoured. Depending on FILE_TRANSFER_MODE the
+    bytes are streamed by the app ('app') or handed to the front web server
+    with X-Accel-Redirect ('x-accel') or X-Sendfile ('x-sendfile').
+    `suffix` selects a file derived from the blob, such as its preview.
+    Permission checks must be done by the caller.
+    """
+    etag = digest + suffix
+    cache_control = IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE
+    cached = not_modified(etag, cache_control)
+    if cached is not None:
+        return cached
+
+    path = blob_path(digest) + suffix
+    mode = current_app.config.get('FILE_TRANSFER_MODE', 'app')
+    if mode in ('x-accel', 'x-sendfile'):
+        response = Response(mimetype=mimetype)
+        if mode == 'x-accel':
+            prefix = current_app.config.get('BLOB_ACCEL_PREFIX', '/protected-blobs/').rstrip('/')
+            response.headers['X-Accel-Redirect'] = f"{prefix}/{digest[:2]}/{digest[2:4]}/{etag}"
+        else:
+            response.headers['X-Sendfile'] = path
+        response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline',
+                             filename=download_name)
+        return tag_response(response, etag, cache_control)
+
+    response = send_file(
+        path,
+        mimetype=mimetype,
+        as_attachment=as_attachment,
+        download_name=download_name,
+        conditional=True,
+        etag=etag
+    )
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def acquire_blob(digest, size):
+    """
+    Add a reference to a blob. Runs inside the caller's transaction;
+    the caller is responsible for committing.
+    """
+    updated = Blob.query.filter_by(sha256=digest).update(
+        {Blob.ref_count: Blob.ref_count + 1}, synchronize_session=False)
+    if not updated:
+        db.session.add(Blob(sha256=digest, size=size, ref_count=1))
+
+    # store_file() may have found the file and discarded its own copy just before
+    # purge_blob() moved it aside. The update above waits for the purge to commit,
+    # so the file is back in place before this reference is committed.
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        try:
+            os.replace(path + PURGED_SUFFIX, path)
+        except FileNotFoundError:
+            current_app.logger.error(f"Blob {digest} is referenced but missing from the blob store")
+
+def _retire_file(path):
+    # Move a blob file aside, stamped with the time it was retired
+    try:
+        os.replace(path, path + PURGED_SUFFIX)
+    except FileNotFoundError:
+        return False
+    os.utime(path + PURGED_SUFFIX)
+    return True
+
+def release_blob(digest):
+    """
+    Drop a reference to a blob. Runs inside the caller's transaction;
+    call purge_blob() after committing to remove the file once unreferenced.
+    """
+    if digest:
+        Blob.query.filter_by(sha256=digest).update(
+            {Blob.ref_count: Blob.ref_count - 1}, synchronize_session=False)
+
+def purge_blob(digest):
+    """
+    Delete a blob row and retire its file if nothing references it any more.
+    The reference count is checked by the DELETE itself, and the file is moved
+    aside before the commit, while the row is still locked against acquire_blob().
+    """
+    if not digest:
+        return False
+
+    deleted = Blob.query.filter(Blob.sha256 == digest, Blob.ref_count <= 0)\
+        .delete(synchronize_session=False)
+    if not deleted:
+        db.session.commit()
+        return False
+
+    retired = _retire_file(blob_path(digest))
+    db.session.commit()
+    if retired:
+        current_app.logger.info(f"Removed unreferenced blob {digest}")
+
+    from app.utils.previews import remove_preview
+    remove_preview(digest)
+    return True
+
+def collect_garbage(min_age=3600):
+    """
+    Remove unreferenced blob rows, their files and previews, and stale temp files.
+    Files younger than min_age seconds are left alone, since they may belong to an upload still in flight.
+    Blob files are retired first and deleted on a later run, so a concurrent
+    upload of the same content can still bring them back.
+    Returns the number of files removed.
+    """
+    removed = 0
+    for (digest,) in db.session.query(Blob.sha256).filter(Blob.ref_count <= 0).all():
+        if purge_blob(digest):
+            removed += 1
+
+    known = {digest for (digest,) in db.session.query(Blob.sha256)}
+    root = get_blob_root()
+    cutoff = time.time() - min_age
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if filename.endswith(PURGED_SUFFIX):
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+                continue
+            digest = filename.split('.', 1)[0]
+            orphaned = filename.startswith('.incoming-') or (dirpath != root and digest not in known)
+            if orphaned and os.path.getmtime(path) < cutoff:
+                if filename == digest:
+                    _retire_file(path)
+                else:
+                    os.remove(path)
+                removed += 1
+    return removed
@@ -1,10 +1,16 @@
 import os
-import shutil
-from datetime import datetime
 from flask import current_app
 from app import db, scheduler
 from app.models.setting import Setting
 from app.utils.notifications import create_notification
+from app.utils.backups import create_backup, delete_backup, get_backup_dir, list_backup_files, prune_backup_blobs
+
+def insert_ignore(table, dialect_name):
+    """INSERT statement that skips rows whose primary key already exists, without aborting the transaction"""
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing()
+    return table.insert().prefix_with('OR IGNORE', dialect='sqlite').prefix_with('IGNORE', dialect='mysql')
 
 def auto_backup_database():
     """Create an automatic database backup"""
@@ -15,37 +21,8 @@ def auto_backup_database():
         
     current_app.logger.info("Running scheduled auto-backup")
     try:
-        # Get the current database path
-        db_uri = current_app.config['SQLALCHEMY_DATABASE_URI']
-        if not db_uri.startswith('sqlite:///'):
-            current_app.logger.error("Auto-backup only supports SQLite databases")
-            return
-            
-        if db_uri[10:].startswith('/'):
-            # Absolute path
-            db_path = db_uri[10:]
-        else:
-            # Relative path
-            db_path = os.path.join(current_app.root_path, db_uri[10:])
-        
-        if not os.path.exists(db_path):
-            current_app.logger.error(f"Database file not found at path: {db_path}")
-            return
-            
-        # Create backup filename
-        db_name = os.path.basename(db_path)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_filename = f'auto_{db_name}_{timestamp}.db'
-        
-        # Create backups directory if it doesn't exist
-        backup_dir = os.path.join(current_app.root_path, 'backups')
-        if not os.path.exists(backup_dir):
-            os.makedirs(backup_dir)
-            
-        backup_path = os.path.join(backup_dir, backup_filename)
-        
-        # Copy the current database file to the backup directory
-        shutil.copy2(db_path, backup_path)
+        # Taken online by the database's backup backend, so writes can continue while it runs
+        backup_filename = create_backup(prefix='auto_')
         
         current_app.logger.info(f"Auto backup created: {backup_filename}")
         
@@ -67,30 +44,35 @@ def auto_backup_database():
         current_app.logger.error(f"Error during auto-backup: {str(e)}")
 
 def cleanup_old_auto_backups():
-    """Remove old auto-backups, keeping only recent ones"""
+    """
+    Remove old auto-backups, keeping only recent ones. Attachments are shared
+    between backups, so they are only removed once no remaining backup references them.
+    """
     try:
         max_backups = int(Setting.get('auto_backup_keep_count', 5))
-        backup_dir = os.path.join(current_app.root_path, 'backups')
+        backup_dir = get_backup_dir()
         
         # Get all auto-backup files sorted by modification time (oldest first)
         auto_backups = []
-        for filename in os.listdir(backup_dir):
-            if filename.startswith('auto_') and filename.endswith('.db'):
-                file_path = os.path.join(backup_dir, filename)
-                if os.path.isfile(file_path):
-                    auto_backups.append((file_path, os.path.getmtime(file_path)))
+        for filename in list_backup_files():
+            if filename.startswith('auto_'):
+                auto_backups.append((filename, os.path.getmtime(os.path.join(backup_dir, filename))))
         
         # Sort by modification time (oldest first)
         auto_backups.sort(key=lambda x: x[1])
         
         # Remove old backups if we have more than max_backups
         if len(auto_backups) > max_backups:
-            for file_path, _ in auto_backups[:-max_backups]:
+            for filename, _ in auto_backups[:-max_backups]:
                 try:
-                    os.remove(file_path)
-                    current_app.logger.info(f"Removed old auto-backup: {os.path.basename(file_path)}")
+                    delete_backup(filename, prune=False)
+                    current_app.logger.info(f"Removed old auto-backup: {filename}")
                 except Exception as e:
                     current_app.logger.error(f"Error removing old auto-backup: {str(e)}")
+        
+        removed = prune_backup_blobs()
+        if removed:
+            current_app.logger.info(f"Removed {removed} attachments no longer referenced by any backup")
     except Exception as e:
         current_app.logger.error(f"Error cleaning up old auto-backups: {str(e)}")
 
@@ -101,9 +83,64 @@ def allowed_file(filename):
 def create_tables():
     """Create all database tables if they don't exist"""
     from app import db
+    from sqlalchemy import inspect
+    had_letter_stats = inspect(db.engine).has_table('project_letter_stats')
     db.create_all()
+    upgrade_schema()
+    
+    from app.utils.search import ensure_search_index
+    ensure_search_index()
+    
+    # Seed the per-project letter counters the first time their table appears
+    if not had_letter_stats:
+        from app.utils.letter_stats import reconcile_letter_stats
+        reconcile_letter_stats()
     print("Database tables created")
 
+# Indexes no longer declared on the models, dropped from existing databases.
+# Letter numbers now come from letter_sequences, which only reads the letters
+# table once to seed a new sequence.
+OBSOLETE_INDEXES = {
+    'letters': ('ix_letters_type_ho_number', 'ix_letters_project_type_number'),
+}
+
+def upgrade_schema():
+    """
+    Add columns and indexes declared on the models that are missing from
+    existing tables, and drop the indexes listed in OBSOLETE_INDEXES
+    """
+    from sqlalchemy import inspect, text
+    
+    inspector = inspect(db.engine)
+    existing_tables = inspector.get_table_names()
+    
+    for table in db.metadata.tables.values():
+        if table.name not in existing_tables:
+            continue
+        
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            print(f"Added column {table.name}.{column.name}")
+        
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=db.engine)
+                print(f"Created index {index.name}")
+        
+        for name in OBSOLETE_INDEXES.get(table.name, ()):
+            if name in existing_indexes:
+                # MySQL names the table; SQLite and PostgreSQL index names are schema-wide
+                on_table = f' ON {table.name}' if db.engine.dialect.name == 'mysql' else ''
+                with db.engine.begin() as connection:
+                    connection.execute(text(f'DROP INDEX {name}{on_table}'))
+                print(f"Dropped index {name}")
+
 def init_default_settings():
     """Initialize default settings if they don't exist"""
     from app import db
@@ -117,17 +154,15 @@ def init_default_settings():
         ensure_head_office_project()
         
         # Set default settings if they don't exist
-        settings = [
-            ('auto_backup_enabled', 'true', 'Enable automatic weekly database backups'),
-            ('auto_backup_keep_count', '5', 'Number of automatic backups to keep')
-        ]
+        from app.utils.settings import SETTINGS, format_value
         
-        for key, value, description in settings:
-            setting = Setting.query.filter_by(key=key).first()
+        for definition in SETTINGS.values():
+            setting = Setting.query.filter_by(key=definition.key).first()
             if not setting:
-                setting = Setting(key=key, value=value, description=description)
+                value = format_value(definition.default, definition.type)
+                setting = Setting(key=definition.key, value=value, description=definition.description)
                 db.session.add(setting)
-                print(f"Created default setting: {key}={value}")
+                print(f"Created default setting: {definition.key}={value}")
         
         db.session.commit()
     except Exception as e:
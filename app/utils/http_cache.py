@@ -0,0 +1,20 @@
+from flask import request, make_response, Response
+
+def not_modified(etag, cache_control='private, no-cache'):
+    """A 304 response if the client already holds `etag`, otherwise None"""
+    if etag in request.if_none_match:
+        return tag_response(Response(status=304), etag, cache_control)
+    return None
+
+def tag_response(response, etag, cache_control='private, no-cache'):
+    """Set the ETag and a Cache-Control that makes the client revalidate before reuse"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def conditional_response(etag, build, cache_control='private, no-cache'):
+    """
+    Answer with 304 Not Modified when the client already holds `etag`,
+    otherwise call build() for the full response and tag it.
+    """
+    return not_modified(etag, cache_control) or tag_response(make_response(build()), etag, cache_control)
@@ -0,0 +1,244 @@
+import json
+import threading
+import traceback
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+from app import db, scheduler
+from app.models.job import Job
+
+DEFAULT_MAX_ATTEMPTS = 5
+
+# Jobs claimed per worker tick
+WORKER_BATCH_SIZE = 20
+
+# Retry delays grow as RETRY_BASE_DELAY * 2 ** (attempts - 1), capped at RETRY_MAX_DELAY
+RETRY_BASE_DELAY = timedelta(seconds=10)
+RETRY_MAX_DELAY = timedelta(hours=1)
+
+# A running job not heard from for this long belonged to a worker that died; it
+# is queued again. Jobs that can take longer call job_heartbeat() as they go.
+STALE_AFTER = timedelta(minutes=10)
+
+# Finished jobs are kept this long for the queue statistics
+KEEP_FINISHED = timedelta(days=7)
+
+# Registered job handlers: kind -> function taking the payload as keyword arguments
+JOB_HANDLERS = {}
+
+# The job the current thread is running, for job_heartbeat()
+_current = threading.local()
+
+def job_handler(kind):
+    """Register the function that runs jobs of the given kind"""
+    def decorator(f):
+        JOB_HANDLERS[kind] = f
+        return f
+    return decorator
+
+def enqueue_job(kind, payload=None, delay=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Queue a job in the caller's transaction. It becomes visible to the worker
+    when the caller commits, so work is never queued for a change that rolled back.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"No handler registered for job kind '{kind}'")
+
+    job = Job(
+        kind=kind,
+        payload=json.dumps(payload or {}),
+        max_attempts=max_attempts,
+        run_after=datetime.utcnow() + (delay or timedelta(0))
+    )
+    db.session.add(job)
+    return job
+
+def retry_delay(attempts):
+    """Backoff before the next attempt of a job that has failed `attempts` times"""
+    return min(RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0), RETRY_MAX_DELAY)
+
+def _claim(job_id):
+    """Mark a pending job as running. Returns False if another worker got it first."""
+    table = Job.__table__
+    now = datetime.utcnow()
+    result = db.session.execute(
+        table.update()
+        .where(table.c.id == job_id, table.c.status == 'pending')
+        .values(status='running', attempts=table.c.attempts + 1, started_at=now, heartbeat_at=now)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+def job_heartbeat():
+    """
+    Tell the queue that the job running in this thread is still alive, so it
+    isn't requeued as stale. Long jobs call this between units of work; it
+    commits the session. Does nothing outside a job.
+    """
+    job_id = getattr(_current, 'job_id', None)
+    if job_id is None:
+        return
+    table = Job.__table__
+    db.session.execute(
+        table.update()
+        .where(table.c.id == job_id, table.c.status == 'running')
+        .values(heartbeat_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+def run_job(job):
+    """Run one claimed job and record the outcome"""
+    handler = JOB_HANDLERS.get(job.kind)
+    _current.job_id = job.id
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for job kind '{job.kind}'")
+        handler(**job.data)
+    except Exception as e:
+        db.session.rollback()
+        job = Job.query.get(job.id)
+        job.last_error = f"{e}\n{traceback.format_exc(limit=5)}"[:4000]
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+            current_app.logger.error(f"Job {job.id} ({job.kind}) failed permanently: {str(e)}")
+        else:
+            job.status = 'pending'
+            job.run_after = datetime.utcnow() + retry_delay(job.attempts)
+            current_app.logger.warning(f"Job {job.id} ({job.kind}) failed, will retry: {str(e)}")
+        db.session.commit()
+        return False
+    finally:
+        _current.job_id = None
+
+    job.status = 'done'
+    job.finished_at = datetime.utcnow()
+    job.last_error = None
+    db.session.commit()
+    return True
+
+def requeue_stale_jobs():
+    """Return jobs orphaned in 'running' by a crashed worker to the queue"""
+    table = Job.__table__
+    now = datetime.utcnow()
+    last_seen = func.coalesce(table.c.heartbeat_at, table.c.started_at)
+    stale = (table.c.status == 'running') & (last_seen < now - STALE_AFTER)
+    db.session.execute(
+        table.update()
+        .where(stale, table.c.attempts >= table.c.max_attempts)
+        .values(status='failed', finished_at=now, last_error='Worker stopped while running the job')
+    )
+    result = db.session.execute(
+        table.update()
+        .where(stale)
+        .values(status='pending', run_after=now)
+    )
+    db.session.commit()
+    return result.rowcount
+
+def purge_finished_jobs():
+    """Delete finished jobs older than KEEP_FINISHED"""
+    deleted = Job.query.filter(
+        Job.status.in_(('done', 'failed')),
+        Job.finished_at < datetime.utcnow() - KEEP_FINISHED
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+def process_jobs(limit=WORKER_BATCH_SIZE):
+    """Run due jobs, oldest first. Returns the number of jobs run."""
+    processed = 0
+    while processed < limit:
+        due = Job.query.with_entities(Job.id)\
+            .filter(Job.status == 'pending', Job.run_after <= datetime.utcnow())\
+            .order_by(Job.run_after, Job.id)\
+            .limit(limit - processed)\
+            .all()
+        if not due:
+            break
+
+        for (job_id,) in due:
+            if _claim(job_id):
+                run_job(Job.query.get(job_id))
+                processed += 1
+    return processed
+
+def queue_stats(sample_size=100):
+    """Queue depth and latency figures for the admin view"""
+    now = datetime.utcnow()
+    counts = dict(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+    oldest_pending = db.session.query(func.min(Job.run_after))\
+        .filter(Job.status == 'pending', Job.run_after <= now)\
+        .scalar()
+
+    recent = Job.query.filter(Job.status == 'done')\
+        .order_by(Job.finished_at.desc())\
+        .limit(sample_size)\
+        .all()
+    waits = [(job.started_at - job.created_at).total_seconds() for job in recent if job.started_at]
+    runtimes = [(job.finished_at - job.started_at).total_seconds() for job in recent if job.started_at]
+
+    failures = Job.query.filter(Job.last_error.isnot(None))\
+        .order_by(Job.id.desc())\
+        .limit(10)\
+        .all()
+
+    return {
+        'pending': counts.get('pending', 0),
+        'running': counts.get('running', 0),
+        'done': counts.get('done', 0),
+        'failed': counts.get('failed', 0),
+        'oldest_due_seconds': round((now - oldest_pending).total_seconds(), 1) if oldest_pending else 0,
+        'average_wait_seconds': round(sum(waits) / len(waits), 2) if waits else None,
+        'average_run_seconds': round(sum(runtimes) / len(runtimes), 3) if runtimes else None,
+        'recent_failures': [job.to_dict() for job in failures]
+    }
+
+@job_handler('notifications.send')
+def _send_notification(audience, title, message, project_id=None, user_id=None,
+                       icon="fa-bell", icon_color="bg-primary", link=None):
+    from app.utils.notifications import audience_recipients, fan_out_notification
+    recipients = audience_recipients(audience, project_id=project_id, user_id=user_id)
+    fan_out_notification(recipients, title, message, icon=icon, icon_color=icon_color, link=link)
+
+@job_handler('blobs.purge')
+def _purge_blob(digest):
+    from app.utils.blobstore import purge_blob
+    purge_blob(digest)
+
+@job_handler('imports.run')
+def _run_import(import_id, register, attachments=None, user_id=None, link=None):
+    from app.utils.letter_import import run_import
+    run_import(import_id, register, attachments, user_id=user_id, link=link)
+
+@job_handler('previews.render')
+def _render_preview(digest):
+    from app.utils.previews import render_preview
+    render_preview(digest)
+
+# Poll for due jobs alongside the other scheduled tasks
+@scheduler.task('interval', id='job_worker', seconds=2, max_instances=1, coalesce=True)
+def job_worker():
+    with scheduler.app.app_context():
+        try:
+            process_jobs()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Job worker error: {str(e)}")
+        finally:
+            db.session.remove()
+
+# Housekeeping: recover orphaned jobs and trim the finished ones
+@scheduler.task('interval', id='job_housekeeping', minutes=5, max_instances=1, coalesce=True)
+def job_housekeeping():
+    with scheduler.app.app_context():
+        try:
+            requeued = requeue_stale_jobs()
+            if requeued:
+                current_app.logger.warning(f"Requeued {requeued} stale jobs")
+            purge_finished_jobs()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Job housekeeping error: {str(e)}")
+        finally:
+            db.session.remove()
@@ -0,0 +1,227 @@
+import io
+import os
+import csv
+import time
+import hashlib
+import tempfile
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import func
+from werkzeug.utils import secure_filename
+from app import db
+from app.models.letter import Letter
+from app.utils.blobstore import blob_path, CHUNK_SIZE
+from app.utils.letter_export import EXPORT_BATCH_SIZE
+from app.utils.project_catalog import get_projects
+from app.utils.versions import get_versions
+from app.utils.zipstream import ZipEntry, stream_zip
+
+# Bumped when the archive layout changes, so older cached archives aren't served
+ARCHIVE_FORMAT = 1
+
+MANIFEST_NAME = 'manifest.csv'
+MANIFEST_HEADER = ['File', 'Letter Number', 'Project Code', 'Type', 'Date', 'Subject', 'Size', 'SHA-256', 'Note']
+
+ARCHIVE_COLUMNS = ('id', 'letter_number', 'project_id', 'is_incoming', 'date', 'object_of',
+                   'file_hash', 'file_name')
+
+# A .partial archive that hasn't grown for this long belongs to a download that died
+STALE_PARTIAL_AFTER = 3600
+
+# Zip timestamps can't go back further than 1980
+ZIP_EPOCH = datetime(1980, 1, 1)
+
+def get_archive_dir():
+    """Directory holding cached archives, created if needed"""
+    folder = current_app.config['ARCHIVE_CACHE_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+def cached_archive_path(key):
+    """Path of the cached archive for a key, whether or not it exists"""
+    return os.path.join(get_archive_dir(), f'{key}.zip')
+
+def archive_filename(query_args):
+    """Download name for an archive, e.g. letters_P1_incoming_2025.zip"""
+    parts = ['letters']
+    if query_args.get('project_code'):
+        parts.append(secure_filename(query_args['project_code']))
+    if query_args.get('is_incoming') is not None:
+        parts.append('incoming' if query_args['is_incoming'].lower() == 'true' else 'outgoing')
+    if query_args.get('year'):
+        parts.append(secure_filename(query_args['year']))
+    return '_'.join(parts) + '.zip'
+
+def _members(query):
+    """
+    Yield (path, date, manifest row) for each letter of a query, in order. path
+    is None for letters without a file or whose file is missing from disk.
+    """
+    project_codes = {project.id: project.project_code for project in get_projects()}
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    rows = query.with_entities(*[getattr(Letter, column) for column in ARCHIVE_COLUMNS])\
+        .yield_per(EXPORT_BATCH_SIZE)
+
+    for row in rows:
+        if row.file_hash:
+            path = blob_path(row.file_hash)
+        elif row.file_name:
+            # Files uploaded before the blob store
+            path = os.path.join(upload_folder, os.path.basename(row.file_name))
+        else:
+            path = None
+
+        size = ''
+        note = '' if path else 'No file'
+        if path:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                path = None
+                note = 'File missing'
+
+        stem = secure_filename((row.letter_number or '').replace('/', '-')) or f'letter_{row.id}'
+        yield path, row.date, [
+            f'{stem}.pdf' if path else '',
+            row.letter_number or '',
+            project_codes.get(row.project_id, ''),
+            'Incoming' if row.is_incoming else 'Outgoing',
+            row.date.strftime('%Y-%m-%d') if row.date else '',
+            row.object_of or '',
+            size,
+            row.file_hash or '',
+            note
+        ]
+
+def _csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue().encode('utf-8')
+
+def archive_key(query):
+    """
+    Identify the archive a query produces, without reading its letters: the
+    query's SQL and parameters, which carry the filters and the user's
+    project, plus a version of the matching set (its size, highest id and
+    latest update) and of the project codes. Files are stored under their
+    content hash, so nothing else changes the archive's bytes.
+    """
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    count, last_id, last_update = query.order_by(None)\
+        .with_entities(func.count(Letter.id), func.max(Letter.id), func.max(Letter.updated_at))\
+        .one()
+    sha = hashlib.sha256(f'letter-archive/{ARCHIVE_FORMAT}\n'.encode())
+    sha.update(f'{compiled}\n{sorted(compiled.params.items())!r}\n'.encode())
+    sha.update(f'{count}|{last_id}|{last_update}|{get_versions("projects")}'.encode())
+    return sha.hexdigest()
+
+def _zip_time(value):
+    return max(value or ZIP_EPOCH, ZIP_EPOCH).timetuple()[:6]
+
+def _read_file(f):
+    with f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            yield chunk
+
+def _entries(query, manifest):
+    # PDFs first, stored as they are, then the manifest with the rows written along the way
+    latest = ZIP_EPOCH
+    for path, date, values in _members(query):
+        f = None
+        if path:
+            try:
+                f = open(path, 'rb')
+            except OSError:
+                values[0], values[6], values[8] = '', '', 'File missing'
+
+        manifest.write(_csv_line(values))
+        latest = max(latest, date or ZIP_EPOCH)
+        if f is not None:
+            yield ZipEntry(values[0], _read_file(f), compress=False, size=values[6], date_time=_zip_time(date))
+
+    manifest.seek(0)
+    # The manifest's timestamp comes from the letters too, keeping the archive reproducible
+    yield ZipEntry(MANIFEST_NAME, _read_file(manifest), date_time=_zip_time(latest))
+
+def stream_archive(query, key):
+    """
+    Yield a zip of the files of a Letter query followed by a manifest CSV,
+    built from disk while it is sent. Memory use doesn't depend on file sizes,
+    and manifest rows wait in a temporary file.
+
+    The same letters and files always give the same bytes, so the archive is
+    also written to the cache under `key` (from archive_key()), unless another
+    request is already doing so. That copy is thrown away if the client
+    disconnects, rather than finished in the request's worker, or if the
+    letters changed while it was built.
+    """
+    prune_archive_cache()
+    final_path = cached_archive_path(key)
+    partial_path = final_path + '.partial'
+    try:
+        cache = open(partial_path, 'xb')
+    except FileExistsError:
+        cache = None
+
+    complete = False
+    try:
+        with tempfile.TemporaryFile() as manifest:
+            manifest.write(_csv_line(MANIFEST_HEADER))
+            chunks = stream_zip(_entries(query, manifest))
+            for chunk in chunks:
+                if cache is not None:
+                    cache.write(chunk)
+                yield chunk
+        complete = True
+    finally:
+        if cache is not None:
+            cache.close()
+            if complete and archive_key(query) == key:
+                os.replace(partial_path, final_path)
+            else:
+                os.remove(partial_path)
+
+def open_cached_archive(key):
+    """Path of the cached archive for key, marked as recently used, or None"""
+    path = cached_archive_path(key)
+    try:
+        os.utime(path)
+    except OSError:
+        return None
+    return path
+
+def prune_archive_cache():
+    """
+    Remove cached archives, least recently used first, until the cache fits in
+    ARCHIVE_CACHE_MAX_MB, along with partial archives left by dead downloads.
+    Returns the number of files removed.
+    """
+    folder = get_archive_dir()
+    limit = current_app.config['ARCHIVE_CACHE_MAX_MB'] * 1024 * 1024
+    now = time.time()
+    removed = 0
+    archives = []
+    for filename in os.listdir(folder):
+        path = os.path.join(folder, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if filename.endswith('.partial'):
+            if now - stat.st_mtime > STALE_PARTIAL_AFTER:
+                os.remove(path)
+                removed += 1
+        elif filename.endswith('.zip'):
+            archives.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in archives)
+    for _, size, path in sorted(archives):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
@@ -0,0 +1,260 @@
+import io
+import re
+import csv
+from datetime import datetime
+from xml.sax.saxutils import escape
+from app.models.letter import Letter
+from app.utils.project_catalog import get_projects
+from app.utils.zipstream import ZipEntry, stream_zip
+
+# Rows fetched from the database per round trip. On PostgreSQL yield_per also
+# switches to a server-side cursor, so the result set is never held in full.
+EXPORT_BATCH_SIZE = 1000
+
+# Bytes of CSV or sheet XML collected before they are handed to the response
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+# (header, column). Headers are ones the letter importer recognises, so an
+# export can be imported again. letter_content is never part of an export.
+EXPORT_COLUMNS = (
+    ('Letter Number', 'letter_number'),
+    ('Project Code', 'project_id'),
+    ('Type', 'is_incoming'),
+    ('Date', 'date'),
+    ('Subject', 'object_of'),
+    ('HO Number', 'ho_number'),
+    ('Project Number', 'project_number'),
+    ('Sender', 'sender'),
+    ('Recipient', 'recipient'),
+    ('In Charge', 'in_charge'),
+    ('Priority', 'priority'),
+    ('Status', 'status'),
+    ('Reference', 'reference'),
+    ('Department', 'department'),
+    ('Category', 'category'),
+    ('Tags', 'tags'),
+    ('Description', 'description'),
+    ('Remarks', 'remarks'),
+    ('Tracking Number', 'tracking_number'),
+    ('Due Date', 'due_date'),
+    ('Created At', 'created_at'),
+)
+
+# Columns exported with their time of day; other datetimes are exported as dates
+DATETIME_COLUMNS = ('created_at',)
+
+# Spreadsheets run a CSV cell starting with one of these as a formula. Such
+# cells are exported with a leading apostrophe, which the importer drops.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+def export_filename(file_format):
+    """Download name for an export, e.g. letters_20250101_0100.xlsx"""
+    return f"letters_{datetime.now().strftime('%Y%m%d_%H%M')}.{file_format}"
+
+def export_rows(query):
+    """
+    Yield one list of cell values per letter of a filtered Letter query. Only
+    the exported columns are selected, and rows are fetched in batches.
+    """
+    project_codes = {project.id: project.project_code for project in get_projects()}
+    query = query.with_entities(*[getattr(Letter, column) for _, column in EXPORT_COLUMNS])\
+        .yield_per(EXPORT_BATCH_SIZE)
+
+    for row in query:
+        values = []
+        for (_, column), value in zip(EXPORT_COLUMNS, row):
+            if column == 'project_id':
+                value = project_codes.get(value, '')
+            elif column == 'is_incoming':
+                value = 'Incoming' if value else 'Outgoing'
+            elif isinstance(value, datetime) and column not in DATETIME_COLUMNS:
+                value = value.date()
+            values.append(value)
+        yield values
+
+def stream_export(query, file_format):
+    """Chunks of the export of a filtered Letter query as CSV or XLSX"""
+    if file_format == 'xlsx':
+        return stream_xlsx(export_rows(query))
+    return stream_csv(export_rows(query))
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def stream_csv(rows):
+    """Chunks of a UTF-8 CSV file with a header row. The BOM lets Excel detect the encoding."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([header for header, _ in EXPORT_COLUMNS])
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+# The workbook is written as SpreadsheetML directly, row by row. Strings are
+# stored inline rather than in a shared strings table, which would have to be
+# complete before the sheet could be written.
+
+SPREADSHEET_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+RELATIONSHIP_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PACKAGE_RELATIONSHIP_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+CONTENT_TYPES_XML = XML_DECLARATION + (
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+
+ROOT_RELS_XML = XML_DECLARATION + (
+    f'<Relationships xmlns="{PACKAGE_RELATIONSHIP_NS}">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+WORKBOOK_XML = XML_DECLARATION + (
+    f'<workbook xmlns="{SPREADSHEET_NS}" xmlns:r="{RELATIONSHIP_NS}">'
+    '<sheets><sheet name="Letters" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+WORKBOOK_RELS_XML = XML_DECLARATION + (
+    f'<Relationships xmlns="{PACKAGE_RELATIONSHIP_NS}">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+# Cell styles: 0 default, 1 date, 2 bold header, 3 date and time
+DATE_STYLE = 1
+HEADER_STYLE = 2
+DATETIME_STYLE = 3
+
+STYLES_XML = XML_DECLARATION + (
+    f'<styleSheet xmlns="{SPREADSHEET_NS}">'
+    '<numFmts count="2">'
+    '<numFmt numFmtId="164" formatCode="yyyy-mm-dd"/>'
+    '<numFmt numFmtId="165" formatCode="yyyy-mm-dd hh:mm"/>'
+    '</numFmts>'
+    '<fonts count="2">'
+    '<font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font>'
+    '</fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="4">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+# The header row stays in view while scrolling
+SHEET_HEADER_XML = XML_DECLARATION + (
+    f'<worksheet xmlns="{SPREADSHEET_NS}">'
+    '<sheetViews><sheetView workbookViewId="0">'
+    '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+    '</sheetView></sheetViews>'
+    '<sheetData>'
+)
+SHEET_FOOTER_XML = '</sheetData></worksheet>'
+
+# Characters XML 1.0 does not allow, even escaped
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+def _column_letter(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+COLUMN_LETTERS = [_column_letter(index) for index in range(len(EXPORT_COLUMNS))]
+
+def _text_cell(reference, value, style=0):
+    text = escape(_INVALID_XML_CHARS.sub('', str(value)))
+    style_attr = f' s="{style}"' if style else ''
+    return f'<c r="{reference}" t="inlineStr"{style_attr}><is><t xml:space="preserve">{text}</t></is></c>'
+
+def _cell(reference, value):
+    if value is None or value == '':
+        return ''
+    if isinstance(value, datetime):
+        serial = (value - EXCEL_EPOCH).total_seconds() / 86400
+        return f'<c r="{reference}" s="{DATETIME_STYLE}"><v>{serial:.6f}</v></c>'
+    if hasattr(value, 'isoformat'):
+        serial = (value - EXCEL_EPOCH.date()).days
+        return f'<c r="{reference}" s="{DATE_STYLE}"><v>{serial}</v></c>'
+    return _text_cell(reference, value)
+
+def _sheet_chunks(rows):
+    parts = [SHEET_HEADER_XML, '<row r="1">']
+    parts.extend(_text_cell(f'{letter}1', header, HEADER_STYLE)
+                 for letter, (header, _) in zip(COLUMN_LETTERS, EXPORT_COLUMNS))
+    parts.append('</row>')
+    size = 0
+    for number, row in enumerate(rows, start=2):
+        row_xml = f'<row r="{number}">' + ''.join(
+            _cell(f'{letter}{number}', value) for letter, value in zip(COLUMN_LETTERS, row)) + '</row>'
+        parts.append(row_xml)
+        size += len(row_xml)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield ''.join(parts).encode('utf-8')
+            parts = []
+            size = 0
+    parts.append(SHEET_FOOTER_XML)
+    yield ''.join(parts).encode('utf-8')
+
+def stream_xlsx(rows):
+    """Chunks of an XLSX workbook with one sheet, compressed while it is written"""
+    def part(name, xml):
+        return ZipEntry(name, [xml.encode('utf-8')])
+
+    return stream_zip([
+        part('[Content_Types].xml', CONTENT_TYPES_XML),
+        part('_rels/.rels', ROOT_RELS_XML),
+        part('xl/workbook.xml', WORKBOOK_XML),
+        part('xl/_rels/workbook.xml.rels', WORKBOOK_RELS_XML),
+        part('xl/styles.xml', STYLES_XML),
+        ZipEntry('xl/worksheets/sheet1.xml', _sheet_chunks(rows))
+    ])
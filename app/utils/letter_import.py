@@ -0,0 +1,573 @@
+import os
+import re
+import csv
+import json
+import time
+import uuid
+import zipfile
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from flask import current_app
+from werkzeug.utils import secure_filename
+from app import db
+from app.models.job import Job
+from app.models.letter import Letter
+from app.utils.blobstore import store_stream, acquire_blob, InvalidUploadError
+from app.utils.jobs import enqueue_job, job_heartbeat
+from app.utils.letter_export import FORMULA_PREFIXES
+from app.utils.letter_stats import adjust_letter_stats
+from app.utils.numbering import (
+    HO_SCOPE, MAX_NUMBER, project_scope, allocate, advance_to, format_number, format_letter_number, letter_year
+)
+from app.utils.previews import queue_preview
+from app.utils.project_catalog import get_project_by_code
+
+# Letters written per transaction. A chunk that fails is retried row by row,
+# so one bad row only costs its own insert.
+IMPORT_CHUNK_SIZE = 500
+
+REGISTER_EXTENSIONS = ('.csv', '.xlsx')
+
+REQUIRED_COLUMNS = ('project_code', 'type', 'date', 'object_of')
+
+# Free-text columns copied from the register, checked against their column length
+TEXT_COLUMNS = (
+    'description', 'in_charge', 'reference', 'remarks', 'sender', 'recipient', 'priority', 'status',
+    'department', 'category', 'tags', 'action_taken', 'tracking_number', 'delivery_status', 'archive_location'
+)
+DATE_COLUMNS = ('due_date', 'follow_up_date', 'archive_date')
+
+# Register headers, lower-cased with spaces and punctuation as underscores -> column
+COLUMN_ALIASES = {
+    'project': 'project_code', 'project_code': 'project_code',
+    'type': 'type', 'letter_type': 'type', 'direction': 'type', 'in_out': 'type',
+    'date': 'date', 'letter_date': 'date',
+    'subject': 'object_of', 'object': 'object_of', 'object_of': 'object_of',
+    'letter_number': 'letter_number', 'letter_no': 'letter_number',
+    'ho_number': 'ho_number', 'ho_no': 'ho_number',
+    'project_number': 'project_number', 'project_no': 'project_number',
+    'file': 'file', 'file_name': 'file', 'pdf': 'file',
+    **{column: column for column in TEXT_COLUMNS + DATE_COLUMNS}
+}
+
+INCOMING_TYPES = ('in', 'incoming', 'received')
+OUTGOING_TYPES = ('out', 'ou', 'outgoing', 'sent')
+
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y-%m-%d %H:%M:%S')
+
+# HO and project numbers at the end of a letter number such as KEC/HO/IN/25-0001-0001
+LETTER_NUMBER_PARTS = re.compile(r'/\d{2}-(\d{1,4})-(\d{1,4})$')
+
+class LetterImportError(Exception):
+    """A register could not be read at all"""
+
+class RowError(ValueError):
+    """A register row that can't be imported"""
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    imported: int = 0
+    # (row number, message) for every rejected row
+    errors: list = field(default_factory=list)
+
+    def write_errors(self, path):
+        """Write the rejected rows to a CSV file"""
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Row', 'Error'])
+            writer.writerows(self.errors)
+
+def _normalize_header(name):
+    return re.sub(r'[^a-z0-9]+', '_', str(name or '').strip().lower()).strip('_')
+
+def _csv_rows(path):
+    try:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            yield from csv.reader(f)
+    except UnicodeDecodeError:
+        raise LetterImportError('The CSV file is not UTF-8 encoded; save it as "CSV UTF-8" and try again')
+
+def _xlsx_rows(path):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise LetterImportError('Reading .xlsx registers needs openpyxl (pip install openpyxl); or save the register as CSV')
+    # Read-only mode streams the sheet instead of loading it whole
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def read_register(path):
+    """Yield (row number, {column: value}) for each non-empty row of a CSV or XLSX register"""
+    rows = _xlsx_rows(path) if path.lower().endswith('.xlsx') else _csv_rows(path)
+    header = next(rows, None)
+    if header is None:
+        raise LetterImportError('The register is empty')
+
+    columns = [COLUMN_ALIASES.get(_normalize_header(name)) for name in header]
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise LetterImportError(f"The register has no column for: {', '.join(missing)}")
+
+    for row_number, values in enumerate(rows, start=2):
+        row = {column: value for column, value in zip(columns, values)
+               if column and value is not None and str(value).strip() != ''}
+        if row:
+            yield row_number, row
+
+def _text(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value)
+    # Undo the apostrophe a CSV export puts before cells that look like formulas
+    if value.startswith("'") and value[1:].startswith(FORMULA_PREFIXES):
+        value = value[1:]
+    return value.strip()
+
+def _date(value, label):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(_text(value), date_format)
+        except ValueError:
+            pass
+    raise RowError(f"{label} '{value}' is not a date")
+
+def _number(value, label):
+    text = _text(value)
+    if not text.isdigit() or not 0 < int(text) <= MAX_NUMBER:
+        raise RowError(f"{label} '{text}' must be a number between 1 and {MAX_NUMBER}")
+    return text.zfill(4)
+
+def parse_row(row):
+    """
+    Validate a register row and turn it into letters table values. Keys starting
+    with '_' carry what the import needs besides the columns.
+    """
+    missing = [column for column in REQUIRED_COLUMNS if column not in row]
+    if missing:
+        raise RowError(f"Missing {', '.join(missing)}")
+
+    project = get_project_by_code(_text(row['project_code']))
+    if project is None:
+        raise RowError(f"Unknown project code '{_text(row['project_code'])}'")
+
+    letter_type = _text(row['type']).lower()
+    if letter_type not in INCOMING_TYPES + OUTGOING_TYPES:
+        raise RowError(f"Type '{row['type']}' must be incoming or outgoing")
+
+    values = {
+        'project_id': project.id,
+        'is_incoming': letter_type in INCOMING_TYPES,
+        'date': _date(row['date'], 'Date'),
+        'object_of': _text(row['object_of']),
+        'status': 'Pending'
+    }
+    for column in TEXT_COLUMNS:
+        if column in row:
+            values[column] = _text(row[column])
+    for column in DATE_COLUMNS:
+        if column in row:
+            values[column] = _date(row[column], column.replace('_', ' ').capitalize())
+    for column, value in values.items():
+        length = getattr(Letter.__table__.c[column].type, 'length', None)
+        if length and isinstance(value, str) and len(value) > length:
+            raise RowError(f'{column} is longer than {length} characters')
+
+    letter_number = _text(row['letter_number']) if 'letter_number' in row else None
+    ho_number = row.get('ho_number')
+    project_number = row.get('project_number')
+    if letter_number and ho_number is None and project_number is None:
+        match = LETTER_NUMBER_PARTS.search(letter_number)
+        if match:
+            ho_number, project_number = match.groups()
+    if (ho_number is None) != (project_number is None):
+        raise RowError('Give both the HO number and the project number, or neither')
+    if letter_number and len(letter_number) > Letter.__table__.c.letter_number.type.length:
+        raise RowError('letter_number is too long')
+
+    values.update(
+        letter_number=letter_number,
+        ho_number=_number(ho_number, 'HO number') if ho_number is not None else None,
+        project_number=_number(project_number, 'Project number') if project_number is not None else None,
+        _project_code=project.project_code,
+        # Numbers belong to the year in the letter number, or else the letter's own year
+        _year=letter_year(letter_number, fallback=values['date']),
+        _file=_text(row['file']) if 'file' in row else None
+    )
+    return values
+
+class AttachmentSource:
+    """The PDFs named in a register's file column, from a directory or a zip archive"""
+
+    def __init__(self, path):
+        self.archive = None
+        self.members = {}
+        if os.path.isdir(path):
+            self.root = os.path.realpath(path)
+        elif zipfile.is_zipfile(path):
+            self.archive = zipfile.ZipFile(path)
+            for info in self.archive.infolist():
+                if not info.is_dir():
+                    # Match by full name or by file name alone, ignoring case
+                    self.members.setdefault(info.filename.lower(), info)
+                    self.members.setdefault(os.path.basename(info.filename).lower(), info)
+        else:
+            raise LetterImportError('Attachments must be a directory or a .zip archive')
+
+    def _open(self, name):
+        if self.archive is not None:
+            info = self.members.get(name.replace('\\', '/').lower())
+            if info is None:
+                raise RowError(f"Attachment '{name}' not found")
+            return self.archive.open(info)
+
+        path = os.path.realpath(os.path.join(self.root, name))
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+            raise RowError(f"Attachment '{name}' not found")
+        return open(path, 'rb')
+
+    def store(self, name):
+        """Stream an attachment into the blob store. Returns (digest, size)."""
+        with self._open(name) as stream:
+            try:
+                return store_stream(stream)
+            except InvalidUploadError:
+                raise RowError(f"Attachment '{name}' is not a valid PDF")
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+
+def _advance_sequences(register_path):
+    """
+    Move every number sequence past the numbers already written in the register,
+    so numbers allocated for unnumbered rows never collide with rows further down.
+    """
+    highest = Counter()
+    for _, row in read_register(register_path):
+        try:
+            letter = parse_row(row)
+        except RowError:
+            continue
+        if letter['ho_number'] is None:
+            continue
+        is_incoming, year = letter['is_incoming'], letter['_year']
+        ho_key = (HO_SCOPE, is_incoming, year)
+        project_key = (project_scope(letter['project_id']), is_incoming, year)
+        highest[ho_key] = max(highest[ho_key], int(letter['ho_number']))
+        highest[project_key] = max(highest[project_key], int(letter['project_number']))
+
+    for (scope, is_incoming, year), value in highest.items():
+        advance_to(scope, is_incoming, year, value)
+    db.session.commit()
+
+def _number_letters(letters):
+    """Copies of the letters with HO/project numbers allocated in bulk and letter numbers filled in"""
+    unnumbered = [letter for letter in letters if letter['ho_number'] is None and not letter['letter_number']]
+    ho_values = {
+        (is_incoming, year): iter(allocate(HO_SCOPE, is_incoming, year, count))
+        for (is_incoming, year), count in Counter(
+            (letter['is_incoming'], letter['_year']) for letter in unnumbered).items()
+    }
+    project_values = {
+        (project_id, is_incoming, year): iter(allocate(project_scope(project_id), is_incoming, year, count))
+        for (project_id, is_incoming, year), count in Counter(
+            (letter['project_id'], letter['is_incoming'], letter['_year']) for letter in unnumbered).items()
+    }
+
+    numbered = []
+    for letter in letters:
+        letter = dict(letter)
+        is_incoming, year = letter['is_incoming'], letter['_year']
+        if letter['ho_number'] is None and not letter['letter_number']:
+            letter['ho_number'] = format_number(next(ho_values[(is_incoming, year)]))
+            letter['project_number'] = format_number(next(project_values[(letter['project_id'], is_incoming, year)]))
+        if not letter['letter_number']:
+            letter['letter_number'] = format_letter_number(
+                letter['_project_code'], is_incoming, year, letter['ho_number'], letter['project_number'])
+        numbered.append(letter)
+    return numbered
+
+# Columns every inserted row sets, so the chunk can go in as one executemany
+INSERT_COLUMNS = (
+    'letter_number', 'project_id', 'date', 'object_of', 'project_number', 'ho_number', 'is_incoming',
+    'file_name', 'file_hash', 'file_size', 'created_by', 'created_at', 'updated_at'
+) + TEXT_COLUMNS + DATE_COLUMNS
+
+def _write_chunk(letters, user_id):
+    """
+    Number and insert letters in one transaction, moving the letter counters and
+    attachment references with them. Returns [(row number, message)] for letters
+    whose number is already taken.
+    """
+    letters = _number_letters(letters)
+    numbers = [letter['letter_number'] for letter in letters]
+    taken = {number for (number,) in db.session.query(Letter.letter_number).filter(Letter.letter_number.in_(numbers))}
+    rejected = [(letter['_row'], f"Letter number {letter['letter_number']} already exists")
+                for letter in letters if letter['letter_number'] in taken]
+    letters = [letter for letter in letters if letter['letter_number'] not in taken]
+    if not letters:
+        db.session.commit()
+        return rejected
+
+    now = datetime.utcnow()
+    rows = []
+    for letter in letters:
+        letter.update(created_by=user_id, created_at=now, updated_at=now)
+        rows.append({column: letter.get(column) for column in INSERT_COLUMNS})
+    # Core executemany skips the ORM's per-row flush, so the counters are moved here in bulk
+    db.session.execute(Letter.__table__.insert(), rows)
+
+    connection = db.session.connection()
+    for (project_id, is_incoming), count in Counter(
+            (letter['project_id'], letter['is_incoming']) for letter in letters).items():
+        adjust_letter_stats(connection, project_id, is_incoming, count)
+
+    previews = set()
+    for letter in letters:
+        if letter.get('file_hash'):
+            acquire_blob(letter['file_hash'], letter['file_size'])
+            previews.add(letter['file_hash'])
+    for digest in previews:
+        queue_preview(digest)
+
+    db.session.commit()
+    return rejected
+
+def _flush_chunk(letters, user_id, result):
+    try:
+        rejected = _write_chunk(letters, user_id)
+    except Exception as e:
+        db.session.rollback()
+        if len(letters) == 1:
+            current_app.logger.warning(f"Import row {letters[0]['_row']} rejected: {str(e)}")
+            result.errors.append((letters[0]['_row'], str(e).splitlines()[0]))
+            return
+        # Find the rows that broke the chunk; the rest still go in
+        for letter in letters:
+            _flush_chunk([letter], user_id, result)
+        return
+    result.errors.extend(rejected)
+    result.imported += len(letters) - len(rejected)
+
+def import_letters(register_path, attachments=None, user_id=None, chunk_size=IMPORT_CHUNK_SIZE, progress=None,
+                   resume=None):
+    """
+    Import the letters of a CSV or XLSX register. Rows are read one at a time,
+    validated, given numbers in bulk and inserted in transactions of chunk_size
+    rows; PDFs named in the file column are taken from `attachments`, a
+    directory or zip archive. Rejected rows are reported in the result and
+    never stop the import. Calls progress(result) after every chunk, when every
+    row counted so far is committed or rejected.
+
+    To continue an interrupted import, pass the result of its last progress()
+    call as `resume`: the rows it covers are skipped.
+    """
+    source = AttachmentSource(attachments) if attachments else None
+    result = ImportResult(imported=resume.imported, errors=list(resume.errors)) if resume else ImportResult()
+    skip_rows = resume.rows if resume else 0
+    try:
+        _advance_sequences(register_path)
+
+        seen_numbers = set()
+        chunk = []
+        for row_number, row in read_register(register_path):
+            result.rows += 1
+            if result.rows <= skip_rows:
+                continue
+            try:
+                letter = parse_row(row)
+                if letter['letter_number']:
+                    if letter['letter_number'] in seen_numbers:
+                        raise RowError(f"Letter number {letter['letter_number']} appears more than once in the register")
+                    seen_numbers.add(letter['letter_number'])
+                if letter['_file']:
+                    if source is None:
+                        raise RowError(f"Attachment '{letter['_file']}' given but no attachments were provided")
+                    letter['file_hash'], letter['file_size'] = source.store(letter['_file'])
+                    letter['file_name'] = secure_filename(os.path.basename(letter['_file']))
+            except RowError as e:
+                result.errors.append((row_number, str(e)))
+                continue
+
+            letter['_row'] = row_number
+            chunk.append(letter)
+            if len(chunk) >= chunk_size:
+                _flush_chunk(chunk, user_id, result)
+                chunk = []
+                if progress:
+                    progress(result)
+
+        if chunk:
+            _flush_chunk(chunk, user_id, result)
+        if progress:
+            progress(result)
+    finally:
+        if source:
+            source.close()
+    return result
+
+# Imports started from the admin page run as 'imports.run' jobs on the job queue.
+# Each gets a directory holding the uploaded files while it runs, then its status
+# and error report.
+STATUS_FILENAME = 'status.json'
+ERRORS_FILENAME = 'errors.csv'
+IMPORT_ID = re.compile(r'^\d{8}_\d{6}_[0-9a-f]{8}$')
+
+# An import is only run again when its worker died, carrying on where it stopped
+IMPORT_MAX_ATTEMPTS = 3
+
+def get_import_dir():
+    """Directory holding the admin uploads, created if needed"""
+    import_dir = os.path.join(current_app.root_path, 'imports')
+    os.makedirs(import_dir, exist_ok=True)
+    return import_dir
+
+def _write_status(work_dir, status):
+    status['updated_at'] = time.time()
+    path = os.path.join(work_dir, STATUS_FILENAME)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(temp_path, path)
+
+def _read_status(work_dir):
+    try:
+        with open(os.path.join(work_dir, STATUS_FILENAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def read_import_status(import_id):
+    """Status of an admin import, or None if there is no such import"""
+    if not IMPORT_ID.match(import_id or ''):
+        return None
+    status = _read_status(os.path.join(get_import_dir(), import_id))
+    if status and status['status'] in ('queued', 'running'):
+        # The job gave up, e.g. after its worker died on every attempt
+        job = Job.query.get(status.get('job_id'))
+        if job is None or job.status == 'failed':
+            status.update(status='failed', error='The import stopped before it finished')
+    return status
+
+def list_imports(limit=5):
+    """The most recent admin imports, newest first"""
+    import_ids = sorted((name for name in os.listdir(get_import_dir()) if IMPORT_ID.match(name)), reverse=True)
+    statuses = (read_import_status(import_id) for import_id in import_ids[:limit])
+    return [status for status in statuses if status]
+
+def import_errors_path(import_id):
+    """Path of an admin import's error report, or None"""
+    if not IMPORT_ID.match(import_id or ''):
+        return None
+    path = os.path.join(get_import_dir(), import_id, ERRORS_FILENAME)
+    return path if os.path.exists(path) else None
+
+def _read_errors(path):
+    try:
+        with open(path, newline='', encoding='utf-8') as f:
+            return [(int(row[0]), row[1]) for row in list(csv.reader(f))[1:]]
+    except (OSError, ValueError, IndexError):
+        return []
+
+def start_import(register_file, attachments_file=None, user_id=None, link=None):
+    """
+    Save an uploaded register (and attachments zip) and queue a job to import
+    it. The user is notified when it finishes. Returns the import id.
+    """
+    extension = os.path.splitext(register_file.filename or '')[1].lower()
+    if extension not in REGISTER_EXTENSIONS:
+        raise LetterImportError(f"The register must be a {' or '.join(REGISTER_EXTENSIONS)} file")
+
+    import_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    work_dir = os.path.join(get_import_dir(), import_id)
+    os.makedirs(work_dir)
+    register = 'register' + extension
+    register_file.save(os.path.join(work_dir, register))
+    attachments = None
+    if attachments_file and attachments_file.filename:
+        attachments = 'attachments.zip'
+        attachments_file.save(os.path.join(work_dir, attachments))
+
+    job = enqueue_job('imports.run', {
+        'import_id': import_id,
+        'register': register,
+        'attachments': attachments,
+        'user_id': user_id,
+        'link': link
+    }, max_attempts=IMPORT_MAX_ATTEMPTS)
+    db.session.flush()
+
+    # Written before the job is committed, so the worker always finds it
+    _write_status(work_dir, {
+        'id': import_id,
+        'job_id': job.id,
+        'status': 'queued',
+        'register': secure_filename(register_file.filename),
+        'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'rows': 0,
+        'imported': 0,
+        'errors': 0
+    })
+    db.session.commit()
+    return import_id
+
+def run_import(import_id, register, attachments=None, user_id=None, link=None):
+    """
+    Run a queued admin import (the 'imports.run' job). If an earlier attempt
+    was interrupted, the import carries on after the last chunk it recorded.
+    """
+    from app.utils.notifications import create_notification
+    work_dir = os.path.join(get_import_dir(), import_id)
+    status = _read_status(work_dir)
+    if status is None or status['status'] not in ('queued', 'running'):
+        return
+
+    register_path = os.path.join(work_dir, register)
+    attachments_path = os.path.join(work_dir, attachments) if attachments else None
+    errors_path = os.path.join(work_dir, ERRORS_FILENAME)
+    resume = None
+    if status['status'] == 'running':
+        resume = ImportResult(rows=status['rows'], imported=status['imported'], errors=_read_errors(errors_path))
+        current_app.logger.warning(f"Letter import {import_id}: resuming after row {status['rows']}")
+    status['status'] = 'running'
+    _write_status(work_dir, status)
+
+    def progress(result):
+        # A crash between a chunk's commit and this write re-imports that chunk on resume
+        if result.errors:
+            result.write_errors(errors_path)
+        status.update(rows=result.rows, imported=result.imported, errors=len(result.errors))
+        _write_status(work_dir, status)
+        job_heartbeat()
+
+    try:
+        result = import_letters(register_path, attachments_path, user_id=user_id, progress=progress, resume=resume)
+        if result.errors:
+            result.write_errors(errors_path)
+        status.update(status='done')
+        message = f"{result.imported} of {result.rows} rows from {status['register']} imported"
+        if result.errors:
+            message += f", {len(result.errors)} rejected"
+        current_app.logger.info(f"Letter import {import_id}: {message}")
+    except Exception as e:
+        db.session.rollback()
+        status.update(status='failed', error=str(e))
+        message = f"Import of {status['register']} failed: {str(e)}"
+        current_app.logger.error(f"Letter import {import_id} failed: {str(e)}")
+
+    for path in (register_path, attachments_path):
+        if path and os.path.exists(path):
+            os.remove(path)
+    _write_status(work_dir, status)
+    if user_id:
+        create_notification(title="Letter Import Finished", message=message, user_id=user_id,
+                            icon="fa-file-import", icon_color="bg-info", link=link)
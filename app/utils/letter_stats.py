@@ -0,0 +1,107 @@
+from sqlalchemy import event, inspect, select, func, case
+from app import db
+from app.models.letter import Letter
+from app.models.project import Project
+from app.models.project_letter_stats import ProjectLetterStats
+
+def _column(is_incoming):
+    # Letters without a type have always been counted as outgoing
+    table = ProjectLetterStats.__table__
+    return table.c.incoming if is_incoming else table.c.outgoing
+
+def adjust_letter_stats(connection, project_id, is_incoming, delta):
+    """Add delta to a project's incoming or outgoing count, in the caller's transaction"""
+    if project_id is None:
+        return
+    # Imported here: app.models imports this module, and app.utils.database imports app.models
+    from app.utils.database import insert_ignore
+    table = ProjectLetterStats.__table__
+    connection.execute(insert_ignore(table, connection.dialect.name),
+                       {'project_id': project_id, 'incoming': 0, 'outgoing': 0})
+    column = _column(is_incoming)
+    connection.execute(table.update()
+                       .where(table.c.project_id == project_id)
+                       .values({column.name: column + delta}))
+
+def _old_value(target, key):
+    history = inspect(target).attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(target, key)
+
+@event.listens_for(Letter, 'after_insert')
+def _letter_inserted(mapper, connection, target):
+    adjust_letter_stats(connection, target.project_id, target.is_incoming, 1)
+
+@event.listens_for(Letter, 'after_delete')
+def _letter_deleted(mapper, connection, target):
+    adjust_letter_stats(connection, _old_value(target, 'project_id'), _old_value(target, 'is_incoming'), -1)
+
+@event.listens_for(Letter, 'after_update')
+def _letter_updated(mapper, connection, target):
+    state = inspect(target)
+    if not (state.attrs.project_id.history.has_changes() or state.attrs.is_incoming.history.has_changes()):
+        return
+    adjust_letter_stats(connection, _old_value(target, 'project_id'), _old_value(target, 'is_incoming'), -1)
+    adjust_letter_stats(connection, target.project_id, target.is_incoming, 1)
+
+# Make the ORM load the previous value before these attributes are replaced,
+# so the update handler knows which counter to move the letter out of
+@event.listens_for(Letter.project_id, 'set', active_history=True)
+@event.listens_for(Letter.is_incoming, 'set', active_history=True)
+def _keep_previous_value(target, value, oldvalue, initiator):
+    return value
+
+def get_project_stats(project_id):
+    """Letter counts for one project: a primary-key lookup"""
+    stats = ProjectLetterStats.query.get(project_id)
+    incoming = stats.incoming if stats else 0
+    outgoing = stats.outgoing if stats else 0
+    return {
+        'total_letters': incoming + outgoing,
+        'incoming_letters': incoming,
+        'outgoing_letters': outgoing
+    }
+
+def get_total_stats():
+    """Letter counts across all projects, summed over one row per project"""
+    incoming, outgoing = db.session.query(
+        func.coalesce(func.sum(ProjectLetterStats.incoming), 0),
+        func.coalesce(func.sum(ProjectLetterStats.outgoing), 0)
+    ).one()
+    return {
+        'total_letters': incoming + outgoing,
+        'incoming_letters': incoming,
+        'outgoing_letters': outgoing
+    }
+
+def reconcile_letter_stats():
+    """Recount every project's letters from the letters table. Returns the projects whose counts were wrong."""
+    table = ProjectLetterStats.__table__
+    letters = Letter.__table__
+    actual = {
+        project_id: (incoming, outgoing)
+        for project_id, incoming, outgoing in db.session.execute(
+            select(
+                letters.c.project_id,
+                func.sum(case((letters.c.is_incoming == True, 1), else_=0)),
+                func.sum(case((letters.c.is_incoming == True, 0), else_=1))
+            ).where(letters.c.project_id.isnot(None)).group_by(letters.c.project_id)
+        )
+    }
+    stored = {row.project_id: (row.incoming, row.outgoing) for row in db.session.execute(select(table))}
+
+    corrected = []
+    existing_projects = {project_id for (project_id,) in db.session.query(Project.id)}
+    for project_id in sorted((set(actual) | set(stored)) & existing_projects):
+        counts = actual.get(project_id, (0, 0))
+        if stored.get(project_id) == counts:
+            continue
+        corrected.append(project_id)
+        db.session.execute(table.delete().where(table.c.project_id == project_id))
+        db.session.execute(table.insert(), {'project_id': project_id, 'incoming': counts[0], 'outgoing': counts[1]})
+
+    # Counters of projects that no longer exist
+    db.session.execute(table.delete().where(table.c.project_id.notin_(select(Project.__table__.c.id))))
+    db.session.commit()
+    return corrected
@@ -0,0 +1,78 @@
+import threading
+import time
+
+# Seconds between checks of the shared notifications version while this
+# process has open streams. Notifications are written by other workers and
+# by the job queue, whose publish() calls only reach their own process.
+WATCH_INTERVAL = 2
+
+# Open notification streams in this process: user_id -> set of threading.Event
+_subscribers = {}
+_lock = threading.Lock()
+_watcher = None
+
+def subscribe(user_id, app):
+    """Register a stream for a user. The returned event is set whenever their notifications change."""
+    global _watcher
+    event = threading.Event()
+    with _lock:
+        _subscribers.setdefault(user_id, set()).add(event)
+        if _watcher is None:
+            _watcher = threading.Thread(target=_watch, args=(app,), name='notification-watcher', daemon=True)
+            _watcher.start()
+    return event
+
+def unsubscribe(user_id, event):
+    """Remove a stream registered with subscribe()"""
+    with _lock:
+        events = _subscribers.get(user_id)
+        if events is not None:
+            events.discard(event)
+            if not events:
+                del _subscribers[user_id]
+
+def subscribed_user_ids():
+    """Users with at least one open stream in this process"""
+    with _lock:
+        return list(_subscribers)
+
+def publish(user_ids):
+    """Wake every stream belonging to the given users"""
+    with _lock:
+        events = [event for user_id in user_ids for event in _subscribers.get(user_id, ())]
+    for event in events:
+        event.set()
+    return len(events)
+
+def _current_version(app):
+    from app import db
+    from app.utils.versions import get_versions
+    with app.app_context():
+        try:
+            return get_versions('notifications')
+        except Exception as e:
+            app.logger.warning(f"Could not read the notifications version: {str(e)}")
+            return None
+        finally:
+            db.session.remove()
+
+def _watch(app):
+    """
+    Wake this process's streams when any process changes notifications.
+    Each stream then compares its own user's signature, so a change for
+    another user costs it one small query. Exits once no streams are open.
+    """
+    global _watcher
+    seen = _current_version(app)
+    while True:
+        time.sleep(WATCH_INTERVAL)
+        with _lock:
+            if not _subscribers:
+                _watcher = None
+                return
+            events = [event for events in _subscribers.values() for event in events]
+        version = _current_version(app)
+        if version is not None and version != seen:
+            seen = version
+            for event in events:
+                event.set()
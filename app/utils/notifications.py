@@ -1,8 +1,10 @@
 from datetime import datetime
 from flask import current_app
 from flask_login import current_user
+from sqlalchemy import select, literal, exists, and_
 from app import db
 from app.models.notification import Notification
+from app.utils.notification_events import publish, subscribed_user_ids
 
 def create_notification(title, message, user_id=None, icon="fa-bell", icon_color="bg-primary", link=None):
     """
@@ -41,6 +43,7 @@ def create_notification(title, message, user_id=None, icon="fa-bell", icon_color
         
         db.session.add(notification)
         db.session.commit()
+        publish([user_id])
         current_app.logger.info(f"Notification created for user {user_id}: {title}")
         return notification
         
@@ -49,80 +52,116 @@ def create_notification(title, message, user_id=None, icon="fa-bell", icon_color
         db.session.rollback()
         return None
 
-def create_notification_for_all_admins(title, message, icon="fa-bell", icon_color="bg-primary", link=None):
-    """Create a notification for all admin users"""
+def fan_out_notification(recipients, title, message, icon="fa-bell", icon_color="bg-primary", link=None):
+    """
+    Create the same notification for every user id selected by `recipients`
+    (a SELECT of user ids) in one INSERT ... SELECT statement and one commit.
+    Users who already have an identical unread notification are skipped.
+    Returns the number of notifications created.
+    """
+    from app.utils.versions import bump_version
+    
+    notifications = Notification.__table__
+    recipients = recipients.subquery()
+    user_id = recipients.c[0]
+    
+    duplicate = exists().where(and_(
+        notifications.c.user_id == user_id,
+        notifications.c.title == title,
+        notifications.c.message == message,
+        notifications.c.read == False
+    ))
+    
+    rows = select(
+        user_id,
+        literal(title),
+        literal(message),
+        literal(icon),
+        literal(icon_color),
+        literal(link),
+        literal(False),
+        literal(datetime.now())
+    ).where(~duplicate)
+    
+    result = db.session.execute(notifications.insert().from_select(
+        ['user_id', 'title', 'message', 'icon', 'icon_color', 'link', 'read', 'created_at'],
+        rows
+    ))
+    created = result.rowcount
+    if created:
+        # A bulk insert skips the ORM events that bump the version
+        bump_version('notifications')
+    db.session.commit()
+    
+    # Wake the open notification streams of any recipient
+    subscribed = subscribed_user_ids()
+    if created and subscribed:
+        publish(db.session.execute(select(user_id).where(user_id.in_(subscribed))).scalars().all())
+    
+    current_app.logger.info(f"Notification fanned out to {created} users: {title}")
+    return created
+
+def audience_recipients(audience, project_id=None, user_id=None):
+    """Build the SELECT of user ids for a named audience"""
     from app.models.user import User
     
+    if audience == 'all_users':
+        # All active users
+        return select(User.id).where(User.is_active == True)
+    if audience == 'all_admins':
+        # All active admin users (both head office and project admins)
+        return select(User.id).where(User.is_admin == True, User.is_active == True)
+    if audience == 'project_users':
+        # All active users associated with the project (including admins)
+        return select(User.id).where(User.project_id == project_id, User.is_active == True)
+    if audience == 'user':
+        return select(User.id).where(User.id == user_id)
+    raise ValueError(f"Unknown notification audience '{audience}'")
+
+def queue_notification(audience, title, message, project_id=None, user_id=None, icon="fa-bell", icon_color="bg-primary", link=None):
+    """
+    Queue a notification for the job worker to fan out, in the caller's
+    transaction, so the request doesn't wait for the notification rows.
+    """
+    from app.utils.jobs import enqueue_job
+    
+    return enqueue_job('notifications.send', {
+        'audience': audience,
+        'title': title,
+        'message': message,
+        'project_id': project_id,
+        'user_id': user_id,
+        'icon': icon,
+        'icon_color': icon_color,
+        'link': link
+    })
+
+def create_notification_for_all_admins(title, message, icon="fa-bell", icon_color="bg-primary", link=None):
+    """Create a notification for all admin users"""
     try:
-        # Get all active admin users (both head office and project admins)
-        admins = User.query.filter_by(is_admin=True, is_active=True).all()
-        notifications = []
-        
-        for admin in admins:
-            notification = create_notification(
-                title=title,
-                message=message,
-                user_id=admin.id,
-                icon=icon,
-                icon_color=icon_color,
-                link=link
-            )
-            if notification:
-                notifications.append(notification)
-                
-        return notifications
+        admins = audience_recipients('all_admins')
+        return fan_out_notification(admins, title, message, icon=icon, icon_color=icon_color, link=link)
     except Exception as e:
         current_app.logger.error(f"Error creating notifications for admins: {str(e)}")
-        return []
+        db.session.rollback()
+        return 0
 
 def create_notification_for_project_users(title, message, project_id, icon="fa-bell", icon_color="bg-primary", link=None):
     """Create a notification for all users associated with a specific project"""
-    from app.models.user import User
-    
     try:
-        # Get all active users associated with the project (including admins)
-        project_users = User.query.filter_by(project_id=project_id, is_active=True).all()
-        notifications = []
-        
-        for user in project_users:
-            notification = create_notification(
-                title=title,
-                message=message,
-                user_id=user.id,
-                icon=icon,
-                icon_color=icon_color,
-                link=link
-            )
-            if notification:
-                notifications.append(notification)
-                
-        return notifications
+        project_users = audience_recipients('project_users', project_id=project_id)
+        return fan_out_notification(project_users, title, message, icon=icon, icon_color=icon_color, link=link)
     except Exception as e:
         current_app.logger.error(f"Error creating notifications for project users: {str(e)}")
-        return []
+        db.session.rollback()
+        return 0
 
 def create_notification_for_all_users(title, message, icon="fa-bell", icon_color="bg-primary", link=None):
     """Create a notification for all active users in the system"""
-    from app.models.user import User
-    
     try:
-        # Get all active users
-        users = User.query.filter_by(is_active=True).all()
-        notifications = []
-        
-        for user in users:
-            notification = create_notification(
-                title=title,
-                message=message,
-                user_id=user.id,
-                icon=icon,
-                icon_color=icon_color,
-                link=link
-            )
-            if notification:
-                notifications.append(notification)
-                
-        return notifications
+        users = audience_recipients('all_users')
+        return fan_out_notification(users, title, message, icon=icon, icon_color=icon_color, link=link)
     except Exception as e:
         current_app.logger.error(f"Error creating notifications for all users: {str(e)}")
-        return [] 
\ No newline at end of file
+        db.session.rollback()
+        return 0
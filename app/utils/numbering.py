@@ -0,0 +1,215 @@
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import and_, select
+from app import db
+from app.models.letter import Letter
+from app.models.letter_sequence import LetterSequence
+from app.models.number_reservation import NumberReservation
+from app.utils.database import insert_ignore
+
+HO_SCOPE = 'HO'
+RESERVATION_TTL = timedelta(minutes=15)
+MAX_NUMBER = 9999
+
+LETTER_NUMBER_YEAR = re.compile(r'/(\d{2})-\d+-\d+$')
+
+class SequenceExhaustedError(Exception):
+    """A letter number sequence has used up all MAX_NUMBER numbers of its year"""
+
+def project_scope(project_id):
+    return f'project:{int(project_id)}'
+
+def format_number(value):
+    """Format a sequence value as a 4-digit letter number"""
+    # Wrapping around would re-issue letter numbers that are already taken
+    if not 0 < value <= MAX_NUMBER:
+        raise SequenceExhaustedError(f"Letter number {value} is beyond the 4-digit limit of {MAX_NUMBER}")
+    return str(value).zfill(4)
+
+def valid_number(text):
+    """Check that an HO or project number entered by hand is 1..MAX_NUMBER"""
+    return text.isdigit() and 0 < int(text) <= MAX_NUMBER
+
+def format_letter_number(project_code, is_incoming, year, ho_number, project_number):
+    """Build a letter number such as KEC/HO/IN/25-0001-0001"""
+    letter_type_code = "IN" if is_incoming else "OU"
+    return f"KEC/{project_code}/{letter_type_code}/{year % 100:02d}-{ho_number}-{project_number}"
+
+def letter_year(letter_number, fallback=None):
+    """Get the four-digit year encoded in a letter number such as KEC/HO/IN/25-0001-0001"""
+    match = LETTER_NUMBER_YEAR.search(letter_number or '')
+    if match:
+        return 2000 + int(match.group(1))
+    return fallback.year if fallback else None
+
+def _sequence_condition(scope, is_incoming, year):
+    table = LetterSequence.__table__
+    return and_(table.c.scope == scope, table.c.is_incoming == is_incoming, table.c.year == year)
+
+def _highest_issued_number(scope, is_incoming, year):
+    """Highest number already used by letters in a sequence, for seeding new sequence rows"""
+    column = Letter.ho_number if scope == HO_SCOPE else Letter.project_number
+    query = db.session.query(column).distinct()\
+        .filter(Letter.is_incoming == is_incoming, column.isnot(None))\
+        .filter(Letter.letter_number.like(f'%/{year % 100:02d}-%'))
+    if scope != HO_SCOPE:
+        query = query.filter(Letter.project_id == int(scope.split(':', 1)[1]))
+    # Compared in Python: older rows can hold blank or non-numeric numbers,
+    # which PostgreSQL refuses to CAST to an integer. There are at most
+    # MAX_NUMBER distinct values per sequence.
+    return max((int(value) for (value,) in query if value.isdigit()), default=0)
+
+def _ensure_sequence(scope, is_incoming, year):
+    """Create the sequence row if it doesn't exist yet, seeded from existing letters"""
+    table = LetterSequence.__table__
+    condition = _sequence_condition(scope, is_incoming, year)
+    if db.session.execute(select(table.c.scope).where(condition)).first():
+        return
+
+    # Insert-if-absent, so a concurrent creator of the same row doesn't abort this transaction
+    statement = insert_ignore(table, db.engine.dialect.name)
+
+    seed = _highest_issued_number(scope, is_incoming, year)
+    db.session.execute(statement, {'scope': scope, 'is_incoming': is_incoming, 'year': year, 'last_value': seed})
+
+def allocate(scope, is_incoming, year, count=1):
+    """
+    Atomically take the next `count` values from a sequence and return them.
+    Raises SequenceExhaustedError if that would go past MAX_NUMBER; the caller
+    rolls back, which returns the values.
+
+    The increment is a single UPDATE, which takes the write lock on the row
+    (or on the database for SQLite) until the caller's transaction commits, so
+    concurrent allocators are serialized and never see the same value.
+    """
+    _ensure_sequence(scope, is_incoming, year)
+    table = LetterSequence.__table__
+    condition = _sequence_condition(scope, is_incoming, year)
+    db.session.execute(table.update().where(condition).values(last_value=table.c.last_value + count))
+    last_value = db.session.execute(select(table.c.last_value).where(condition)).scalar()
+    if last_value > MAX_NUMBER:
+        sequence = 'HO' if scope == HO_SCOPE else 'project'
+        letter_type = 'incoming' if is_incoming else 'outgoing'
+        raise SequenceExhaustedError(
+            f"All {MAX_NUMBER} {sequence} numbers for {letter_type} letters of {year} have been used")
+    return list(range(last_value - count + 1, last_value + 1))
+
+def advance_to(scope, is_incoming, year, value):
+    """Move a sequence forward so it never re-issues a number that was entered by hand"""
+    _ensure_sequence(scope, is_incoming, year)
+    table = LetterSequence.__table__
+    condition = and_(_sequence_condition(scope, is_incoming, year), table.c.last_value < value)
+    db.session.execute(table.update().where(condition).values(last_value=value))
+
+def allocate_letter_numbers(project_id, is_incoming, year=None):
+    """Allocate a fresh (ho_number, project_number) pair inside the caller's transaction"""
+    year = year or datetime.now().year
+    ho_value = allocate(HO_SCOPE, is_incoming, year)[0]
+    project_value = allocate(project_scope(project_id), is_incoming, year)[0]
+    return format_number(ho_value), format_number(project_value)
+
+def _next_value(scope, is_incoming, year):
+    """The value a sequence would issue next, without taking it or creating its row"""
+    table = LetterSequence.__table__
+    last_value = db.session.execute(
+        select(table.c.last_value).where(_sequence_condition(scope, is_incoming, year))).scalar()
+    if last_value is None:
+        last_value = _highest_issued_number(scope, is_incoming, year)
+    return last_value + 1
+
+def preview_letter_numbers(user_id, project_id, is_incoming, year=None):
+    """
+    The (ho_number, project_number, reservation) the create form would show,
+    without using any numbers up: the user's live reservation if there is one
+    (reservation is then not None), otherwise the next values of the sequences,
+    which another user may still take first.
+    """
+    year = year or datetime.now().year
+    reservation = NumberReservation.query.filter(
+        NumberReservation.user_id == user_id,
+        NumberReservation.project_id == project_id,
+        NumberReservation.is_incoming == is_incoming,
+        NumberReservation.year == year,
+        NumberReservation.expires_at >= datetime.utcnow()
+    ).first()
+    if reservation is not None:
+        return reservation.ho_number, reservation.project_number, reservation
+
+    ho_value = _next_value(HO_SCOPE, is_incoming, year)
+    project_value = _next_value(project_scope(project_id), is_incoming, year)
+    return format_number(ho_value), format_number(project_value), None
+
+def reserve_letter_numbers(user_id, project_id, is_incoming, year=None):
+    """
+    Reserve numbers to show on the create form. A user's live reservation for the
+    same project and letter type is reused, so toggling the form doesn't burn numbers.
+    """
+    year = year or datetime.now().year
+    now = datetime.utcnow()
+
+    NumberReservation.query.filter(NumberReservation.expires_at < now).delete(synchronize_session=False)
+
+    reservation = NumberReservation.query.filter_by(
+        user_id=user_id,
+        project_id=project_id,
+        is_incoming=is_incoming,
+        year=year
+    ).first()
+
+    if reservation is None:
+        ho_number, project_number = allocate_letter_numbers(project_id, is_incoming, year)
+        reservation = NumberReservation(
+            user_id=user_id,
+            project_id=project_id,
+            is_incoming=is_incoming,
+            year=year,
+            ho_number=ho_number,
+            project_number=project_number
+        )
+        db.session.add(reservation)
+
+    reservation.expires_at = now + RESERVATION_TTL
+    db.session.commit()
+    return reservation
+
+def claim_reservation(user_id, project_id, is_incoming, ho_number, project_number, year=None):
+    """Consume a matching live reservation in the caller's transaction. Returns True if one was found."""
+    year = year or datetime.now().year
+    reservation = NumberReservation.query.filter(
+        NumberReservation.user_id == user_id,
+        NumberReservation.project_id == project_id,
+        NumberReservation.is_incoming == is_incoming,
+        NumberReservation.year == year,
+        NumberReservation.ho_number == ho_number,
+        NumberReservation.project_number == project_number,
+        NumberReservation.expires_at >= datetime.utcnow()
+    ).first()
+
+    if reservation is None:
+        return False
+
+    db.session.delete(reservation)
+    return True
+
+def backfill_sequences():
+    """Raise every sequence to the highest number already used by existing letters"""
+    highest = {}
+    letters = db.session.query(
+        Letter.letter_number, Letter.project_id, Letter.is_incoming,
+        Letter.ho_number, Letter.project_number, Letter.created_at
+    ).yield_per(1000)
+
+    for letter_number, project_id, is_incoming, ho_number, project_number, created_at in letters:
+        year = letter_year(letter_number, created_at)
+        if year is None:
+            continue
+        is_incoming = bool(is_incoming)
+        for scope, number in ((HO_SCOPE, ho_number), (project_scope(project_id), project_number)):
+            if number and number.isdigit():
+                key = (scope, is_incoming, year)
+                highest[key] = max(highest.get(key, 0), int(number))
+
+    for (scope, is_incoming, year), value in highest.items():
+        advance_to(scope, is_incoming, year, value)
+    db.session.commit()
+    return len(highest)
@@ -0,0 +1,123 @@
+import base64
+from datetime import datetime
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+class KeysetPage:
+    """One page of keyset-paginated results plus the cursors to move from it"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, page_size=DEFAULT_PAGE_SIZE):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.page_size = page_size
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+def _encode(position, row_id):
+    raw = f"{position}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _decode(cursor, parse):
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        position, row_id = base64.urlsafe_b64decode(padded.encode()).decode().rsplit('|', 1)
+        return parse(position), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def encode_cursor(sort_value, row_id):
+    """Encode a (datetime, id) position as an opaque URL-safe cursor"""
+    return _encode(sort_value.isoformat(), row_id)
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor, returning None if it is malformed"""
+    return _decode(cursor, datetime.fromisoformat)
+
+def encode_rank_cursor(rank, row_id):
+    """Encode a (relevance rank, id) position as an opaque URL-safe cursor"""
+    return _encode(repr(float(rank)), row_id)
+
+def decode_rank_cursor(cursor):
+    """Decode a cursor produced by encode_rank_cursor, returning None if it is malformed"""
+    return _decode(cursor, float)
+
+def get_page_size(value, default=DEFAULT_PAGE_SIZE):
+    """Parse a page size request argument, clamped to 1..MAX_PAGE_SIZE"""
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return default
+
+def _seek(query, columns, after_key, before_key, page_size, descending):
+    """
+    Fetch the page of rows following after_key, or preceding before_key, in
+    the order of columns. Returns (rows, has_prev, has_next).
+    """
+    key = tuple_(*columns)
+    if before_key:
+        query = query.filter(key > before_key if descending else key < before_key)
+        query = query.order_by(*[column.asc() if descending else column.desc() for column in columns])
+    else:
+        if after_key:
+            query = query.filter(key < after_key if descending else key > after_key)
+        query = query.order_by(*[column.desc() if descending else column.asc() for column in columns])
+
+    rows = query.limit(page_size + 1).all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    if before_key:
+        rows.reverse()
+        return rows, has_more, True
+    return rows, after_key is not None, has_more
+
+def keyset_paginate(query, sort_column, id_column, after=None, before=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Paginate a query newest-first over (sort_column, id_column) using a seek predicate
+    instead of OFFSET, so every page costs the same regardless of how deep it is.
+    The predicate is a row-value comparison, which the database can turn into
+    an index range scan; the equivalent OR of two conditions can't be.
+    `after` moves to older rows, `before` moves back to newer rows.
+    """
+    rows, has_newer, has_older = _seek(query, (sort_column, id_column), decode_cursor(after),
+                                       decode_cursor(before), page_size, descending=True)
+
+    sort_key = sort_column.key
+    id_key = id_column.key
+    next_cursor = prev_cursor = None
+    if rows and has_older:
+        next_cursor = encode_cursor(getattr(rows[-1], sort_key), getattr(rows[-1], id_key))
+    if rows and has_newer:
+        prev_cursor = encode_cursor(getattr(rows[0], sort_key), getattr(rows[0], id_key))
+
+    return KeysetPage(rows, next_cursor, prev_cursor, page_size)
+
+def rank_paginate(query, rank_column, id_column, after=None, before=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Paginate a query best match first over (rank_column, id_column), where a
+    lower rank is a better match, as with bm25(). Works like keyset_paginate,
+    with cursors from encode_rank_cursor; the query's own ordering is replaced.
+    """
+    query = query.order_by(None).add_columns(rank_column)
+    rows, has_prev, has_next = _seek(query, (rank_column, id_column), decode_rank_cursor(after),
+                                     decode_rank_cursor(before), page_size, descending=False)
+
+    id_key = id_column.key
+    next_cursor = prev_cursor = None
+    if rows and has_next:
+        next_cursor = encode_rank_cursor(rows[-1][1], getattr(rows[-1][0], id_key))
+    if rows and has_prev:
+        prev_cursor = encode_rank_cursor(rows[0][1], getattr(rows[0][0], id_key))
+
+    return KeysetPage([item for item, _ in rows], next_cursor, prev_cursor, page_size)
@@ -0,0 +1,86 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from flask import current_app
+from app.utils.blobstore import blob_path, blob_exists, get_blob_root
+from app.utils.jobs import enqueue_job
+
+# Previews are PNGs of the first page, this many pixels wide
+PREVIEW_WIDTH = 320
+
+# Stored next to the blob they were rendered from: blobs/ab/cd/abcd....preview.png
+PREVIEW_SUFFIX = '.preview.png'
+
+RENDER_TIMEOUT = 60
+
+def preview_path(digest):
+    """Get the path of the first-page preview of a blob"""
+    return blob_path(digest) + PREVIEW_SUFFIX
+
+def preview_exists(digest):
+    """Check if a preview has been rendered for a blob"""
+    return bool(digest) and os.path.exists(preview_path(digest))
+
+def _render_with_pymupdf(source, target):
+    import fitz
+    with fitz.open(source) as document:
+        page = document[0]
+        zoom = PREVIEW_WIDTH / page.rect.width
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        with open(target, 'wb') as f:
+            f.write(pixmap.tobytes('png'))
+
+def _render_with_pdftoppm(source, target):
+    prefix = target[:-len('.png')]
+    subprocess.run(
+        ['pdftoppm', '-png', '-f', '1', '-l', '1', '-singlefile', '-scale-to-x', str(PREVIEW_WIDTH),
+         '-scale-to-y', '-1', source, prefix],
+        check=True,
+        capture_output=True,
+        timeout=RENDER_TIMEOUT
+    )
+
+def get_renderer():
+    """The first available renderer (PyMuPDF, then poppler's pdftoppm), or None"""
+    try:
+        import fitz  # noqa: F401
+        return _render_with_pymupdf
+    except ImportError:
+        pass
+    if shutil.which('pdftoppm'):
+        return _render_with_pdftoppm
+    return None
+
+def render_preview(digest):
+    """
+    Render the first page of a blob to its preview file.
+    Returns False if there is nothing to do or no renderer is installed.
+    """
+    if not blob_exists(digest) or preview_exists(digest):
+        return False
+
+    renderer = get_renderer()
+    if renderer is None:
+        current_app.logger.warning("No PDF renderer available (install PyMuPDF or poppler-utils); skipping previews")
+        return False
+
+    fd, temp_path = tempfile.mkstemp(prefix='.incoming-', suffix='.png', dir=get_blob_root())
+    os.close(fd)
+    try:
+        renderer(blob_path(digest), temp_path)
+        os.replace(temp_path, preview_path(digest))
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return True
+
+def queue_preview(digest):
+    """Queue rendering of a blob's preview in the caller's transaction, unless it already exists"""
+    if digest and not preview_exists(digest):
+        enqueue_job('previews.render', {'digest': digest}, max_attempts=3)
+
+def remove_preview(digest):
+    """Delete the preview of a blob, if any"""
+    if digest and os.path.exists(preview_path(digest)):
+        os.remove(preview_path(digest))
@@ -0,0 +1,135 @@
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload, object_session
+from app import db
+
+# How long a loaded principal is reused across requests. Changes made in this
+# process invalidate it at once; other processes see them within this window.
+PRINCIPAL_TTL = 30
+
+_cache = {}
+_lock = threading.Lock()
+
+@dataclass(frozen=True)
+class Principal:
+    """
+    Read-only snapshot of the logged-in user and their project, used as
+    current_user. Role flags are computed once, when the user is loaded.
+    """
+    id: int
+    username: str
+    email: str
+    role: Optional[str]
+    is_admin: bool
+    is_active: bool
+    is_head_office: bool
+    project_id: Optional[int]
+    project_code: Optional[str]
+    created_at: Optional[datetime]
+
+    # Flask-Login interface
+    is_authenticated = True
+    is_anonymous = False
+
+    def get_id(self):
+        return str(self.id)
+
+    @property
+    def is_head_office_admin(self):
+        return self.is_head_office and self.is_admin
+
+    @property
+    def is_head_office_user(self):
+        return self.is_head_office and not self.is_admin
+
+    @property
+    def is_project_admin(self):
+        return not self.is_head_office and self.is_admin
+
+    @property
+    def is_project_user(self):
+        return not self.is_head_office and not self.is_admin
+
+    def get_role_display(self):
+        if self.is_head_office_admin:
+            return "Head Office Admin"
+        elif self.is_head_office_user:
+            return "Head Office User"
+        elif self.is_project_admin:
+            return "Project Admin"
+        else:
+            return "Project User"
+
+    @classmethod
+    def from_user(cls, user):
+        project = user.project
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            role=user.role,
+            is_admin=bool(user.is_admin),
+            is_active=bool(user.is_active),
+            is_head_office=bool(project and project.is_head_office),
+            project_id=user.project_id,
+            project_code=project.project_code if project else None,
+            created_at=user.created_at
+        )
+
+def load_principal(user_id):
+    """Principal for a user id, from the cache or one query joining the user's project"""
+    now = time.monotonic()
+    with _lock:
+        cached = _cache.get(user_id)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    from app.models.user import User
+    user = User.query.options(joinedload(User.project)).get(user_id)
+    if user is None:
+        invalidate_principal(user_id)
+        return None
+
+    principal = Principal.from_user(user)
+    with _lock:
+        _cache[user_id] = (now + PRINCIPAL_TTL, principal)
+    return principal
+
+def invalidate_principal(user_id=None):
+    """Drop one user's cached principal, or every cached principal when user_id is None"""
+    with _lock:
+        if user_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(user_id, None)
+
+# Invalidate after commit rather than at flush, so a concurrent request can't
+# cache the old row again between the flush and the commit
+def _user_changed(mapper, connection, target):
+    object_session(target).info.setdefault('changed_principals', set()).add(target.id)
+
+def _project_changed(mapper, connection, target):
+    # A project's code or Head Office flag is part of every member's principal
+    object_session(target).info.setdefault('changed_principals', set()).add(None)
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_changed(session):
+    for user_id in session.info.pop('changed_principals', ()):
+        invalidate_principal(user_id)
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_changed(session):
+    session.info.pop('changed_principals', None)
+
+def _track_models():
+    from app.models.user import User
+    from app.models.project import Project
+    for identifier in ('after_update', 'after_delete'):
+        event.listen(User, identifier, _user_changed)
+        event.listen(Project, identifier, _project_changed)
+
+_track_models()
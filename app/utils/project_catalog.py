@@ -0,0 +1,94 @@
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+from app import db
+from app.utils.versions import get_versions, on_committed_change
+
+# Seconds between checks of the 'projects' version token. Changes made in this
+# process are picked up at once; other processes see them within this window.
+VERSION_CHECK_INTERVAL = 5
+
+@dataclass(frozen=True)
+class CatalogProject:
+    """The fields of a project needed by dropdowns, lookups and the projects page"""
+    id: int
+    project_code: str
+    name: str
+    is_head_office: bool
+    description: Optional[str]
+    created_at: Optional[datetime]
+
+class _Catalog:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.token = None
+        self.checked_at = 0.0
+        self.projects = ()
+        self.by_id = {}
+        self.by_code = {}
+
+_catalog = _Catalog()
+
+def _load(token):
+    from app.models.project import Project
+    rows = db.session.query(Project.id, Project.project_code, Project.name, Project.is_head_office,
+                            Project.description, Project.created_at)\
+        .order_by(Project.id)\
+        .all()
+    projects = tuple(CatalogProject(project_id, code, name, bool(is_head_office), description, created_at)
+                     for project_id, code, name, is_head_office, description, created_at in rows)
+    with _catalog.lock:
+        _catalog.token = token
+        _catalog.checked_at = time.monotonic()
+        _catalog.projects = projects
+        _catalog.by_id = {project.id: project for project in projects}
+        _catalog.by_code = {project.project_code: project for project in projects}
+
+def _refresh():
+    """Reload the catalog if its version token has changed since the last check"""
+    if _catalog.token is not None and time.monotonic() - _catalog.checked_at < VERSION_CHECK_INTERVAL:
+        return
+    token = get_versions('projects')
+    if token == _catalog.token:
+        _catalog.checked_at = time.monotonic()
+    else:
+        _load(token)
+
+def get_projects(head_office_first=False):
+    """All projects, ordered by id or with Head Office projects first"""
+    _refresh()
+    projects = list(_catalog.projects)
+    if head_office_first:
+        projects.sort(key=lambda project: not project.is_head_office)
+    return projects
+
+def get_project(project_id):
+    """A project by id, or None"""
+    _refresh()
+    try:
+        return _catalog.by_id.get(int(project_id))
+    except (TypeError, ValueError):
+        return None
+
+def get_project_by_code(project_code):
+    """A project by its code, or None"""
+    _refresh()
+    return _catalog.by_code.get(project_code)
+
+def get_visible_projects(user):
+    """Projects a user may pick from: all of them for Head Office, otherwise their own"""
+    if user.is_head_office:
+        return get_projects()
+    project = get_project(user.project_id)
+    return [project] if project else []
+
+def invalidate_catalog():
+    """Force the next lookup to reload the catalog"""
+    with _catalog.lock:
+        _catalog.token = None
+
+# Project writes bump the 'projects' version in the same transaction; this just
+# skips the wait for the next version check in the process that made the change
+on_committed_change('projects', invalidate_catalog)
@@ -0,0 +1,141 @@
+from datetime import datetime
+from sqlalchemy import tuple_
+from app import db
+
+# Registered hot queries: name -> function building a representative query
+HOT_QUERIES = {}
+
+def hot_query(name):
+    """Register a query shape that runs on a hot path, for the index advisor"""
+    def decorator(f):
+        HOT_QUERIES[name] = f
+        return f
+    return decorator
+
+@hot_query('letters.list_by_project_and_type')
+def _letters_by_project_and_type():
+    from app.models.letter import Letter
+    return Letter.summary_query()\
+        .filter(Letter.project_id == 1, Letter.is_incoming == True)\
+        .filter(tuple_(Letter.date, Letter.id) < (datetime(2025, 1, 1), 100))\
+        .order_by(Letter.date.desc(), Letter.id.desc())\
+        .limit(51)
+
+@hot_query('letters.list_by_project')
+def _letters_by_project():
+    from app.models.letter import Letter
+    return Letter.summary_query()\
+        .filter(Letter.project_id == 1)\
+        .order_by(Letter.date.desc(), Letter.id.desc())\
+        .limit(51)
+
+@hot_query('letters.list_by_type')
+def _letters_by_type():
+    from app.models.letter import Letter
+    return Letter.summary_query()\
+        .filter(Letter.is_incoming == False)\
+        .order_by(Letter.date.desc(), Letter.id.desc())\
+        .limit(51)
+
+@hot_query('letters.list_all')
+def _letters_all():
+    from app.models.letter import Letter
+    return Letter.summary_query()\
+        .order_by(Letter.date.desc(), Letter.id.desc())\
+        .limit(51)
+
+@hot_query('dashboard.recent_letters')
+def _recent_letters():
+    from app.models.letter import Letter
+    return Letter.summary_query()\
+        .filter(Letter.project_id == 1)\
+        .order_by(Letter.created_at.desc())\
+        .limit(5)
+
+@hot_query('dashboard.project_stats')
+def _project_stats():
+    from app.models.project_letter_stats import ProjectLetterStats
+    return ProjectLetterStats.query.filter_by(project_id=1)
+
+@hot_query('numbering.allocate')
+def _allocate_number():
+    from app.models.letter_sequence import LetterSequence
+    table = LetterSequence.__table__
+    return table.update()\
+        .where(table.c.scope == 'HO', table.c.is_incoming == True, table.c.year == 2025)\
+        .values(last_value=table.c.last_value + 1)
+
+@hot_query('numbering.current_value')
+def _current_number():
+    from app.models.letter_sequence import LetterSequence
+    table = LetterSequence.__table__
+    return db.select(table.c.last_value)\
+        .where(table.c.scope == 'HO', table.c.is_incoming == True, table.c.year == 2025)
+
+@hot_query('notifications.latest')
+def _latest_notifications():
+    from app.models.notification import Notification
+    return Notification.query\
+        .filter_by(user_id=1)\
+        .order_by(Notification.created_at.desc())\
+        .limit(10)
+
+@hot_query('notifications.unread_count')
+def _unread_count():
+    from app.models.notification import Notification
+    return db.session.query(db.func.count(Notification.id))\
+        .filter_by(user_id=1, read=False)
+
+@hot_query('notifications.duplicate_check')
+def _duplicate_check():
+    from app.models.notification import Notification
+    return Notification.query\
+        .filter_by(user_id=1, title='t', message='m', read=False)\
+        .limit(1)
+
+@hot_query('users.project_recipients')
+def _project_recipients():
+    from app.models.user import User
+    return User.query.with_entities(User.id).filter_by(project_id=1, is_active=True)
+
+@hot_query('users.admin_recipients')
+def _admin_recipients():
+    from app.models.user import User
+    return User.query.with_entities(User.id).filter_by(is_admin=True, is_active=True)
+
+def explain(query):
+    """Return the database's query plan for an ORM query or Core statement as a list of text lines"""
+    engine = db.engine
+    statement = getattr(query, 'statement', query)
+    compiled = statement.compile(dialect=engine.dialect)
+    params = compiled.construct_params()
+
+    with engine.connect() as connection:
+        if engine.dialect.name == 'sqlite':
+            values = tuple(params[name] for name in compiled.positiontup)
+            rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', values)
+            return [row[-1] for row in rows]
+
+        rows = connection.exec_driver_sql(f'EXPLAIN {compiled}', params)
+        return [row[0] for row in rows]
+
+def find_plan_problems(plan):
+    """Flag full table scans and sorts that an index could avoid"""
+    problems = []
+    for line in plan:
+        upper = line.upper()
+        if upper.startswith('SCAN') and 'USING' not in upper and 'VIRTUAL TABLE' not in upper:
+            problems.append(f'full scan: {line}')
+        elif 'SEQ SCAN' in upper:
+            problems.append(f'full scan: {line.strip()}')
+        elif 'USE TEMP B-TREE' in upper:
+            problems.append(f'sort without index: {line}')
+    return problems
+
+def advise_indexes():
+    """Explain every registered hot query; returns [(name, plan, problems)]"""
+    results = []
+    for name, build in sorted(HOT_QUERIES.items()):
+        plan = explain(build())
+        results.append((name, plan, find_plan_problems(plan)))
+    return results
@@ -0,0 +1,36 @@
+import time
+from functools import wraps
+from flask import current_app, session
+from app import db
+from app.extensions import REPLICA_BIND
+
+# Session key holding the time until which a user's reads stay on the primary
+PRIMARY_UNTIL_KEY = '_primary_until'
+
+def replica_enabled():
+    """Check if a read replica is configured"""
+    return REPLICA_BIND in (current_app.config.get('SQLALCHEMY_BINDS') or {})
+
+def use_replica(view):
+    """
+    Serve a read-only view's letter queries from the read replica, if one is
+    configured. Users who wrote something in the last REPLICA_STICKY_SECONDS
+    read from the primary instead, so replication lag never hides their own changes.
+    """
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        if replica_enabled() and session.get(PRIMARY_UNTIL_KEY, 0) <= time.time():
+            db.session.info['use_replica'] = True
+        return view(*args, **kwargs)
+    return decorated
+
+def init_replica(app):
+    """Keep users on the primary for a few seconds after each request that wrote"""
+    if REPLICA_BIND in (app.config.get('SQLALCHEMY_BINDS') or {}):
+        app.logger.info('Read replica enabled for letter list, search and dashboard queries')
+
+    @app.after_request
+    def stick_to_primary_after_write(response):
+        if replica_enabled() and db.session.info.get('wrote'):
+            session[PRIMARY_UNTIL_KEY] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+        return response
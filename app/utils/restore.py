@@ -0,0 +1,158 @@
+import os
+import time
+import uuid
+import shutil
+import threading
+from flask import current_app
+from app import db
+from app.utils.backup_backends import BackendError
+from app.utils.backups import (
+    get_database_path, get_backup_backend, get_backup_dir, create_backup, materialize_backup, BackupError
+)
+
+# Seconds between checks of the generation file
+GENERATION_CHECK_INTERVAL = 1
+
+class RestoreError(Exception):
+    """A backup was rejected or could not be restored"""
+
+class _Generation:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = None
+        self.checked_at = 0.0
+
+_generation = _Generation()
+
+def generation_path():
+    """
+    File whose content changes every time a SQLite database is restored. Other
+    databases need no connection reset; their caches follow the version tokens.
+    """
+    path = get_database_path()
+    return path + '.generation' if path else None
+
+def _read_generation():
+    try:
+        with open(generation_path()) as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+def bump_generation():
+    """Tell every worker process that the database was replaced"""
+    path = generation_path()
+    if path is None:
+        return
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(temp_path, path)
+
+def check_generation():
+    """
+    Drop pooled connections and in-process caches if the database was restored
+    by any process since the last check. Runs at the start of each request.
+    """
+    if generation_path() is None:
+        return
+    now = time.monotonic()
+    if now - _generation.checked_at < GENERATION_CHECK_INTERVAL:
+        return
+
+    value = _read_generation()
+    with _generation.lock:
+        _generation.checked_at = now
+        if _generation.value is None:
+            _generation.value = value
+            return
+        if value == _generation.value:
+            return
+        _generation.value = value
+
+    current_app.logger.info("Database was restored; resetting connections and caches")
+    db.session.remove()
+    db.engine.dispose()
+    _reset_caches()
+
+def _reset_caches():
+    from app.utils.project_catalog import invalidate_catalog
+    from app.utils.settings import invalidate_settings
+    from app.utils.principal import invalidate_principal
+    invalidate_catalog()
+    invalidate_settings()
+    invalidate_principal()
+
+def validate_database_file(path):
+    """Check that a file is an intact backup of this app's database"""
+    try:
+        get_backup_backend().validate(path)
+    except (BackendError, BackupError) as e:
+        raise RestoreError(str(e))
+
+def restore_database_file(source_path):
+    """
+    Replace the contents of the live database with a backup file.
+
+    The file is copied to a side file and validated first, and the current
+    database is backed up. The database backend then loads the side file in
+    a single transaction: other connections see either the old database or
+    the new one, never a partial copy. Other workers reset their caches when
+    they see the new generation or version tokens.
+    Returns the filename of the pre-restore backup.
+    """
+    try:
+        backend = get_backup_backend()
+    except BackupError as e:
+        raise RestoreError(str(e))
+
+    side_path = os.path.join(get_backup_dir(), f'.restore-{os.getpid()}-{uuid.uuid4().hex[:8]}')
+    shutil.copyfile(source_path, side_path)
+    try:
+        validate_database_file(side_path)
+
+        try:
+            safety_backup = create_backup(prefix='pre_restore_')
+        except BackupError as e:
+            raise RestoreError(f'Could not back up the current database first: {str(e)}')
+
+        db.session.remove()
+        started = time.monotonic()
+        try:
+            backend.restore(side_path)
+        except BackendError as e:
+            raise RestoreError(f'{str(e)} (the previous state is saved as {safety_backup})')
+        current_app.logger.info(f"Database contents replaced in {time.monotonic() - started:.3f}s")
+    finally:
+        if os.path.exists(side_path):
+            os.remove(side_path)
+
+    bump_generation()
+    _after_restore()
+    return safety_backup
+
+def _after_restore():
+    # Bring an older backup up to the current schema, then make every cache reload
+    from app.utils.database import create_tables
+    from app.utils.letter_stats import reconcile_letter_stats
+    from app.utils.versions import bump_version
+    db.engine.dispose()
+    create_tables()
+    # Tables an older archive doesn't have keep their rows on PostgreSQL, so recount
+    reconcile_letter_stats()
+    for name in ('users', 'projects', 'settings'):
+        bump_version(name)
+    db.session.commit()
+    _reset_caches()
+
+def restore_backup(filename):
+    """Restore a backup from the backups directory. Returns the filename of the pre-restore backup."""
+    try:
+        path, is_temporary = materialize_backup(filename)
+    except BackupError as e:
+        raise RestoreError(str(e))
+    try:
+        return restore_database_file(path)
+    finally:
+        if is_temporary:
+            os.remove(path)
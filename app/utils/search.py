@@ -0,0 +1,105 @@
+import re
+from flask import current_app
+from sqlalchemy import text, Integer, Float, or_
+from app import db
+from app.models.letter import Letter
+
+# Columns covered by the full-text index, in index order
+SEARCH_COLUMNS = ('letter_number', 'description', 'object_of', 'sender', 'recipient')
+
+_fts_available = {}
+
+def fts_available():
+    """Check whether the current database supports the letters FTS5 index"""
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return False
+
+    if engine.url not in _fts_available:
+        with engine.connect() as connection:
+            options = {row[0] for row in connection.exec_driver_sql('PRAGMA compile_options')}
+        _fts_available[engine.url] = 'ENABLE_FTS5' in options
+    return _fts_available[engine.url]
+
+def ensure_search_index():
+    """Create the letters_fts index and its sync triggers if they don't exist yet"""
+    if not fts_available():
+        return False
+
+    columns = ', '.join(SEARCH_COLUMNS)
+    new_values = ', '.join(f'new.{column}' for column in SEARCH_COLUMNS)
+    old_values = ', '.join(f'old.{column}' for column in SEARCH_COLUMNS)
+
+    with db.engine.begin() as connection:
+        exists = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'letters_fts'")).first()
+
+        connection.exec_driver_sql(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS letters_fts USING fts5(
+                {columns}, content='letters', content_rowid='id',
+                tokenize='unicode61', prefix='2 3'
+            )""")
+        connection.exec_driver_sql(f"""
+            CREATE TRIGGER IF NOT EXISTS letters_fts_insert AFTER INSERT ON letters BEGIN
+                INSERT INTO letters_fts(rowid, {columns}) VALUES (new.id, {new_values});
+            END""")
+        connection.exec_driver_sql(f"""
+            CREATE TRIGGER IF NOT EXISTS letters_fts_delete AFTER DELETE ON letters BEGIN
+                INSERT INTO letters_fts(letters_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+            END""")
+        connection.exec_driver_sql(f"""
+            CREATE TRIGGER IF NOT EXISTS letters_fts_update AFTER UPDATE OF {columns} ON letters BEGIN
+                INSERT INTO letters_fts(letters_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+                INSERT INTO letters_fts(rowid, {columns}) VALUES (new.id, {new_values});
+            END""")
+
+        if not exists:
+            connection.exec_driver_sql("INSERT INTO letters_fts(letters_fts) VALUES ('rebuild')")
+            current_app.logger.info("Built letters full-text search index")
+
+    return True
+
+def rebuild_search_index():
+    """Rebuild the letters_fts index from the letters table"""
+    if not ensure_search_index():
+        return False
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql("INSERT INTO letters_fts(letters_fts) VALUES ('rebuild')")
+        connection.exec_driver_sql("INSERT INTO letters_fts(letters_fts) VALUES ('optimize')")
+    return True
+
+def build_match_expression(search_term):
+    """
+    Turn free text into an FTS5 query: every word must match, and the
+    last word is treated as a prefix so results update while typing.
+    """
+    tokens = re.findall(r'\w+', search_term, flags=re.UNICODE)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+def apply_letter_search(query, search_term):
+    """
+    Restrict a Letter query to letters matching search_term.
+    Returns (query, rank): with full-text search, rank is the bm25() column
+    (lower is a better match) and the query is already ordered by it, best
+    first, so it should not be re-sorted. Otherwise rank is None.
+    """
+    match = build_match_expression(search_term) if fts_available() else None
+
+    if match:
+        matches = text(
+            "SELECT rowid AS letter_id, bm25(letters_fts) AS rank "
+            "FROM letters_fts WHERE letters_fts MATCH :match"
+        ).bindparams(match=match).columns(letter_id=Integer, rank=Float).subquery('search')
+        query = query.join(matches, matches.c.letter_id == Letter.id)\
+            .order_by(matches.c.rank, Letter.id)
+        return query, matches.c.rank
+
+    # Fallback for databases without FTS5. ilike keeps it case-insensitive on
+    # PostgreSQL, where LIKE is case-sensitive.
+    search = f"%{search_term}%"
+    query = query.filter(or_(*[getattr(Letter, column).ilike(search) for column in SEARCH_COLUMNS]))
+    return query, None
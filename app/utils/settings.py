@@ -0,0 +1,134 @@
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any
+from flask import current_app
+from app import db
+from app.models.setting import Setting
+from app.utils.versions import get_versions, on_committed_change
+
+# Seconds between checks of the 'settings' version token. Writes in this
+# process are picked up at once; other processes see them within this window.
+VERSION_CHECK_INTERVAL = 5
+
+@dataclass(frozen=True)
+class SettingDefinition:
+    key: str
+    type: type
+    default: Any
+    description: str
+
+# Declared settings: key -> SettingDefinition
+SETTINGS = {}
+
+def define_setting(key, type, default, description):
+    """Declare a setting with its type and default value"""
+    SETTINGS[key] = SettingDefinition(key, type, default, description)
+    return SETTINGS[key]
+
+define_setting('auto_backup_enabled', bool, True, 'Enable automatic weekly database backups')
+define_setting('auto_backup_keep_count', int, 5, 'Number of automatic backups to keep')
+
+def parse_value(raw, value_type):
+    """Convert a stored string to value_type"""
+    if value_type is bool:
+        lowered = raw.strip().lower()
+        if lowered in ('true', '1', 'yes', 'on'):
+            return True
+        if lowered in ('false', '0', 'no', 'off', ''):
+            return False
+        raise ValueError(f"'{raw}' is not a boolean")
+    return value_type(raw)
+
+def format_value(value, value_type):
+    """Convert a value to the string stored in the settings table"""
+    if value_type is bool:
+        if isinstance(value, str):
+            value = parse_value(value, bool)
+        return 'true' if value else 'false'
+    return str(value_type(value))
+
+def _guess_value(raw):
+    # Undeclared settings keep the old heuristic coercion
+    if raw.lower() in ('true', 'false'):
+        return raw.lower() == 'true'
+    try:
+        if '.' in raw:
+            return float(raw)
+        return int(raw)
+    except ValueError:
+        return raw
+
+class _SettingsCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.token = None
+        self.checked_at = 0.0
+        self.values = {}
+
+_cache = _SettingsCache()
+
+def _load(token):
+    values = {}
+    for key, raw in db.session.query(Setting.key, Setting.value):
+        definition = SETTINGS.get(key)
+        if definition is None:
+            values[key] = _guess_value(raw)
+            continue
+        try:
+            values[key] = parse_value(raw, definition.type)
+        except (TypeError, ValueError):
+            current_app.logger.warning(f"Ignoring invalid value {raw!r} for setting {key}")
+    with _cache.lock:
+        _cache.values = values
+        _cache.token = token
+        _cache.checked_at = time.monotonic()
+
+def _refresh():
+    if _cache.token is not None and time.monotonic() - _cache.checked_at < VERSION_CHECK_INTERVAL:
+        return
+    token = get_versions('settings')
+    if token == _cache.token:
+        _cache.checked_at = time.monotonic()
+    else:
+        _load(token)
+
+def get_setting(key, default=None):
+    """
+    A setting's value from the in-memory cache. Declared settings come back as
+    their declared type, falling back to `default` or the declared default.
+    """
+    _refresh()
+    if key in _cache.values:
+        return _cache.values[key]
+    if default is None and key in SETTINGS:
+        return SETTINGS[key].default
+    return default
+
+def set_setting(key, value, description=None, commit=True):
+    """Store a setting, validating declared settings against their type"""
+    definition = SETTINGS.get(key)
+    stored = format_value(value, definition.type) if definition else str(value)
+    description = description or (definition.description if definition else None)
+
+    setting = Setting.query.filter_by(key=key).first()
+    if setting:
+        setting.value = stored
+        setting.updated_at = datetime.utcnow()
+        if description:
+            setting.description = description
+    else:
+        setting = Setting(key=key, value=stored, description=description)
+        db.session.add(setting)
+
+    if commit:
+        db.session.commit()
+    return setting
+
+def invalidate_settings():
+    """Force the next lookup to reload settings"""
+    with _cache.lock:
+        _cache.token = None
+
+on_committed_change('settings', invalidate_settings)
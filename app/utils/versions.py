@@ -0,0 +1,69 @@
+import uuid
+from sqlalchemy import event, select
+from sqlalchemy.orm import object_session
+from app import db
+from app.models.change_version import ChangeVersion
+from app.utils.database import insert_ignore
+
+def new_token():
+    return uuid.uuid4().hex
+
+def bump_version(name, connection=None):
+    """
+    Give a data set a new version token, in the caller's transaction.
+    Tokens are random rather than counted so a restored database can
+    never reuse a token for different data.
+    """
+    connection = connection or db.session.connection()
+    table = ChangeVersion.__table__
+    token = new_token()
+    result = connection.execute(table.update().where(table.c.name == name).values(token=token))
+    if result.rowcount == 0:
+        connection.execute(insert_ignore(table, connection.dialect.name), {'name': name, 'token': token})
+
+def get_versions(*names):
+    """Current version tokens for the given data sets, as one string suitable for an ETag"""
+    table = ChangeVersion.__table__
+    tokens = dict(db.session.execute(select(table.c.name, table.c.token).where(table.c.name.in_(names))).all())
+    return '.'.join(tokens.get(name, '0') for name in names)
+
+# Functions to call after a commit that changed a tracked data set: name -> [callback]
+_commit_callbacks = {}
+
+def on_committed_change(name, callback):
+    """Call callback() after every commit that changed the named data set through the ORM"""
+    _commit_callbacks.setdefault(name, []).append(callback)
+
+def track_changes(model, name):
+    """Bump the named version whenever rows of model are inserted, updated or deleted through the ORM"""
+    def bump(mapper, connection, target):
+        bump_version(name, connection)
+        object_session(target).info.setdefault('changed_versions', set()).add(name)
+
+    for identifier in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model, identifier, bump)
+
+# Callbacks run after commit rather than at flush, so a concurrent request
+# can't reload the old rows between the flush and the commit
+@event.listens_for(db.session, 'after_commit')
+def _run_commit_callbacks(session):
+    for name in session.info.pop('changed_versions', ()):
+        for callback in _commit_callbacks.get(name, ()):
+            callback()
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('changed_versions', None)
+
+def _track_models():
+    from app.models.user import User
+    from app.models.project import Project
+    from app.models.setting import Setting
+    from app.models.notification import Notification
+    track_changes(User, 'users')
+    track_changes(Project, 'projects')
+    track_changes(Setting, 'settings')
+    # Lets every process's notification streams see changes made elsewhere
+    track_changes(Notification, 'notifications')
+
+_track_models()
@@ -0,0 +1,53 @@
+import io
+import time
+import zipfile
+from collections import namedtuple
+
+# chunks is an iterable of bytes. compress=False stores the data as it is, which
+# suits files that are already compressed such as PDFs. size, if known, lets
+# zipfile switch to ZIP64 for entries over 2GB; date_time defaults to now.
+ZipEntry = namedtuple('ZipEntry', ('name', 'chunks', 'compress', 'size', 'date_time'),
+                      defaults=(True, None, None))
+
+class _Pipe(io.RawIOBase):
+    """Unseekable file object that collects what zipfile writes, for the generator to hand on"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_zip(entries):
+    """
+    Yield a zip archive chunk by chunk while it is being built from ZipEntry
+    items. Only the current chunk is held in memory: zipfile writes sizes and
+    checksums after each entry's data, since the output can't seek.
+    """
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, 'w') as archive:
+        for entry in entries:
+            info = zipfile.ZipInfo(entry.name, date_time=entry.date_time or time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED if entry.compress else zipfile.ZIP_STORED
+            if entry.size is not None:
+                info.file_size = entry.size
+            with archive.open(info, 'w') as member:
+                for chunk in entry.chunks:
+                    member.write(chunk)
+                    yield from _drain(pipe)
+            yield from _drain(pipe)
+    yield from _drain(pipe)
+
+def _drain(pipe):
+    data = pipe.take()
+    if data:
+        yield data
@@ -1,17 +1,52 @@
 import os
 from dotenv import load_dotenv
+from sqlalchemy.pool import QueuePool
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 load_dotenv(os.path.join(basedir, '.env'))
 
+def database_url(name, default=None):
+    """A database URL from the environment, accepting the postgres:// scheme some hosts hand out"""
+    url = os.environ.get(name) or default
+    if url and url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
 class Config:
     """Base configuration"""
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-here'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = os.path.join(basedir, 'app/static/uploads')
+    BLOB_STORE_FOLDER = os.environ.get('BLOB_STORE_FOLDER') or os.path.join(basedir, 'instance/blobs')
+    # How letter PDFs are sent after the permission check: 'app' streams them from Python,
+    # 'x-accel' (nginx) and 'x-sendfile' (Apache, lighttpd) hand the transfer to the web server
+    FILE_TRANSFER_MODE = os.environ.get('FILE_TRANSFER_MODE', 'app').lower()
+    # Internal nginx location aliased to BLOB_STORE_FOLDER, used by 'x-accel'
+    BLOB_ACCEL_PREFIX = os.environ.get('BLOB_ACCEL_PREFIX', '/protected-blobs/')
+    # Zip archives of letter PDFs, kept so repeated downloads are served from disk and can resume
+    ARCHIVE_CACHE_FOLDER = os.environ.get('ARCHIVE_CACHE_FOLDER') or os.path.join(basedir, 'instance/archives')
+    ARCHIVE_CACHE_MAX_MB = int(os.environ.get('ARCHIVE_CACHE_MAX_MB', 5120))
     MAX_CONTENT_LENGTH = 64 * 1024 * 1024  # 64MB max file size
     ALLOWED_EXTENSIONS = {'pdf'}
     ADMIN_CODE = os.environ.get('ADMIN_CODE') or 'admin123'
+    # Push notifications over server-sent events; when disabled the browser polls /api/notifications.
+    # Each open tab holds a worker for minutes, so only enable this with threaded or async workers.
+    # Streams in every worker process see a change within a few seconds, through a shared version token.
+    NOTIFICATION_STREAM_ENABLED = os.environ.get('NOTIFICATION_STREAM_ENABLED', 'false').lower() == 'true'
+    # Process queued jobs in this process. Flask CLI commands other than `flask run`
+    # never start the worker, so a bulk command doesn't compete with it for the database.
+    JOB_WORKER_ENABLED = os.environ.get('JOB_WORKER_ENABLED', 'true').lower() == 'true'
+    # Pragmas applied to every new SQLite connection; empty keeps SQLite's defaults
+    SQLITE_PRAGMAS = {}
+    # Optional read replica of a PostgreSQL primary. Letter list, search and
+    # dashboard queries go there, except for users who wrote in the last
+    # REPLICA_STICKY_SECONDS, who keep reading from the primary.
+    READ_REPLICA_URL = database_url('READ_REPLICA_URL')
+    SQLALCHEMY_BINDS = {'replica': READ_REPLICA_URL} if READ_REPLICA_URL else None
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+    # PostgreSQL client tools used for backup and restore, when not on the PATH
+    PG_DUMP_PATH = os.environ.get('PG_DUMP_PATH')
+    PG_RESTORE_PATH = os.environ.get('PG_RESTORE_PATH')
     
     @staticmethod
     def init_app(app):
@@ -20,20 +55,48 @@ class Config:
 class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DEV_DATABASE_URL') or \
-        'sqlite:///' + os.path.join(basedir, 'letter_registry.db')
+    SQLALCHEMY_DATABASE_URI = database_url('DEV_DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'letter_registry.db'))
 
 class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
-    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
-        'sqlite:///' + os.path.join(basedir, 'letter_registry_test.db')
+    SQLALCHEMY_DATABASE_URI = database_url('TEST_DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'letter_registry_test.db'))
     WTF_CSRF_ENABLED = False
 
 class ProductionConfig(Config):
     """Production configuration"""
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
-        'sqlite:///' + os.path.join(basedir, 'letter_registry.db')
+    SQLALCHEMY_DATABASE_URI = database_url('DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'letter_registry.db'))
+    
+    # WAL lets readers in every worker carry on while one connection writes
+    SQLITE_PRAGMAS = {
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),  # ms to wait for a lock
+        'journal_mode': 'wal',
+        'synchronous': 'normal',    # a power cut may drop the last commits, but never corrupts a WAL database
+        'cache_size': -16000,       # 16MB page cache per connection
+        'mmap_size': 268435456,     # read through a 256MB memory map
+        'temp_store': 'memory'
+    }
+    
+    # Keep SQLite connections open across requests, so the pragmas and page
+    # cache aren't rebuilt for every request. Other databases keep their defaults.
+    if SQLALCHEMY_DATABASE_URI.startswith('sqlite:'):
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            'poolclass': QueuePool,
+            'pool_size': int(os.environ.get('DATABASE_POOL_SIZE', 5)),
+            'max_overflow': 10,
+            'pool_timeout': 30,
+            'connect_args': {'check_same_thread': False}
+        }
+    elif SQLALCHEMY_DATABASE_URI.startswith('postgresql'):
+        # Check connections before use, so a restarted or failed-over server
+        # doesn't hand the first request after it a dead connection
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            'pool_size': int(os.environ.get('DATABASE_POOL_SIZE', 5)),
+            'max_overflow': 10,
+            'pool_timeout': 30,
+            'pool_recycle': 1800,
+            'pool_pre_ping': True
+        }
     
     @classmethod
     def init_app(cls, app):
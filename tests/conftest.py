@@ -0,0 +1,92 @@
+import io
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from app import create_app, db, scheduler
+from app.models import Letter, Project
+from app.utils.database import init_default_settings
+from app.utils.principal import invalidate_principal
+from app.utils.project_catalog import invalidate_catalog
+from app.utils.settings import invalidate_settings
+
+PDF = b'%PDF-1.4\n' + b'x' * 2000 + b'\n%%EOF\n'
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """An app on a fresh SQLite database, with its files under tmp_path and no job worker"""
+    # The app writes its log file relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config.TestingConfig, 'SQLALCHEMY_DATABASE_URI', f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setattr(config.TestingConfig, 'BLOB_STORE_FOLDER', str(tmp_path / 'blobs'))
+    monkeypatch.setattr(config.TestingConfig, 'ARCHIVE_CACHE_FOLDER', str(tmp_path / 'archives'))
+    monkeypatch.setattr(config.TestingConfig, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(config.TestingConfig, 'JOB_WORKER_ENABLED', False)
+
+    # Process-wide caches would otherwise carry rows over from the previous test's database
+    invalidate_catalog()
+    invalidate_settings()
+    invalidate_principal()
+
+    app = create_app('testing')
+    with app.app_context():
+        init_default_settings()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+    # create_app() starts the shared scheduler; the next app starts it again
+    scheduler.shutdown(wait=False)
+
+@pytest.fixture
+def head_office(app):
+    return Project.query.filter_by(is_head_office=True).one()
+
+@pytest.fixture
+def project(app):
+    project = Project(name='Project One', project_code='P1')
+    db.session.add(project)
+    db.session.commit()
+    return project
+
+@pytest.fixture
+def client(app, head_office):
+    """A test client logged in as the default head office admin"""
+    client = app.test_client()
+    response = client.post('/auth/login', data={'username': 'admin', 'password': 'admin123',
+                                                'project_id': head_office.id})
+    assert response.status_code == 302
+    return client
+
+def make_letter(project, number, date=None, is_incoming=True, **fields):
+    """Insert a letter directly, bypassing numbering"""
+    letter = Letter(
+        letter_number=f'KEC/{project.project_code}/{"IN" if is_incoming else "OU"}/25-{number:04d}-{number:04d}',
+        project_id=project.id,
+        date=date or datetime(2025, 1, 1),
+        object_of=fields.pop('object_of', f'Letter {number}'),
+        ho_number=f'{number:04d}',
+        project_number=f'{number:04d}',
+        is_incoming=is_incoming,
+        created_by=1,
+        **fields
+    )
+    db.session.add(letter)
+    db.session.commit()
+    return letter
+
+def post_letter(client, project, is_incoming=True, **fields):
+    """Submit the create letter form with a small PDF"""
+    data = {
+        'project_id': project.id,
+        'letter_type': 'incoming' if is_incoming else 'outgoing',
+        'date': '2025-02-01',
+        'object_of': 'Subject',
+        'letter_file': (io.BytesIO(PDF), 'letter.pdf')
+    }
+    data.update(fields)
+    return client.post('/letters/create', data=data, content_type='multipart/form-data')
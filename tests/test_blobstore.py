@@ -0,0 +1,80 @@
+import io
+import os
+
+import pytest
+
+from app import db
+from app.models import Letter
+from app.models.blob import Blob
+from app.utils.blobstore import (
+    PURGED_SUFFIX, InvalidUploadError, acquire_blob, blob_path, collect_garbage, purge_blob, release_blob,
+    store_bytes, store_stream
+)
+from conftest import PDF, post_letter
+
+def ref_count(digest):
+    blob = Blob.query.get(digest)
+    return blob.ref_count if blob else None
+
+def test_identical_content_is_stored_once(app):
+    first = store_bytes(PDF)
+    second = store_bytes(PDF)
+    assert first == second
+    assert os.path.exists(blob_path(first[0]))
+
+def test_uploads_must_be_pdfs(app):
+    with pytest.raises(InvalidUploadError):
+        store_stream(io.BytesIO(b'MZ not a pdf'))
+    with pytest.raises(InvalidUploadError):
+        store_stream(io.BytesIO(b''))
+
+def test_reference_counts(app):
+    digest, size = store_bytes(PDF)
+    acquire_blob(digest, size)
+    acquire_blob(digest, size)
+    db.session.commit()
+    assert ref_count(digest) == 2
+
+    release_blob(digest)
+    db.session.commit()
+    assert not purge_blob(digest)
+    assert ref_count(digest) == 1 and os.path.exists(blob_path(digest))
+
+    release_blob(digest)
+    db.session.commit()
+    assert purge_blob(digest)
+    assert ref_count(digest) is None and not os.path.exists(blob_path(digest))
+
+def test_acquire_brings_back_a_purged_file(app):
+    # An upload of the same content found the file just before it was purged
+    digest, size = store_bytes(PDF)
+    db.session.add(Blob(sha256=digest, size=size, ref_count=0))
+    db.session.commit()
+    assert purge_blob(digest)
+
+    acquire_blob(digest, size)
+    db.session.commit()
+    assert os.path.exists(blob_path(digest)) and ref_count(digest) == 1
+
+def test_garbage_collection_deletes_retired_files_later(app):
+    digest, size = store_bytes(PDF)
+    db.session.add(Blob(sha256=digest, size=size, ref_count=0))
+    db.session.commit()
+
+    collect_garbage(min_age=3600)
+    assert os.path.exists(blob_path(digest) + PURGED_SUFFIX)
+    collect_garbage(min_age=-1)
+    assert not os.path.exists(blob_path(digest) + PURGED_SUFFIX)
+
+def test_letters_share_and_release_blobs(client, project):
+    assert post_letter(client, project).status_code == 302
+    assert post_letter(client, project, is_incoming=False).status_code == 302
+    digests = {letter.file_hash for letter in Letter.query}
+    assert len(digests) == 1
+    digest = digests.pop()
+    assert ref_count(digest) == 2
+
+    for letter in Letter.query.all():
+        assert client.post(f'/letters/{letter.id}/delete').status_code == 302
+    assert Letter.query.count() == 0
+    assert ref_count(digest) in (0, None)
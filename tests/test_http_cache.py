@@ -0,0 +1,58 @@
+from app.models import Letter
+from app.utils.notifications import create_notification
+from conftest import PDF, post_letter
+
+def revalidate(client, url, etag):
+    return client.get(url, headers={'If-None-Match': etag})
+
+def test_notifications_answer_304_until_they_change(client):
+    first = client.get('/api/notifications')
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and first.get_json()['unreadCount'] == 0
+    assert 'no-cache' in first.headers['Cache-Control']
+
+    unchanged = revalidate(client, '/api/notifications', etag)
+    assert unchanged.status_code == 304 and unchanged.data == b''
+
+    create_notification('Hello', 'A new notification', user_id=1)
+    changed = revalidate(client, '/api/notifications', etag)
+    assert changed.status_code == 200 and changed.get_json()['unreadCount'] == 1
+    assert changed.headers['ETag'] != etag
+
+    notification_id = changed.get_json()['notifications'][0]['id']
+    client.post(f'/api/notifications/{notification_id}/read')
+    assert revalidate(client, '/api/notifications', changed.headers['ETag']).status_code == 200
+
+def test_users_answer_304_until_a_user_changes(client):
+    first = client.get('/api/users')
+    etag = first.headers['ETag']
+    assert revalidate(client, '/api/users', etag).status_code == 304
+
+    response = client.post('/api/users', json={'username': 'clerk', 'email': 'clerk@example.com',
+                                                'password': 'secret123', 'project_id': 1})
+    assert response.get_json()['success']
+    changed = revalidate(client, '/api/users', etag)
+    assert changed.status_code == 200
+    assert 'clerk' in [user['username'] for user in changed.get_json()['users']]
+
+def test_letter_download_uses_the_content_hash(client, project):
+    assert post_letter(client, project).status_code == 302
+    letter = Letter.query.one()
+
+    response = client.get(f'/letters/download/{letter.id}')
+    assert response.status_code == 200 and response.data == PDF
+    assert letter.file_hash in response.headers['ETag']
+    assert revalidate(client, f'/letters/download/{letter.id}', response.headers['ETag']).status_code == 304
+
+def test_stream_sees_notifications_from_other_processes(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'NOTIFICATION_STREAM_ENABLED', True)
+    monkeypatch.setattr('app.utils.notification_events.WATCH_INTERVAL', 0.1)
+    events = client.get('/api/notifications/stream').response
+    assert next(events).startswith(b'retry:')
+    assert b'"unreadCount": 0' in next(events)
+
+    # Written the way another worker would: nothing in this process is told
+    monkeypatch.setattr('app.utils.notifications.publish', lambda user_ids: 0)
+    create_notification('Hello', 'From another worker', user_id=1)
+    assert b'"unreadCount": 1' in next(events)
+    events.close()
@@ -0,0 +1,87 @@
+from datetime import datetime
+
+import pytest
+
+from app import db
+from app.models import Letter
+from app.models.letter_sequence import LetterSequence
+from app.models.number_reservation import NumberReservation
+from app.utils.numbering import (
+    HO_SCOPE, MAX_NUMBER, SequenceExhaustedError, allocate, advance_to, allocate_letter_numbers,
+    claim_reservation, format_number, project_scope, reserve_letter_numbers
+)
+from conftest import make_letter, post_letter
+
+YEAR = datetime.now().year
+
+def sequence_value(scope, is_incoming, year=YEAR):
+    sequence = LetterSequence.query.get((scope, is_incoming, year))
+    return sequence.last_value if sequence else None
+
+def test_allocate_takes_consecutive_values(app):
+    assert allocate(HO_SCOPE, True, YEAR) == [1]
+    assert allocate(HO_SCOPE, True, YEAR, count=3) == [2, 3, 4]
+    # Each type and year has its own sequence
+    assert allocate(HO_SCOPE, False, YEAR) == [1]
+    assert allocate(HO_SCOPE, True, YEAR + 1) == [1]
+
+def test_new_sequence_is_seeded_from_existing_letters(app, project):
+    make_letter(project, 7)
+    assert allocate_letter_numbers(project.id, True, 2025) == ('0008', '0008')
+
+def test_advance_to_never_moves_back(app):
+    allocate(HO_SCOPE, True, YEAR, count=5)
+    advance_to(HO_SCOPE, True, YEAR, 3)
+    assert sequence_value(HO_SCOPE, True) == 5
+    advance_to(HO_SCOPE, True, YEAR, 9)
+    assert sequence_value(HO_SCOPE, True) == 9
+
+def test_format_number_does_not_wrap():
+    assert format_number(1) == '0001'
+    assert format_number(MAX_NUMBER) == '9999'
+    with pytest.raises(SequenceExhaustedError):
+        format_number(MAX_NUMBER + 1)
+
+def test_exhausted_sequence_raises(app):
+    advance_to(HO_SCOPE, True, YEAR, MAX_NUMBER)
+    with pytest.raises(SequenceExhaustedError):
+        allocate(HO_SCOPE, True, YEAR)
+
+def test_reservation_is_reused_and_claimed(app, project):
+    first = reserve_letter_numbers(1, project.id, True)
+    second = reserve_letter_numbers(1, project.id, True)
+    assert (first.ho_number, first.project_number) == (second.ho_number, second.project_number)
+    assert sequence_value(HO_SCOPE, True) == 1
+
+    assert not claim_reservation(1, project.id, True, '0002', first.project_number)
+    assert claim_reservation(1, project.id, True, first.ho_number, first.project_number)
+    db.session.commit()
+    assert NumberReservation.query.count() == 0
+
+def test_create_letter_uses_reserved_numbers(client, project):
+    numbers = client.post('/letters/generate_numbers', data={'is_incoming': '1', 'project_id': project.id}).get_json()
+    assert numbers['reserved_until']
+
+    response = post_letter(client, project, ho_number=numbers['ho_number'], project_number=numbers['project_number'])
+    assert response.status_code == 302
+    letter = Letter.query.one()
+    assert (letter.ho_number, letter.project_number) == (numbers['ho_number'], numbers['project_number'])
+    assert sequence_value(HO_SCOPE, True) == 1
+
+def test_generate_numbers_get_does_not_reserve(client, project):
+    preview = client.get(f'/letters/generate_numbers?is_incoming=1&project_id={project.id}').get_json()
+    assert preview == client.get(f'/letters/generate_numbers?is_incoming=1&project_id={project.id}').get_json()
+    assert (preview['ho_number'], preview['reserved_until']) == ('0001', None)
+    assert NumberReservation.query.count() == 0
+    assert sequence_value(HO_SCOPE, True) is None
+
+def test_hand_entered_numbers_move_the_sequences(client, project):
+    assert post_letter(client, project, ho_number='40', project_number='12').status_code == 302
+    assert sequence_value(HO_SCOPE, True) == 40
+    assert sequence_value(project_scope(project.id), True) == 12
+
+def test_out_of_range_hand_entered_numbers_are_rejected(client, project):
+    response = post_letter(client, project, ho_number='12345', project_number='1')
+    assert response.status_code == 302 and '/letters/create' in response.headers['Location']
+    assert Letter.query.count() == 0
+    assert sequence_value(HO_SCOPE, True) is None
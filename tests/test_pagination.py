@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from app.models import Letter
+from app.utils.pagination import (
+    decode_cursor, decode_rank_cursor, encode_cursor, encode_rank_cursor, get_page_size, keyset_paginate
+)
+from conftest import make_letter
+
+def walk(page_of, first_page):
+    """Follow next cursors from first_page; returns the list of pages of ids"""
+    pages = [first_page]
+    while pages[-1].has_next:
+        pages.append(page_of(after=pages[-1].next_cursor))
+    return pages
+
+def test_cursors_round_trip():
+    position = (datetime(2025, 3, 1, 12, 30), 42)
+    assert decode_cursor(encode_cursor(*position)) == position
+    assert decode_rank_cursor(encode_rank_cursor(-1.2345678901234567, 7)) == (-1.2345678901234567, 7)
+
+def test_malformed_cursors_are_ignored():
+    for cursor in (None, '', 'not-a-cursor', '!!!', encode_rank_cursor(1.5, 3)):
+        assert decode_cursor(cursor) is None
+
+def test_page_size_is_clamped():
+    assert get_page_size(None) == 50
+    assert get_page_size('0') == 1
+    assert get_page_size('5000') == 200
+    assert get_page_size('abc', default=10) == 10
+
+def test_keyset_walks_every_row_once_newest_first(app, project):
+    # Several letters share a date, so the id breaks ties
+    for number in range(1, 12):
+        make_letter(project, number, date=datetime(2025, 1, 1 + number // 3))
+    expected = [letter.id for letter in Letter.query.order_by(Letter.date.desc(), Letter.id.desc())]
+
+    def page_of(after=None, before=None):
+        return keyset_paginate(Letter.query, Letter.date, Letter.id, after=after, before=before, page_size=4)
+
+    pages = walk(page_of, page_of())
+    assert [letter.id for page in pages for letter in page.items] == expected
+    assert [len(page.items) for page in pages] == [4, 4, 3]
+    assert not pages[0].has_prev and pages[-1].has_prev
+
+    # Going back from the last page gives the page before it
+    back = page_of(before=pages[-1].prev_cursor)
+    assert [letter.id for letter in back.items] == [letter.id for letter in pages[1].items]
+    assert back.has_next and back.has_prev
+
+def test_keyset_empty_query(app):
+    page = keyset_paginate(Letter.query, Letter.date, Letter.id)
+    assert page.items == [] and not page.has_next and not page.has_prev
@@ -0,0 +1,71 @@
+import pytest
+
+from app import db
+from app.models import Letter
+from app.utils.pagination import rank_paginate
+from app.utils.search import apply_letter_search, build_match_expression, fts_available
+from conftest import make_letter
+
+@pytest.fixture
+def fts(app):
+    if not fts_available():
+        pytest.skip('SQLite was built without FTS5')
+
+def test_build_match_expression():
+    assert build_match_expression('road works') == '"road" "works"*'
+    assert build_match_expression('"*(') is None
+
+def test_full_text_search_ranks_and_prefix_matches(fts, project):
+    once = make_letter(project, 1, object_of='bridge inspection')
+    twice = make_letter(project, 2, object_of='bridge bridge repairs')
+    make_letter(project, 3, object_of='road survey')
+
+    query, rank = apply_letter_search(Letter.query, 'brid')
+    assert rank is not None
+    assert [letter.id for letter in query] == [twice.id, once.id]
+
+def test_search_follows_updates(fts, project):
+    letter = make_letter(project, 1, object_of='bridge inspection')
+    letter.object_of = 'tunnel inspection'
+    db.session.commit()
+
+    assert apply_letter_search(Letter.query, 'bridge')[0].count() == 0
+    assert [found.id for found in apply_letter_search(Letter.query, 'tunnel')[0]] == [letter.id]
+
+def test_ranked_results_are_paginated(fts, project):
+    for number in range(1, 8):
+        make_letter(project, number, object_of='culvert ' * (number % 3 + 1))
+    query, rank = apply_letter_search(Letter.query, 'culvert')
+    best_first = [letter.id for letter in query]
+
+    ids = []
+    page = rank_paginate(query, rank, Letter.id, page_size=3)
+    pages = [page]
+    while page.has_next:
+        page = rank_paginate(query, rank, Letter.id, after=page.next_cursor, page_size=3)
+        pages.append(page)
+    for page in pages:
+        ids += [letter.id for letter in page.items]
+    assert ids == best_first
+    assert len(pages) == 3
+
+    back = rank_paginate(query, rank, Letter.id, before=pages[-1].prev_cursor, page_size=3)
+    assert [letter.id for letter in back.items] == [letter.id for letter in pages[1].items]
+
+def test_search_without_fts_falls_back_to_like(app, project, monkeypatch):
+    monkeypatch.setattr('app.utils.search.fts_available', lambda: False)
+    letter = make_letter(project, 1, object_of='Bridge inspection')
+    query, rank = apply_letter_search(Letter.query, 'bridge')
+    assert rank is None
+    assert [found.id for found in query] == [letter.id]
+
+def test_letters_list_pages_through_search_results(fts, client, project):
+    for number in range(1, 6):
+        make_letter(project, number, object_of='viaduct')
+    url = '/letters/?format=json&search=viaduct&per_page=2'
+    ids = []
+    while url:
+        data = client.get(url).get_json()
+        ids += [letter['id'] for letter in data['letters']]
+        url = data['next_url']
+    assert sorted(ids) == sorted(letter.id for letter in Letter.query)